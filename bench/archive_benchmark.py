@@ -0,0 +1,267 @@
+"""メッセージ履歴の保存形式（txt と圧縮アーカイブ）を比較するベンチマーク
+
+代替サーバーの合成データから1ルーム分のメッセージを作り、get_room_messages の差分保存と同じように
+--batch 件ずつ保存した場合の、次の値を比較します。
+
+- ディスク使用量: txt は room_*/YYYYMMDD/HHMM_diff.txt の合計、圧縮アーカイブはデータとインデックスの合計
+- 期間指定の読み出し: 指定した時間幅のメッセージを読む時間
+  txt は保存日のディレクトリで絞り込んだうえでファイルを読んで解析し、圧縮アーカイブは
+  インデックスで選んだブロックだけを展開します（展開したブロック数も表示）
+
+計測の前に、追記の途中（インデックスの書き込みの前後）で終了した場合にアーカイブが壊れず、
+次の追記で元に戻ること、追記と並行して読み出してもエラーにならないことを確認します。
+
+    python bench/archive_benchmark.py
+    python bench/archive_benchmark.py --messages 200000 --batch 20 --range-hours 6
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_chatwork_server import FakeChatWork, FakeServerConfig  # noqa: E402
+
+import chatwork_mcp  # noqa: E402
+
+
+def build_messages(messages: int, accounts: int, interval: int) -> List[Dict[str, Any]]:
+    """送信日時を interval 秒ずつずらしたメッセージを作ります"""
+    state = FakeChatWork(FakeServerConfig(rooms=1, messages_per_room=messages, tasks_per_room=0, accounts=accounts))
+    room_messages = state.messages(next(iter(state.rooms)))
+    start = int(time.time()) - interval * len(room_messages)
+    return [dict(message, send_time=start + i * interval, update_time=0) for i, message in enumerate(room_messages)]
+
+
+def write_txt_tree(base_dir: Path, messages: List[Dict[str, Any]], batch: int) -> None:
+    """差分保存と同じく、batch 件ごとに最後のメッセージの送信時刻のファイルへ書き出します"""
+    room_dir = base_dir / "room_1"
+    for start in range(0, len(messages), batch):
+        records = [chatwork_mcp.MessageRecord.from_api(message) for message in messages[start:start + batch]]
+        saved_at = datetime.fromtimestamp(records[-1].send_time)
+        save_file = room_dir / saved_at.strftime("%Y%m%d") / f"{saved_at.strftime('%H%M')}_diff.txt"
+        chatwork_mcp._write_message_file(save_file, records, True)
+
+
+def read_txt_range(base_dir: Path, since: int, until: int) -> List[Any]:
+    """txt の保存先から期間内のメッセージを読みます（期間より前の日付のディレクトリは読まない）"""
+    first_day = datetime.fromtimestamp(since).strftime("%Y%m%d")
+    results = []
+    for day_dir in sorted((base_dir / "room_1").iterdir()):
+        if not day_dir.is_dir() or day_dir.name < first_day:
+            continue
+        for txt_file in sorted(day_dir.glob("*.txt")):
+            for send_time, text in chatwork_mcp._parse_message_file(txt_file.read_text(encoding="utf-8")):
+                if since <= send_time < until:
+                    results.append((send_time, text))
+    return results
+
+
+class _SimulatedCrash(Exception):
+    pass
+
+
+def verify_crash_safety(work_dir: Path, messages: List[Dict[str, Any]]) -> int:
+    """末尾のブロックをまとめ直す追記を、インデックスの各書き込みの前後で中断しても壊れないことを確認します
+
+    ブロックあたり4件のアーカイブに2件を保存した後、複数のブロックにまたがる10件の追記を中断し、
+    読み出しができること、保存済みのメッセージが失われないこと、同じ追記のやり直しで
+    全件がちょうど1回ずつ読めることを確認します。
+
+    Returns:
+        int: 確認した中断箇所の数
+    """
+    first, second = messages[:2], messages[2:12]
+    original = chatwork_mcp.MessageArchive._write_index_entries
+    checked = 0
+    for crash_at in range(4):  # (書き込みの回数, 書き込みの前か後か) の組み合わせ
+        call_number, after = divmod(crash_at, 2)
+        calls = []
+
+        def crashing(self: Any, index_file: Any, start: int, blocks: List[Any]) -> None:
+            calls.append(start)
+            if len(calls) - 1 == call_number and not after:
+                raise _SimulatedCrash()
+            original(self, index_file, start, blocks)
+            if len(calls) - 1 == call_number and after:
+                raise _SimulatedCrash()
+
+        archive = chatwork_mcp.MessageArchive(work_dir / f"crash_{crash_at}" / chatwork_mcp.ARCHIVE_FILENAME, 4)
+        archive.append(first)
+        chatwork_mcp.MessageArchive._write_index_entries = crashing
+        try:
+            archive.append(second)
+        except _SimulatedCrash:
+            checked += 1
+        finally:
+            chatwork_mcp.MessageArchive._write_index_entries = original
+
+        stored = {message["message_id"] for message in archive.query()[0]}
+        if not {message["message_id"] for message in first} <= stored:
+            raise AssertionError(f"中断箇所 {crash_at}: 保存済みのメッセージが失われました")
+        archive.append(second)
+        recovered = [message["message_id"] for message in archive.query()[0]]
+        if sorted(recovered) != sorted(message["message_id"] for message in first + second):
+            raise AssertionError(f"中断箇所 {crash_at}: やり直し後のメッセージが一致しません")
+    if checked != 4:
+        raise AssertionError(f"中断を再現できたのは {checked} 箇所だけです")
+    return checked
+
+
+def verify_concurrent_reads(work_dir: Path, messages: List[Dict[str, Any]], readers: int = 2) -> int:
+    """1つのスレッドで少しずつ追記しながら、他のスレッドで読み出してもエラーにならないことを確認します
+
+    Returns:
+        int: 追記と並行して行った読み出しの回数
+    """
+    archive = chatwork_mcp.MessageArchive(work_dir / "concurrent" / chatwork_mcp.ARCHIVE_FILENAME, 64)
+    archive.append(messages[:20])
+    done = threading.Event()
+    errors: List[str] = []
+    reads = [0] * readers
+
+    def write() -> None:
+        try:
+            for start in range(20, len(messages), 7):
+                archive.append(messages[start:start + 7])
+        finally:
+            done.set()
+
+    def read(number: int) -> None:
+        while not done.is_set():
+            try:
+                archive.query(limit=50)
+            except Exception as e:
+                errors.append(repr(e))
+            reads[number] += 1
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise AssertionError(f"追記と並行した読み出しが {len(errors)} 回失敗しました: {errors[0]}")
+    if len(archive.query()[0]) != len(messages):
+        raise AssertionError("追記と並行した読み出しの後、メッセージ数が一致しません")
+    return sum(reads)
+
+
+def _tree_bytes(path: Path, suffix: str) -> int:
+    return sum(file.stat().st_size for file in path.rglob(f"*{suffix}") if file.is_file())
+
+
+def _best_of(repeat: int, func: Any) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    messages = build_messages(args.messages, args.accounts, args.interval)
+    work_dir = Path(tempfile.mkdtemp(prefix="chatwork_archive_bench_"))
+    try:
+        crash_points = verify_crash_safety(work_dir / "crash", messages)
+        concurrent_reads = verify_concurrent_reads(work_dir / "concurrent", messages[:2000])
+
+        started = time.perf_counter()
+        write_txt_tree(work_dir / "txt", messages, args.batch)
+        txt_write_s = time.perf_counter() - started
+
+        archive = chatwork_mcp.MessageArchive(work_dir / "archive" / "room_1" / chatwork_mcp.ARCHIVE_FILENAME, args.block_messages)
+        started = time.perf_counter()
+        for start in range(0, len(messages), args.batch):
+            archive.append(messages[start:start + args.batch])
+        archive_write_s = time.perf_counter() - started
+
+        rng = random.Random(0)
+        span = args.range_hours * 3600
+        first, last = messages[0]["send_time"], messages[-1]["send_time"]
+        ranges = [(since, since + span) for since in (rng.randint(first, max(first, last - span)) for _ in range(args.queries))]
+
+        blocks_read = []
+
+        def archive_queries() -> None:
+            blocks_read.clear()
+            for since, until in ranges:
+                _, read = archive.query(since, until)
+                blocks_read.append(read)
+
+        def txt_queries() -> None:
+            for since, until in ranges:
+                read_txt_range(work_dir / "txt", since, until)
+
+        # 両方の形式で同じ件数が読めることを確認する
+        for since, until in ranges:
+            if len(archive.query(since, until)[0]) != len(read_txt_range(work_dir / "txt", since, until)):
+                raise AssertionError(f"期間 {since}〜{until} の件数が一致しません")
+
+        return {
+            "messages": len(messages),
+            "batch": args.batch,
+            "txt_files": sum(1 for _ in (work_dir / "txt").rglob("*.txt")),
+            "txt_bytes": _tree_bytes(work_dir / "txt", ".txt"),
+            "archive_bytes": archive.size,
+            "archive_blocks": len(archive.blocks()),
+            "txt_write_s": txt_write_s,
+            "archive_write_s": archive_write_s,
+            "range_hours": args.range_hours,
+            "txt_query_ms": _best_of(args.repeat, txt_queries) / len(ranges) * 1000,
+            "archive_query_ms": _best_of(args.repeat, archive_queries) / len(ranges) * 1000,
+            "archive_blocks_read": sum(blocks_read) / len(blocks_read),
+            "crash_points_checked": crash_points,
+            "concurrent_reads_checked": concurrent_reads
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="メッセージ履歴の保存形式のベンチマーク")
+    parser.add_argument("--messages", type=int, default=50000, help="保存するメッセージ数")
+    parser.add_argument("--accounts", type=int, default=200, help="投稿者のアカウント数")
+    parser.add_argument("--interval", type=int, default=60, help="メッセージの送信間隔（秒）")
+    parser.add_argument("--batch", type=int, default=20, help="1回の保存（差分取得）に含めるメッセージ数")
+    parser.add_argument("--block-messages", type=int, default=chatwork_mcp.ARCHIVE_BLOCK_MESSAGES, help="圧縮アーカイブの1ブロックのメッセージ数")
+    parser.add_argument("--range-hours", type=float, default=2.0, help="期間指定の読み出しの時間幅（時間）")
+    parser.add_argument("--queries", type=int, default=20, help="期間指定の読み出しの回数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数（最小値を採用）")
+    parser.add_argument("--json", help="結果をJSONで保存するファイルのパス")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    result = run(args)
+    print(f"messages: {result['messages']} (batch {result['batch']})")
+    print(f"{'':<20}{'txt':>14}{'compressed':>14}{'ratio':>8}")
+    print(f"{'disk bytes':<20}{result['txt_bytes']:>14}{result['archive_bytes']:>14}{result['archive_bytes'] / result['txt_bytes']:>8.1%}")
+    print(f"{'write s (total)':<20}{result['txt_write_s']:>14.2f}{result['archive_write_s']:>14.2f}")
+    print(
+        f"{'range read ms':<20}{result['txt_query_ms']:>14.2f}{result['archive_query_ms']:>14.2f}"
+        f"{result['archive_query_ms'] / result['txt_query_ms']:>8.1%}"
+    )
+    print(f"txt files: {result['txt_files']}, archive blocks: {result['archive_blocks']}, "
+          f"blocks read per {result['range_hours']}h range: {result['archive_blocks_read']:.1f}")
+    print(f"crash safety: {result['crash_points_checked']} interrupted appends recovered, "
+          f"{result['concurrent_reads_checked']} reads during appends")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
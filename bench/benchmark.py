@@ -0,0 +1,281 @@
+"""chatwork_mcp.py の各ツールのレイテンシ・スループットを計測するベンチマーク
+
+ローカルの代替サーバー（fake_chatwork_server.py）に向けて各MCPツールを
+指定した同時実行数で呼び出し、p50/p99レイテンシ、スループット、
+論理操作1回あたりに消費したAPIリクエスト数を表示します。
+
+    python bench/benchmark.py --concurrency 1,8,32 --operations 200 --latency 0.02
+    python bench/benchmark.py --tools get_rooms,get_room_task --json before.json
+    python bench/benchmark.py --tools get_room_task --profiles 4 --client-rate-limit 300 --server-rate-limit 300
+
+--base-url を省略した場合は、代替サーバーを同じプロセス内で起動します。
+サーバー側の処理時間が計測に混ざらないようにしたい場合は、別プロセスで
+fake_chatwork_server.py を起動して --base-url を指定してください。
+変更の前後で --json の出力を保存しておくと、結果を比較できます。
+--profiles に2以上を指定すると、その数のAPIトークン（プロファイル）を設定し、
+論理操作を順に振り分けます（レート制限はトークンごとに数えられます）。
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_chatwork_server import FakeServerConfig, start_fake_server  # noqa: E402
+
+# 論理操作1回分の呼び出し（引数は通し番号）
+Operation = Callable[[int], Awaitable[Any]]
+
+# 一括操作のベンチマークで1回に含める件数
+BATCH_SIZE = 10
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    """昇順に並んだ値の百分位数（nearest-rank法）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class FakeServerStats:
+    """代替サーバーが受信したリクエスト数を取得します"""
+
+    def __init__(self, base_url: str):
+        self._root = base_url.rsplit("/v2", 1)[0]
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def reset(self) -> None:
+        session = await self._get_session()
+        async with session.post(f"{self._root}/_fake/reset") as response:
+            response.raise_for_status()
+
+    async def get(self) -> Dict[str, Any]:
+        session = await self._get_session()
+        async with session.get(f"{self._root}/_fake/stats") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+async def _run_operations(operation: Operation, operations: int, concurrency: int) -> Dict[str, Any]:
+    """operationを指定した同時実行数でoperations回実行し、各回の所要時間を集計します"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(operations))
+
+    async def worker() -> None:
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                await operation(index)
+            except Exception as e:
+                key = f"{type(e).__name__}: {e}"[:120]
+                errors[key] = errors.get(key, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, operations))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "operations": operations,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": operations / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000
+    }
+
+
+def _profile_name(number: int) -> str:
+    return f"bench{number}"
+
+
+async def _build_operations(cw: Any, save_dir: str, profiles: int) -> Dict[str, Operation]:
+    """ベンチマーク対象のツールごとに、論理操作1回分の呼び出しを組み立てます"""
+    rooms = await cw.get_rooms()
+    room_ids = [room["room_id"] for room in rooms]
+    message_refs = []
+    task_refs = []
+    for room_id in room_ids[:5]:
+        messages = await cw._request_api("GET", f"/rooms/{room_id}/messages", params={"force": 1}) or []
+        message_refs.extend((room_id, int(message["message_id"])) for message in messages[-20:])
+        tasks = await cw.get_room_tasks(room_id) or []
+        task_refs.extend((room_id, task["task_id"]) for task in tasks)
+    if not message_refs or not task_refs:
+        raise RuntimeError("代替サーバーにメッセージまたはタスクがありません（--messages-per-room / --tasks-per-room を確認してください）")
+
+    # ローカルストアを使うツールのために、全ルームを一度同期しておく
+    await cw.sync_room_messages(save_dir, force=1)
+
+    def room(index: int) -> int:
+        return room_ids[index % len(room_ids)]
+
+    def task(index: int) -> Any:
+        return task_refs[index % len(task_refs)]
+
+    def status(index: int) -> str:
+        return "done" if (index // len(task_refs)) % 2 == 0 else "open"
+
+    def profile(index: int) -> Optional[str]:
+        return _profile_name(index % profiles + 1) if profiles > 1 else None
+
+    return {
+        "get_rooms": lambda i: cw.get_rooms(profile=profile(i)),
+        "get_room_messages": lambda i: cw.get_room_messages(room(i), save_dir, profile=profile(i)),
+        "get_room_message": lambda i: cw.get_room_message(*message_refs[i % len(message_refs)], profile=profile(i)),
+        "get_room_tasks": lambda i: cw.get_room_tasks(room(i), profile=profile(i)),
+        "get_my_tasks": lambda i: cw.get_my_tasks(profile=profile(i)),
+        "get_room_task": lambda i: cw.get_room_task(*task(i), profile=profile(i)),
+        "post_room_messages": lambda i: cw.post_room_messages(room(i), f"ベンチマーク投稿 {i}", profile=profile(i)),
+        "post_room_tasks": lambda i: cw.post_room_tasks(room(i), f"ベンチマークタスク {i}", [1], profile=profile(i)),
+        "put_room_task_status": lambda i: cw.put_room_task_status(*task(i), status=status(i), profile=profile(i)),
+        "post_room_tasks_batch": lambda i: cw.post_room_tasks_batch([
+            {"room_id": room(i * BATCH_SIZE + j), "body": f"一括タスク {i}-{j}", "to_ids": [1], "profile": profile(j)}
+            for j in range(BATCH_SIZE)
+        ]),
+        "put_room_task_status_batch": lambda i: cw.put_room_task_status_batch([
+            {"room_id": task(i * BATCH_SIZE + j)[0], "task_id": task(i * BATCH_SIZE + j)[1], "status": status(i),
+             "profile": profile(j)}
+            for j in range(BATCH_SIZE)
+        ]),
+        "sync_room_messages": lambda i: cw.sync_room_messages(save_dir, profile=profile(i)),
+        "get_stored_messages": lambda i: cw.get_stored_messages(room(i), save_dir),
+        "search_messages": lambda i: cw.search_messages(["議事録", "リリース", "deploy", "確認"][i % 4], save_dir),
+        "get_unread_summary": lambda i: cw.get_unread_summary(profile=profile(i)),
+        "query_tasks": lambda i: cw.query_tasks(due=["overdue", "due_soon", "all"][i % 3], profile=profile(i)),
+    }
+
+
+def _print_report(results: List[Dict[str, Any]]) -> None:
+    header = f"{'tool':<28}{'conc':>5}{'ops':>7}{'err':>5}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'req/op':>8}{'429':>6}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['tool']:<28}{result['concurrency']:>5}{result['operations']:>7}"
+            f"{result['operations'] - result['succeeded']:>5}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            f"{result['throughput']:>10.1f}{result['requests_per_operation']:>8.2f}{result['throttled']:>6}"
+        )
+    for result in results:
+        for message, count in result["errors"].items():
+            print(f"  {result['tool']} (concurrency={result['concurrency']}): {count}件失敗 {message}")
+
+
+async def run_benchmark(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    runner = None
+    base_url = args.base_url
+    if base_url is None:
+        runner, base_url = await start_fake_server(FakeServerConfig(
+            rooms=args.rooms,
+            messages_per_room=args.messages_per_room,
+            tasks_per_room=args.tasks_per_room,
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            rate_limit=args.server_rate_limit,
+            error_rate_429=args.error_rate_429,
+            retry_after=args.retry_after
+        ))
+
+    # chatwork_mcp は読み込み時に環境変数を参照するため、設定してから読み込む
+    os.environ["CHATWORK_API_BASE_URL"] = base_url
+    os.environ.setdefault("CHATWORK_API_TOKEN", "benchmark-token")
+    os.environ["CHATWORK_RATE_LIMIT_REQUESTS"] = str(args.client_rate_limit)
+    os.environ.setdefault("CHATWORK_RATE_LIMIT_RETRY_BASE_DELAY", "0.05")
+    if args.profiles > 1:
+        for number in range(1, args.profiles + 1):
+            os.environ[f"CHATWORK_API_TOKEN_{_profile_name(number).upper()}"] = f"benchmark-token-{number}"
+    import chatwork_mcp as cw
+
+    stats = FakeServerStats(base_url)
+    save_dir = tempfile.mkdtemp(prefix="chatwork_bench_")
+    results = []
+    try:
+        operations = await _build_operations(cw, save_dir, args.profiles)
+        tools = args.tools.split(",") if args.tools else list(operations)
+        unknown = [tool for tool in tools if tool not in operations]
+        if unknown:
+            raise SystemExit(f"不明なツールです: {', '.join(unknown)}（指定できるツール: {', '.join(operations)}）")
+
+        for tool in tools:
+            for concurrency in (int(value) for value in args.concurrency.split(",")):
+                # 計測ごとにキャッシュを空にし、同じ条件から始める
+                cw._response_cache.clear()
+                await stats.reset()
+                result = await _run_operations(operations[tool], args.operations, concurrency)
+                server = await stats.get()
+                result.update({
+                    "tool": tool,
+                    "concurrency": concurrency,
+                    "requests": server["requests"],
+                    "requests_per_operation": server["requests"] / args.operations,
+                    "throttled": server["throttled"],
+                    "requests_by_route": server["by_route"]
+                })
+                results.append(result)
+    finally:
+        await stats.close()
+        await cw._close_http_session()
+        cw._close_message_stores()
+        shutil.rmtree(save_dir, ignore_errors=True)
+        if runner is not None:
+            await runner.cleanup()
+    return results
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="chatwork_mcp.py のツール単位のベンチマーク")
+    parser.add_argument("--base-url", help="起動済みの代替サーバーのURL（例: http://127.0.0.1:8765/v2）。省略時はプロセス内で起動")
+    parser.add_argument("--tools", help="計測するツール名（カンマ区切り）。省略時はすべて")
+    parser.add_argument("--concurrency", default="1,8,32", help="同時実行数（カンマ区切り）")
+    parser.add_argument("--operations", type=int, default=100, help="同時実行数ごとの論理操作の回数")
+    parser.add_argument("--rooms", type=int, default=20, help="合成するルーム数")
+    parser.add_argument("--messages-per-room", type=int, default=1000, help="ルームごとのメッセージ数")
+    parser.add_argument("--tasks-per-room", type=int, default=20, help="ルームごとのタスク数")
+    parser.add_argument("--latency", type=float, default=0.01, help="代替サーバーの基本遅延（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="代替サーバーの遅延の揺らぎ（秒）")
+    parser.add_argument("--error-rate-429", type=float, default=0.0, help="代替サーバーが無条件に429を返す確率")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="429応答のRetry-After（秒）")
+    parser.add_argument("--server-rate-limit", type=int, default=0, help="代替サーバー側のレート制限（0: 制限なし）")
+    parser.add_argument("--client-rate-limit", type=int, default=1000000,
+                        help="クライアント側のレート制限（CHATWORK_RATE_LIMIT_REQUESTS）。実運用の値は300")
+    parser.add_argument("--profiles", type=int, default=1,
+                        help="論理操作を振り分けるAPIトークン（プロファイル）の数。2以上で CHATWORK_API_TOKEN_BENCH<n> を設定")
+    parser.add_argument("--json", help="結果をJSONで保存するファイルのパス")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    results = asyncio.run(run_benchmark(args))
+    _print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+"""ChatWork API v2 のローカル代替サーバー（性能計測・動作確認用）
+
+doc/ に記載したエンドポイント（ルーム・メッセージ・タスク・既読/未読）を、
+合成データを使ってメモリ上で再現します。実際のAPIトークンなしで
+chatwork_mcp.py の性能を計測するためのもので、本番での利用は想定していません。
+
+    python bench/fake_chatwork_server.py --port 8765 --rooms 50 --messages-per-room 10000 --latency 0.05
+
+起動後、CHATWORK_API_BASE_URL=http://127.0.0.1:8765/v2 を指定してサーバーを実行すると、
+すべてのリクエストがこのサーバーに向きます（CHATWORK_API_TOKEN は任意の値で構いません）。
+
+計測用に、API以外に次のエンドポイントを用意しています（リクエスト数には含みません）。
+    GET  /_fake/stats   受信したリクエスト数（ルート別・429応答数を含む）
+    POST /_fake/reset   リクエスト数とレート制限のカウンタを初期化
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# 1回のメッセージ一覧取得で返す最大件数（ChatWork APIの仕様）
+MESSAGES_PAGE_SIZE = 100
+
+MY_ACCOUNT_ID = 1
+
+_SAMPLE_BODIES = [
+    "お疲れさまです。本日の定例の議事録を共有します。",
+    "[To:{to}]{name}さん\n資料の確認をお願いします。",
+    "[info][title]リリース予定[/title]来週水曜日にリリース予定です。[/info]",
+    "[rp aid={to} to={room}-{reply}]{name}さん\n承知しました、対応します。",
+    "[qt][qtmeta aid={to} time=1700000000]前回の件ですが[/qt]こちらは完了しています。",
+    "[code]SELECT * FROM messages WHERE room_id = 1;[/code]このクエリが遅いようです。",
+    "The deploy pipeline finished without errors.",
+    "[toall]明日は全社会議のため、午後の予定を空けておいてください。",
+]
+
+
+class FakeServerConfig:
+    """代替サーバーの動作設定
+
+    Args:
+        rooms: 合成するルーム数
+        messages_per_room: ルームごとのメッセージ数
+        tasks_per_room: ルームごとのタスク数
+        accounts: 合成するアカウント数
+        latency: 各レスポンスの基本遅延（秒）
+        latency_jitter: 基本遅延に加える揺らぎの上限（秒）
+        slow_rate: 応答が止まったように遅くなる確率（0〜1、レイテンシの裾の再現用）
+        slow_latency: slow_rate で選ばれたレスポンスに加える遅延（秒）
+        rate_limit: APIトークンごとの期間あたりのリクエスト上限（0の場合は制限しない）
+        rate_limit_period: レート制限の期間（秒）
+        error_rate_429: レート制限とは無関係に429を返す確率（0〜1）
+        retry_after: 429応答に付けるRetry-Afterの秒数
+        seed: 合成データの乱数シード
+    """
+
+    def __init__(
+        self,
+        rooms: int = 20,
+        messages_per_room: int = 1000,
+        tasks_per_room: int = 20,
+        accounts: int = 50,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 1.0,
+        rate_limit: int = 0,
+        rate_limit_period: float = 300.0,
+        error_rate_429: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0
+    ):
+        self.rooms = rooms
+        self.messages_per_room = messages_per_room
+        self.tasks_per_room = tasks_per_room
+        self.accounts = max(accounts, 2)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.rate_limit = rate_limit
+        self.rate_limit_period = rate_limit_period
+        self.error_rate_429 = error_rate_429
+        self.retry_after = retry_after
+        self.seed = seed
+
+
+class FakeChatWork:
+    """合成データとリクエスト統計を保持する代替サーバーの状態"""
+
+    def __init__(self, config: FakeServerConfig):
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._now = int(time.time())
+        self.accounts = [
+            {
+                "account_id": account_id,
+                "name": "自分" if account_id == MY_ACCOUNT_ID else f"ユーザー{account_id}",
+                "avatar_image_url": f"https://example.invalid/avatar/{account_id}.png"
+            }
+            for account_id in range(1, config.accounts + 1)
+        ]
+        self.rooms: Dict[int, Dict[str, Any]] = {}
+        self._messages: Dict[int, List[Dict[str, Any]]] = {}  # 初回アクセス時に生成
+        self.read_cursor: Dict[int, int] = {}  # force=0で次に返すメッセージの位置
+        self.tasks: Dict[int, Dict[str, Any]] = {}
+        self._next_message_id = 10 ** 12
+        self._next_task_id = 1
+        for index in range(config.rooms):
+            room_id = 1000 + index
+            room_type = "my" if index == 0 else ("direct" if index % 5 == 1 else "group")
+            self.rooms[room_id] = {
+                "room_id": room_id,
+                "name": "マイチャット" if room_type == "my" else f"プロジェクト{index}",
+                "type": room_type,
+                "role": "admin" if index % 3 == 0 else "member",
+                "sticky": index < 3,
+                "unread_num": self._random.randint(0, 30),
+                "mention_num": self._random.randint(0, 3),
+                "mytask_num": 0,
+                "message_num": config.messages_per_room,
+                "file_num": 0,
+                "task_num": 0,
+                "icon_path": f"https://example.invalid/icon/{room_id}.png",
+                "last_update_time": self._now - self._random.randint(0, 86400)
+            }
+            for _ in range(config.tasks_per_room):
+                self.add_task(room_id, self._random_account()["account_id"], self._random_account(),
+                              f"合成タスク{self._next_task_id}", self._random_limit(), "date")
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """リクエスト統計とレート制限のカウンタを初期化します"""
+        self.requests_total = 0
+        self.requests_by_route: Dict[str, int] = {}
+        self.throttled = 0
+        self._windows: Dict[str, Tuple[float, int]] = {}  # APIトークン → (期間の開始時刻, リクエスト数)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests_total,
+            "throttled": self.throttled,
+            "by_route": dict(self.requests_by_route)
+        }
+
+    def _random_account(self) -> Dict[str, Any]:
+        return self._random.choice(self.accounts)
+
+    def _random_limit(self) -> int:
+        # 期限切れ・期限間近・期限なしが混ざるように分布させる
+        choice = self._random.random()
+        if choice < 0.2:
+            return 0
+        return self._now + self._random.randint(-7, 30) * 86400
+
+    def _new_message_id(self) -> str:
+        self._next_message_id += 1
+        return str(self._next_message_id)
+
+    def make_message(self, room_id: int, account: Dict[str, Any], body: str, send_time: int) -> Dict[str, Any]:
+        return {
+            "message_id": self._new_message_id(),
+            "account": dict(account),
+            "body": body,
+            "send_time": send_time,
+            "update_time": 0
+        }
+
+    def messages(self, room_id: int) -> List[Dict[str, Any]]:
+        """ルームのメッセージ（古い順）を返します。大きなルームは初回アクセス時に生成します"""
+        messages = self._messages.get(room_id)
+        if messages is None:
+            rng = random.Random(self.config.seed * 7919 + room_id)
+            count = self.config.messages_per_room
+            start = self._now - count * 60
+            messages = []
+            for index in range(count):
+                account = rng.choice(self.accounts)
+                to = rng.choice(self.accounts)
+                body = rng.choice(_SAMPLE_BODIES).format(
+                    to=to["account_id"], name=to["name"], room=room_id,
+                    reply=messages[-1]["message_id"] if messages else "0"
+                )
+                messages.append(self.make_message(room_id, account, body, start + index * 60))
+            self._messages[room_id] = messages
+        return messages
+
+    def add_task(
+        self,
+        room_id: int,
+        account_id: int,
+        assigned_by: Dict[str, Any],
+        body: str,
+        limit: int,
+        limit_type: str
+    ) -> Dict[str, Any]:
+        room = self.rooms[room_id]
+        task = {
+            "task_id": self._next_task_id,
+            "account": dict(self.accounts[account_id - 1]),
+            "assigned_by_account": dict(assigned_by),
+            "message_id": self._new_message_id(),
+            "body": body,
+            "limit_time": limit,
+            "status": "open",
+            "limit_type": limit_type,
+            "room": {"room_id": room_id, "name": room["name"], "icon_path": room["icon_path"]}
+        }
+        self.tasks[task["task_id"]] = task
+        self._next_task_id += 1
+        room["task_num"] += 1
+        if account_id == MY_ACCOUNT_ID:
+            room["mytask_num"] += 1
+        return task
+
+    def room_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """ルームのタスク一覧・詳細の形式（roomを含まない）に変換します"""
+        return {key: value for key, value in task.items() if key != "room"}
+
+    def my_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """自分のタスク一覧の形式（accountを含まない）に変換します"""
+        return {key: value for key, value in task.items() if key != "account"}
+
+    def take_rate_limit(self, token: str) -> Tuple[bool, Dict[str, str]]:
+        """APIトークンのレート制限の予算を1つ消費し、許可するかどうかとレスポンスヘッダを返します
+
+        実際のAPIと同じく、レート制限はトークンごとに数えます。
+        """
+        config = self.config
+        if config.rate_limit <= 0:
+            return True, {}
+        now = time.monotonic()
+        window_started, count = self._windows.get(token, (now, 0))
+        if now - window_started >= config.rate_limit_period:
+            window_started, count = now, 0
+        reset = int(time.time() + config.rate_limit_period - (now - window_started)) + 1
+        allowed = count < config.rate_limit
+        if allowed:
+            count += 1
+        self._windows[token] = (window_started, count)
+        headers = {
+            "x-ratelimit-limit": str(config.rate_limit),
+            "x-ratelimit-remaining": str(max(config.rate_limit - count, 0)),
+            "x-ratelimit-reset": str(reset)
+        }
+        return allowed, headers
+
+
+def _json_error(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.json_response({"errors": [message]}, status=status, headers=headers)
+
+
+def _int_param(value: Optional[str]) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text='{"errors": ["Invalid parameter"]}', content_type="application/json")
+
+
+@web.middleware
+async def _fake_api_middleware(request: web.Request, handler: Any) -> web.StreamResponse:
+    """遅延・認証・レート制限・429注入をすべてのAPIリクエストに適用します"""
+    if request.path.startswith("/_fake/"):
+        return await handler(request)
+
+    state: FakeChatWork = request.app["state"]
+    config = state.config
+    route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+    route_key = f"{request.method} {route}"
+    state.requests_total += 1
+    state.requests_by_route[route_key] = state.requests_by_route.get(route_key, 0) + 1
+
+    delay = config.latency + (random.uniform(0, config.latency_jitter) if config.latency_jitter > 0 else 0.0)
+    if config.slow_rate > 0 and random.random() < config.slow_rate:
+        delay += config.slow_latency
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+    token = request.headers.get("X-ChatWorkToken")
+    if not token:
+        return _json_error(401, "Invalid API token")
+
+    allowed, headers = state.take_rate_limit(token)
+    if not allowed or (config.error_rate_429 > 0 and random.random() < config.error_rate_429):
+        state.throttled += 1
+        headers = dict(headers)
+        headers["Retry-After"] = str(config.retry_after)
+        return _json_error(429, "Rate limit exceeded", headers)
+
+    response = await handler(request)
+    response.headers.update(headers)
+    return response
+
+
+def _room_or_404(request: web.Request) -> Tuple[FakeChatWork, int]:
+    state: FakeChatWork = request.app["state"]
+    room_id = _int_param(request.match_info["room_id"])
+    if room_id not in state.rooms:
+        raise web.HTTPNotFound(text='{"errors": ["Room not found"]}', content_type="application/json")
+    return state, room_id
+
+
+async def _get_rooms(request: web.Request) -> web.Response:
+    state: FakeChatWork = request.app["state"]
+    return web.json_response(list(state.rooms.values()))
+
+
+async def _get_messages(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    messages = state.messages(room_id)
+    force = request.query.get("force", "0") == "1"
+    if force:
+        page = messages[-MESSAGES_PAGE_SIZE:]
+    else:
+        # 前回取得分以降のメッセージのみ返す（初回は最新100件）
+        cursor = state.read_cursor.get(room_id, max(len(messages) - MESSAGES_PAGE_SIZE, 0))
+        page = messages[cursor:][-MESSAGES_PAGE_SIZE:]
+    state.read_cursor[room_id] = len(messages)
+    if not page:
+        return web.Response(status=204)
+    return web.json_response(page)
+
+
+async def _post_message(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    form = await request.post()
+    body = form.get("body")
+    if not body:
+        return _json_error(400, "Parameter body is required")
+    me = state.accounts[MY_ACCOUNT_ID - 1]
+    message = state.make_message(room_id, me, str(body), int(time.time()))
+    state.messages(room_id).append(message)
+    room = state.rooms[room_id]
+    room["message_num"] += 1
+    room["last_update_time"] = message["send_time"]
+    if form.get("self_unread") == "1":
+        room["unread_num"] += 1
+    return web.json_response({"message_id": message["message_id"]})
+
+
+def _find_message(state: FakeChatWork, room_id: int, message_id: str) -> Dict[str, Any]:
+    for message in reversed(state.messages(room_id)):
+        if message["message_id"] == message_id:
+            return message
+    raise web.HTTPNotFound(text='{"errors": ["Message not found"]}', content_type="application/json")
+
+
+async def _get_message(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    return web.json_response(_find_message(state, room_id, request.match_info["message_id"]))
+
+
+async def _put_message(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    message = _find_message(state, room_id, request.match_info["message_id"])
+    if message["account"]["account_id"] != MY_ACCOUNT_ID:
+        return _json_error(403, "You don't have permission to edit this message")
+    form = await request.post()
+    if not form.get("body"):
+        return _json_error(400, "Parameter body is required")
+    message["body"] = str(form["body"])
+    message["update_time"] = int(time.time())
+    return web.json_response(message)
+
+
+async def _delete_message(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    message = _find_message(state, room_id, request.match_info["message_id"])
+    if message["account"]["account_id"] != MY_ACCOUNT_ID:
+        return _json_error(403, "You don't have permission to delete this message")
+    state.messages(room_id).remove(message)
+    state.rooms[room_id]["message_num"] -= 1
+    return web.json_response({"message_id": message["message_id"]})
+
+
+async def _put_read(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    room = state.rooms[room_id]
+    room["unread_num"] = 0
+    room["mention_num"] = 0
+    return web.json_response({"unread_num": 0, "mention_num": 0})
+
+
+async def _put_unread(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    form = await request.post()
+    message_id = form.get("message_id")
+    if not message_id:
+        return _json_error(400, "Parameter message_id is required")
+    messages = state.messages(room_id)
+    message = _find_message(state, room_id, str(message_id))
+    room = state.rooms[room_id]
+    room["unread_num"] = len(messages) - messages.index(message)
+    return web.json_response({"unread_num": room["unread_num"], "mention_num": room["mention_num"]})
+
+
+def _filter_tasks(tasks: List[Dict[str, Any]], query: Any) -> List[Dict[str, Any]]:
+    account_id = _int_param(query.get("account_id"))
+    assigned_by = _int_param(query.get("assigned_by_account_id"))
+    status = query.get("status")
+    return [
+        task for task in tasks
+        if (account_id is None or task["account"]["account_id"] == account_id)
+        and (assigned_by is None or task["assigned_by_account"]["account_id"] == assigned_by)
+        and (status is None or task["status"] == status)
+    ]
+
+
+async def _get_tasks(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    tasks = [task for task in state.tasks.values() if task["room"]["room_id"] == room_id]
+    tasks = _filter_tasks(tasks, request.query)
+    if not tasks:
+        return web.Response(status=204)
+    return web.json_response([state.room_task(task) for task in tasks])
+
+
+async def _post_tasks(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    form = await request.post()
+    body = form.get("body")
+    to_ids = [item for item in str(form.get("to_ids", "")).replace("[]", "").split(",") if item]
+    if not body or not to_ids:
+        return _json_error(400, "Parameters body and to_ids are required")
+    ids = [_int_param(item) for item in to_ids]
+    if any(account_id is None or not 1 <= account_id <= len(state.accounts) for account_id in ids):
+        return _json_error(400, "Invalid to_ids")
+    limit_type = str(form.get("limit_type", "date"))
+    limit = _int_param(form.get("limit")) or 0
+    me = state.accounts[MY_ACCOUNT_ID - 1]
+    task_ids = [
+        state.add_task(room_id, account_id, me, str(body), limit, limit_type)["task_id"]
+        for account_id in ids
+    ]
+    return web.json_response({"task_ids": task_ids})
+
+
+def _task_or_404(state: FakeChatWork, room_id: int, task_id_text: str) -> Dict[str, Any]:
+    task = state.tasks.get(_int_param(task_id_text))
+    if task is None or task["room"]["room_id"] != room_id:
+        raise web.HTTPNotFound(text='{"errors": ["Task not found"]}', content_type="application/json")
+    return task
+
+
+async def _get_task(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    return web.json_response(state.room_task(_task_or_404(state, room_id, request.match_info["task_id"])))
+
+
+async def _put_task_status(request: web.Request) -> web.Response:
+    state, room_id = _room_or_404(request)
+    task = _task_or_404(state, room_id, request.match_info["task_id"])
+    form = await request.post()
+    status = form.get("body")
+    if status not in ("open", "done"):
+        return _json_error(400, "Parameter body must be open or done")
+    task["status"] = str(status)
+    return web.json_response(state.room_task(task))
+
+
+async def _get_my_tasks(request: web.Request) -> web.Response:
+    state: FakeChatWork = request.app["state"]
+    tasks = [task for task in state.tasks.values() if task["account"]["account_id"] == MY_ACCOUNT_ID]
+    tasks = _filter_tasks(tasks, request.query)
+    if not tasks:
+        return web.Response(status=204)
+    return web.json_response([state.my_task(task) for task in tasks])
+
+
+async def _get_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app["state"].stats())
+
+
+async def _post_reset(request: web.Request) -> web.Response:
+    request.app["state"].reset_stats()
+    return web.Response(status=204)
+
+
+def create_app(config: Optional[FakeServerConfig] = None) -> web.Application:
+    """代替サーバーのアプリケーションを生成します（APIは /v2 以下に配置）"""
+    app = web.Application(middlewares=[_fake_api_middleware])
+    app["state"] = FakeChatWork(config or FakeServerConfig())
+    app.add_routes([
+        web.get("/v2/rooms", _get_rooms),
+        web.get("/v2/rooms/{room_id}/messages", _get_messages),
+        web.post("/v2/rooms/{room_id}/messages", _post_message),
+        web.put("/v2/rooms/{room_id}/messages/read", _put_read),
+        web.put("/v2/rooms/{room_id}/messages/unread", _put_unread),
+        web.get("/v2/rooms/{room_id}/messages/{message_id}", _get_message),
+        web.put("/v2/rooms/{room_id}/messages/{message_id}", _put_message),
+        web.delete("/v2/rooms/{room_id}/messages/{message_id}", _delete_message),
+        web.get("/v2/rooms/{room_id}/tasks", _get_tasks),
+        web.post("/v2/rooms/{room_id}/tasks", _post_tasks),
+        web.get("/v2/rooms/{room_id}/tasks/{task_id}", _get_task),
+        web.put("/v2/rooms/{room_id}/tasks/{task_id}/status", _put_task_status),
+        web.get("/v2/my/tasks", _get_my_tasks),
+        web.get("/_fake/stats", _get_stats),
+        web.post("/_fake/reset", _post_reset),
+    ])
+    return app
+
+
+async def start_fake_server(
+    config: Optional[FakeServerConfig] = None,
+    host: str = "127.0.0.1",
+    port: int = 0
+) -> Tuple[web.AppRunner, str]:
+    """代替サーバーを現在のイベントループ上で起動します
+
+    Returns:
+        Tuple[web.AppRunner, str]: 停止用のランナーと、CHATWORK_API_BASE_URL に指定するURL
+    """
+    runner = web.AppRunner(create_app(config), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}/v2"
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ChatWork API v2 のローカル代替サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rooms", type=int, default=20, help="合成するルーム数")
+    parser.add_argument("--messages-per-room", type=int, default=1000, help="ルームごとのメッセージ数")
+    parser.add_argument("--tasks-per-room", type=int, default=20, help="ルームごとのタスク数")
+    parser.add_argument("--accounts", type=int, default=50, help="合成するアカウント数")
+    parser.add_argument("--latency", type=float, default=0.0, help="各レスポンスの基本遅延（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="遅延に加える揺らぎの上限（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="応答を大きく遅らせる確率（0〜1）")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="遅らせる場合に加える遅延（秒）")
+    parser.add_argument("--rate-limit", type=int, default=0, help="APIトークンごとの期間あたりのリクエスト上限（0: 制限なし）")
+    parser.add_argument("--rate-limit-period", type=float, default=300.0, help="レート制限の期間（秒）")
+    parser.add_argument("--error-rate-429", type=float, default=0.0, help="無条件に429を返す確率（0〜1）")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429応答のRetry-After（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数シード")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    config = FakeServerConfig(
+        rooms=args.rooms,
+        messages_per_room=args.messages_per_room,
+        tasks_per_room=args.tasks_per_room,
+        accounts=args.accounts,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        rate_limit=args.rate_limit,
+        rate_limit_period=args.rate_limit_period,
+        error_rate_429=args.error_rate_429,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+    print(f"CHATWORK_API_BASE_URL=http://{args.host}:{args.port}/v2")
+    web.run_app(create_app(config), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
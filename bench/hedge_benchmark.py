@@ -0,0 +1,126 @@
+"""ヘッジリクエストによる get_room_message のテールレイテンシの変化を計測するベンチマーク
+
+代替サーバー（fake_chatwork_server.py）をプロセス内で起動し、一部のレスポンスだけを大きく遅らせて
+（--slow-rate, --slow-latency）レイテンシの裾を再現します。キャッシュを使わずに get_room_message を
+呼び出し、ヘッジリクエストの有無で次の値を比較します。
+
+- 所要時間のパーセンタイル（p50, p90, p99, 最大）
+- 代替サーバーが受信したリクエスト数と、ヘッジとして送った2回目の件数・先に成功した件数
+
+    python bench/hedge_benchmark.py
+    python bench/hedge_benchmark.py --operations 2000 --concurrency 8 --slow-rate 0.02 --slow-latency 2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_chatwork_server import FakeServerConfig, start_fake_server  # noqa: E402
+from benchmark import FakeServerStats  # noqa: E402
+
+os.environ.setdefault("CHATWORK_API_TOKEN", "benchmark-token")
+# レート制限の待機で計測が歪まないよう、既定では予算を十分に大きくする
+os.environ.setdefault("CHATWORK_RATE_LIMIT_REQUESTS", "100000")
+import chatwork_mcp as cw  # noqa: E402
+
+
+def _percentile(latencies: List[float], q: float) -> float:
+    return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+
+async def _run_mode(hedge: bool, message_ids: List[int], stats: FakeServerStats, args: argparse.Namespace) -> Dict[str, Any]:
+    cw.HEDGE_ENABLED = hedge
+    cw._hedge_policy = cw.HedgePolicy(
+        args.percentile, cw.HEDGE_MIN_DELAY, cw.HEDGE_MIN_SAMPLES, args.max_ratio, cw.HEDGE_RESERVED_REQUESTS
+    )
+    cw._metrics.hedges_sent = cw._metrics.hedges_won = 0
+    await stats.reset()
+    latencies: List[float] = []
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for number in range(args.operations):
+        queue.put_nowait(message_ids[number % len(message_ids)])
+
+    async def worker() -> None:
+        while not queue.empty():
+            message_id = queue.get_nowait()
+            # キャッシュに当たらないよう、毎回APIから取得する
+            cw._response_cache.clear()
+            started = time.perf_counter()
+            await cw.get_room_message(1000, message_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    server = await stats.get()
+    latencies.sort()
+    return {
+        "mode": "hedged" if hedge else "single",
+        "operations": len(latencies),
+        "elapsed_s": elapsed,
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p90_ms": _percentile(latencies, 0.9) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "requests": server["requests"],
+        "hedges_sent": cw._metrics.hedges_sent,
+        "hedges_won": cw._metrics.hedges_won
+    }
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    config = FakeServerConfig(rooms=1, messages_per_room=200, tasks_per_room=0)
+    runner, base_url = await start_fake_server(config)
+    cw.CHATWORK_API_BASE_URL = base_url
+    stats = FakeServerStats(base_url)
+    try:
+        messages = await cw._request_api("GET", "/rooms/1000/messages", params={"force": 1})
+        message_ids = [int(message["message_id"]) for message in messages]
+        # 一覧の取得後に遅延を設定し、計測対象のリクエストだけに適用する
+        config.latency = args.latency
+        config.latency_jitter = args.latency_jitter
+        config.slow_rate = args.slow_rate
+        config.slow_latency = args.slow_latency
+        return [await _run_mode(hedge, message_ids, stats, args) for hedge in (False, True)]
+    finally:
+        await stats.close()
+        await cw._close_http_session()
+        await runner.cleanup()
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ヘッジリクエストのベンチマーク")
+    parser.add_argument("--operations", type=int, default=1000, help="get_room_message の呼び出し回数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時実行数")
+    parser.add_argument("--latency", type=float, default=0.01, help="代替サーバーの基本遅延（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.01, help="基本遅延に加える揺らぎの上限（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.02, help="応答を大きく遅らせる確率（0〜1）")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="遅らせる場合に加える遅延（秒）")
+    parser.add_argument("--percentile", type=float, default=cw.HEDGE_PERCENTILE, help="2回目を送るまでの待機に使うパーセンタイル")
+    parser.add_argument("--max-ratio", type=float, default=cw.HEDGE_MAX_RATIO, help="2回目の送信数の上限の割合")
+    parser.add_argument("--json", help="結果をJSONで保存するファイルのパス")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    results = asyncio.run(run(args))
+    print(f"{'mode':<8}{'ops':>6}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'requests':>10}{'hedged':>8}{'won':>6}")
+    for result in results:
+        print(
+            f"{result['mode']:<8}{result['operations']:>6}{result['p50_ms']:>9.1f}{result['p90_ms']:>9.1f}"
+            f"{result['p99_ms']:>9.1f}{result['max_ms']:>9.1f}{result['requests']:>10}{result['hedges_sent']:>8}{result['hedges_won']:>6}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
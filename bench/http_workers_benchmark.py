@@ -0,0 +1,204 @@
+"""HTTPトランスポートで複数のクライアントを受ける場合のベンチマーク
+
+代替サーバー（fake_chatwork_server.py）をプロセス内で起動し、chatwork_mcp.py を次のいずれかの構成で
+HTTPサーバーとして起動して、複数のMCPクライアントから get_room_tasks を呼び出します。
+
+- separate: ワーカー数と同じ数のサーバーを別々に起動（クライアントごとにサーバーを起動する場合と同じく、
+            キャッシュとレート制限の予算を共有しない）
+- shared:   1つのサーバーを --workers のワーカープロセスで起動（CHATWORK_SHARED_STATE_PATH で共有）
+
+同じAPIトークンを使うため、代替サーバー側のレート制限（--server-rate-limit）は全クライアントの合計で数えられます。
+スループット、代替サーバーが受信したリクエスト数、429の応答数を表示します。
+
+    python bench/http_workers_benchmark.py --workers 4 --clients 16 --operations 50
+    python bench/http_workers_benchmark.py --modes shared --workers 2,4 --json workers.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_chatwork_server import FakeServerConfig, start_fake_server  # noqa: E402
+from benchmark import FakeServerStats  # noqa: E402
+
+from mcp import ClientSession  # noqa: E402
+from mcp.client.streamable_http import streamablehttp_client  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(ROOT, "chatwork_mcp.py")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(base_url: str, port: int, workers: int, shared_state: str, args: argparse.Namespace) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "CHATWORK_API_BASE_URL": base_url,
+        "CHATWORK_API_TOKEN": "benchmark-token",
+        "CHATWORK_RATE_LIMIT_REQUESTS": str(args.client_rate_limit),
+        "CHATWORK_RATE_LIMIT_PERIOD": str(args.rate_limit_period),
+        "CHATWORK_MCP_TRANSPORT": "streamable-http",
+        "CHATWORK_MCP_PORT": str(port),
+        "CHATWORK_MCP_WORKERS": str(workers),
+        "CHATWORK_WATCH_ENABLED": "0",
+        "FASTMCP_LOG_LEVEL": "WARNING"
+    })
+    env.pop("CHATWORK_METRICS_FILE", None)
+    if shared_state:
+        env["CHATWORK_SHARED_STATE_PATH"] = shared_state
+    else:
+        env.pop("CHATWORK_SHARED_STATE_PATH", None)
+    return subprocess.Popen([sys.executable, SERVER_SCRIPT], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+async def _wait_ready(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/healthz") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"ポート {port} のサーバーが起動しませんでした")
+            await asyncio.sleep(0.2)
+
+
+def _stop_servers(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        process.stderr.close()
+
+
+async def _run_client(url: str, room_ids: List[int], operations: int, seed: int, errors: List[str]) -> int:
+    """1つのMCPセッションで get_room_tasks を operations 回呼び出し、成功した回数を返します"""
+    rng = random.Random(seed)
+    done = 0
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            for _ in range(operations):
+                result = await session.call_tool("get_room_tasks", {"room_id": rng.choice(room_ids), "fields": ["task_id"]})
+                if result.isError:
+                    errors.append(result.content[0].text if result.content else "error")
+                else:
+                    done += 1
+    return done
+
+
+async def _run_mode(mode: str, workers: int, base_url: str, room_ids: List[int], args: argparse.Namespace) -> Dict[str, Any]:
+    stats = FakeServerStats(base_url)
+    await stats.reset()
+    state_dir = tempfile.mkdtemp(prefix="chatwork_workers_bench_")
+    if mode == "shared":
+        ports = [_free_port()]
+        processes = [_start_server(base_url, ports[0], workers, os.path.join(state_dir, "shared.db"), args)]
+    else:
+        ports = [_free_port() for _ in range(workers)]
+        processes = [_start_server(base_url, port, 1, "", args) for port in ports]
+    try:
+        await asyncio.gather(*(_wait_ready(port) for port in ports))
+        errors: List[str] = []
+        started = time.perf_counter()
+        done = await asyncio.gather(*(
+            _run_client(f"http://127.0.0.1:{ports[number % len(ports)]}/mcp", room_ids, args.operations, number, errors)
+            for number in range(args.clients)
+        ))
+        elapsed = time.perf_counter() - started
+        server = await stats.get()
+    finally:
+        await stats.close()
+        _stop_servers(processes)
+    total = sum(done)
+    return {
+        "mode": mode,
+        "workers": workers,
+        "clients": args.clients,
+        "operations": total,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "elapsed_s": elapsed,
+        "ops_per_s": total / elapsed if elapsed > 0 else 0.0,
+        "requests": server["requests"],
+        "throttled": server["throttled"]
+    }
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    runner, base_url = await start_fake_server(FakeServerConfig(
+        rooms=args.rooms,
+        tasks_per_room=args.tasks_per_room,
+        messages_per_room=10,
+        latency=args.latency,
+        rate_limit=args.server_rate_limit,
+        rate_limit_period=args.rate_limit_period
+    ))
+    try:
+        room_ids = list(range(1000, 1000 + args.rooms))
+        results = []
+        for workers in (int(value) for value in args.workers.split(",")):
+            for mode in args.modes.split(","):
+                results.append(await _run_mode(mode, workers, base_url, room_ids, args))
+        return results
+    finally:
+        await runner.cleanup()
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HTTPトランスポートのワーカー構成のベンチマーク")
+    parser.add_argument("--modes", default="separate,shared", help="計測する構成（separate, shared のカンマ区切り）")
+    parser.add_argument("--workers", default="4", help="ワーカー数（separate ではサーバー数、カンマ区切り）")
+    parser.add_argument("--clients", type=int, default=16, help="同時に接続するMCPクライアント数")
+    parser.add_argument("--operations", type=int, default=50, help="クライアントごとの呼び出し回数")
+    parser.add_argument("--rooms", type=int, default=50, help="合成するルーム数（呼び出すルームはこの中から選ぶ）")
+    parser.add_argument("--tasks-per-room", type=int, default=20, help="ルームごとのタスク数")
+    parser.add_argument("--latency", type=float, default=0.02, help="代替サーバーの基本遅延（秒）")
+    parser.add_argument("--server-rate-limit", type=int, default=100, help="代替サーバー側のレート制限（APIトークンごと、0: 制限なし）")
+    parser.add_argument("--client-rate-limit", type=int, default=100, help="サーバーごとのレート制限（CHATWORK_RATE_LIMIT_REQUESTS）")
+    parser.add_argument("--rate-limit-period", type=float, default=60.0, help="レート制限の期間（秒）")
+    parser.add_argument("--json", help="結果をJSONで保存するファイルのパス")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    results = asyncio.run(run(args))
+    print(f"{'mode':<10}{'workers':>8}{'ops':>7}{'errors':>8}{'ops/s':>9}{'requests':>10}{'429':>6}")
+    for result in results:
+        print(
+            f"{result['mode']:<10}{result['workers']:>8}{result['operations']:>7}{result['errors']:>8}"
+            f"{result['ops_per_s']:>9.1f}{result['requests']:>10}{result['throttled']:>6}"
+        )
+        if result["first_error"]:
+            print(f"  {result['mode']}: {result['first_error'][:120]}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""APIレスポンスのJSONデコードのマイクロベンチマーク
+
+代表的なレスポンス（長い本文を含むメッセージ100件、ルーム一覧、自分のタスク一覧）を
+合成し、次の方法でデコードにかかる時間を比較します。
+
+- json:         標準ライブラリのコーデック（aiohttp の response.json() と同じく str に変換してから json.loads）
+- json (bytes): 参考値。標準ライブラリの json.loads にバイト列をそのまま渡す（文字コードの判定が入る）
+- orjson:       orjson.loads にバイト列をそのまま渡す（インストールされている場合のみ）
+
+速度比は json に対する倍率です。
+
+    python bench/json_benchmark.py
+    python bench/json_benchmark.py --rooms 1000 --body-repeat 40
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_chatwork_server import FakeChatWork, FakeServerConfig, MY_ACCOUNT_ID  # noqa: E402
+
+import chatwork_mcp  # noqa: E402
+
+
+def build_payloads(rooms: int, body_repeat: int) -> Dict[str, bytes]:
+    """代替サーバーの合成データから、APIが返すのと同じ形式のレスポンス本文を作ります"""
+    state = FakeChatWork(FakeServerConfig(rooms=rooms, messages_per_room=100, tasks_per_room=10))
+    room_id = next(iter(state.rooms))
+    messages = [
+        dict(message, body="\n".join([message["body"]] * body_repeat))
+        for message in state.messages(room_id)
+    ]
+    my_tasks = [state.my_task(task) for task in state.tasks.values() if task["account"]["account_id"] == MY_ACCOUNT_ID]
+
+    def encode(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    return {
+        "get_room_messages (100 long messages)": encode(messages),
+        f"get_rooms ({rooms} rooms)": encode(list(state.rooms.values())),
+        f"get_my_tasks ({len(my_tasks)} tasks)": encode(my_tasks)
+    }
+
+
+def _decoders() -> Dict[str, Callable[[bytes], Any]]:
+    decoders: Dict[str, Callable[[bytes], Any]] = {}
+    for name, factory in chatwork_mcp._JSON_CODECS.items():
+        try:
+            decoders[name] = factory().loads
+        except ImportError:
+            print(f"{name}: インストールされていないため計測しません")
+        if name == "json":
+            decoders["json (bytes)"] = json.loads
+    return decoders
+
+
+def _per_call_us(func: Callable[[], Any], repeat: int) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def run(rooms: int, body_repeat: int, repeat: int) -> List[Dict[str, Any]]:
+    payloads = build_payloads(rooms, body_repeat)
+    decoders = _decoders()
+    results = []
+    for payload_name, body in payloads.items():
+        expected = decoders["json"](body)
+        baseline_us = None
+        for decoder_name, decode in decoders.items():
+            # 速さだけでなく、結果が同一であることも確認する
+            if decode(body) != expected:
+                raise AssertionError(f"{decoder_name} のデコード結果が一致しません: {payload_name}")
+            us = _per_call_us(lambda: decode(body), repeat)
+            if baseline_us is None:
+                baseline_us = us
+            results.append({
+                "payload": payload_name,
+                "bytes": len(body),
+                "decoder": decoder_name,
+                "us_per_call": us,
+                "mb_per_s": len(body) / us,
+                "speedup": baseline_us / us
+            })
+    return results
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="JSONデコードのマイクロベンチマーク")
+    parser.add_argument("--rooms", type=int, default=300, help="ルーム一覧に含めるルーム数")
+    parser.add_argument("--body-repeat", type=int, default=20, help="メッセージ本文を長くするための繰り返し回数")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の繰り返し回数（最小値を採用）")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    results = run(args.rooms, args.body_repeat, args.repeat)
+    print(f"{'payload':<40}{'bytes':>10}  {'decoder':<14}{'us/call':>10}{'MB/s':>9}{'speedup':>9}")
+    for result in results:
+        print(
+            f"{result['payload']:<40}{result['bytes']:>10}  {result['decoder']:<14}"
+            f"{result['us_per_call']:>10.1f}{result['mb_per_s']:>9.1f}{result['speedup']:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
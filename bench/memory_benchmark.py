@@ -0,0 +1,125 @@
+"""メッセージを保持する際のメモリ使用量を比較するベンチマーク
+
+代替サーバーの合成データから、APIと同じ100件単位のJSONレスポンスを作ってデコードし、
+次の2つの保持方法でのメモリ使用量を tracemalloc で計測します。
+
+- dict:   デコードしたdictのまま保持（メッセージごとに account のdictを持つ）
+- record: MessageRecord に変換して保持（アカウント情報は AccountDirectory で共有）
+
+それぞれ、リストで保持する場合と、get_room_message と同じように1件ずつ
+TTLCacheに保持する場合を計測します。
+
+    python bench/memory_benchmark.py
+    python bench/memory_benchmark.py --messages 100000 --accounts 500
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_chatwork_server import MESSAGES_PAGE_SIZE, FakeChatWork, FakeServerConfig  # noqa: E402
+
+import chatwork_mcp  # noqa: E402
+
+
+def build_pages(messages: int, rooms: int, accounts: int) -> List[bytes]:
+    """APIのメッセージ一覧と同じ100件単位のJSONレスポンスを作ります"""
+    per_room = -(-messages // rooms)
+    state = FakeChatWork(FakeServerConfig(rooms=rooms, messages_per_room=per_room, tasks_per_room=0, accounts=accounts))
+    pages = []
+    remaining = messages
+    for room_id in state.rooms:
+        room_messages = state.messages(room_id)[:remaining]
+        remaining -= len(room_messages)
+        for start in range(0, len(room_messages), MESSAGES_PAGE_SIZE):
+            page = room_messages[start:start + MESSAGES_PAGE_SIZE]
+            pages.append(json.dumps(page, ensure_ascii=False).encode("utf-8"))
+        if remaining <= 0:
+            break
+    return pages
+
+
+def _measure(build: Callable[[], Any]) -> int:
+    """build() が返したオブジェクトを保持している間に増えたメモリ量（バイト）を返します"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        held = build()
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del held
+    return current
+
+
+def run(messages: int, rooms: int, accounts: int) -> Dict[str, Any]:
+    pages = build_pages(messages, rooms, accounts)
+    count = sum(len(json.loads(page)) for page in pages)
+
+    def decode_all() -> List[Dict[str, Any]]:
+        return [message for page in pages for message in json.loads(page)]
+
+    def as_records() -> Any:
+        directory = chatwork_mcp.AccountDirectory()
+        records = []
+        for page in pages:
+            # 1ページ分のdictはレコードへの変換後に破棄され、本文などの文字列だけが残る
+            records.extend(chatwork_mcp.MessageRecord.from_api(message, directory) for message in json.loads(page))
+        return records, directory
+
+    def cache_with(convert: Callable[[Dict[str, Any], Any], Any]) -> Callable[[], Any]:
+        def build() -> Any:
+            cache = chatwork_mcp.TTLCache(count)
+            directory = chatwork_mcp.AccountDirectory()
+            for page in pages:
+                for message in json.loads(page):
+                    cache.set(f"/rooms/1/messages/{message['message_id']}", convert(message, directory), 3600)
+            return cache, directory
+        return build
+
+    results = {
+        "messages": count,
+        "accounts": accounts,
+        "list_dict_bytes": _measure(decode_all),
+        "list_record_bytes": _measure(as_records),
+        "cache_dict_bytes": _measure(cache_with(lambda message, directory: message)),
+        "cache_record_bytes": _measure(cache_with(lambda message, directory: chatwork_mcp.MessageRecord.from_api(message, directory)))
+    }
+    return results
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="メッセージ保持時のメモリ使用量のベンチマーク")
+    parser.add_argument("--messages", type=int, default=100000, help="保持するメッセージ数")
+    parser.add_argument("--rooms", type=int, default=100, help="メッセージを分散させるルーム数")
+    parser.add_argument("--accounts", type=int, default=200, help="投稿者のアカウント数")
+    parser.add_argument("--json", help="結果をJSONで保存するファイルのパス")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    results = run(args.messages, args.rooms, args.accounts)
+    count = results["messages"]
+    print(f"messages: {count}, accounts: {results['accounts']}")
+    print(f"{'working set':<14}{'dict MB':>10}{'record MB':>11}{'dict B/msg':>12}{'record B/msg':>14}{'saved':>8}")
+    for label, key in (("list", "list"), ("TTLCache", "cache")):
+        dict_bytes, record_bytes = results[f"{key}_dict_bytes"], results[f"{key}_record_bytes"]
+        print(
+            f"{label:<14}{dict_bytes / 2 ** 20:>10.1f}{record_bytes / 2 ** 20:>11.1f}"
+            f"{dict_bytes / count:>12.0f}{record_bytes / count:>14.0f}{1 - record_bytes / dict_bytes:>8.0%}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
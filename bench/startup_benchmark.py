@@ -0,0 +1,196 @@
+"""chatwork_mcp.py の起動時間を計測するベンチマーク
+
+MCPホストはセッションごとにサーバーを起動するため、起動時間は毎回かかります。
+このスクリプトは次の2つを計測します。
+
+1. 読み込み時間の内訳（python -X importtime）: chatwork_mcp の読み込みにかかった時間と、
+   chatwork_mcp が直接読み込むモジュールごとの累積時間
+2. initialize までの時間: python chatwork_mcp.py をstdioで起動し、MCPの initialize と
+   tools/list に応答するまでの時間
+
+    python bench/startup_benchmark.py --runs 10
+    python bench/startup_benchmark.py --runs 10 --json startup_before.json
+
+--deferred に指定したモジュール（既定: aiohttp）が起動時に読み込まれていないことも確認します。
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(ROOT, "chatwork_mcp.py")
+
+# python -X importtime の出力行（"import time: self [us] | cumulative | imported package"）
+_IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _server_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("CHATWORK_API_TOKEN", "startup-benchmark-token")
+    # 起動時間の計測にバックグラウンド処理が混ざらないようにする
+    env["CHATWORK_WATCH_ENABLED"] = "0"
+    env.pop("CHATWORK_METRICS_FILE", None)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def profile_imports() -> Dict[str, Any]:
+    """chatwork_mcp を1回読み込み、読み込み時間の内訳（マイクロ秒）を返します"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import chatwork_mcp"],
+        cwd=ROOT, env=_server_env(), capture_output=True, text=True, check=True
+    )
+    total = self_time = 0
+    direct: Dict[str, int] = {}
+    children: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = int(match.group(1)), int(match.group(2)), len(match.group(3)), match.group(4)
+        # importtimeは子モジュールを親より先に、入れ子を2文字ずつ字下げして出力する
+        if indent == 3:
+            children[name] = children.get(name, 0) + cumulative
+        elif indent == 1:
+            if name == "chatwork_mcp":
+                total, self_time, direct = cumulative, own, children
+            children = {}
+    return {"total_us": total, "self_us": self_time, "direct_us": direct}
+
+
+def loaded_modules(names: List[str]) -> List[str]:
+    """chatwork_mcp を読み込んだ直後に、namesのうち読み込み済みのモジュールを返します"""
+    code = f"import sys, chatwork_mcp; print(','.join(n for n in {names!r} if n in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT, env=_server_env(), capture_output=True, text=True, check=True
+    )
+    return [name for name in result.stdout.strip().split(",") if name]
+
+
+def _read_response(process: subprocess.Popen, request_id: int) -> Dict[str, Any]:
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError(f"サーバーが応答せずに終了しました: {process.stderr.read()}")
+        message = json.loads(line)
+        if message.get("id") == request_id:
+            return message
+
+
+def measure_initialize() -> Dict[str, float]:
+    """サーバーを起動し、initialize と tools/list への応答までの時間（ミリ秒）を返します"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT],
+        cwd=ROOT, env=_server_env(), text=True,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        process.stdin.write(json.dumps({
+            "jsonrpc": "2.0", "id": 1, "method": "initialize",
+            "params": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {},
+                "clientInfo": {"name": "startup-benchmark", "version": "0"}
+            }
+        }) + "\n")
+        process.stdin.flush()
+        _read_response(process, 1)
+        initialized = time.perf_counter()
+
+        process.stdin.write(json.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}) + "\n")
+        process.stdin.write(json.dumps({"jsonrpc": "2.0", "id": 2, "method": "tools/list"}) + "\n")
+        process.stdin.flush()
+        _read_response(process, 2)
+        listed = time.perf_counter()
+    finally:
+        process.stdin.close()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+    return {
+        "initialize_ms": (initialized - started) * 1000,
+        "tools_list_ms": (listed - started) * 1000
+    }
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "median": statistics.median(values),
+        "min": min(values),
+        "max": max(values)
+    }
+
+
+def run(runs: int, top: int, deferred: List[str]) -> Dict[str, Any]:
+    profiles = [profile_imports() for _ in range(runs)]
+    direct_names = set().union(*(profile["direct_us"] for profile in profiles))
+    direct = {
+        name: statistics.median(profile["direct_us"].get(name, 0) for profile in profiles) / 1000
+        for name in direct_names
+    }
+    timings = [measure_initialize() for _ in range(runs)]
+    return {
+        "runs": runs,
+        "import_ms": _summary([profile["total_us"] / 1000 for profile in profiles]),
+        "import_self_ms": _summary([profile["self_us"] / 1000 for profile in profiles]),
+        "direct_imports_ms": dict(sorted(direct.items(), key=lambda item: item[1], reverse=True)[:top]),
+        "initialize_ms": _summary([timing["initialize_ms"] for timing in timings]),
+        "tools_list_ms": _summary([timing["tools_list_ms"] for timing in timings]),
+        "loaded_at_startup": loaded_modules(deferred)
+    }
+
+
+def _print_report(result: Dict[str, Any], deferred: List[str]) -> None:
+    def line(label: str, summary: Dict[str, float]) -> None:
+        print(f"{label:<34}{summary['median']:>9.1f} ms  (min {summary['min']:.1f}, max {summary['max']:.1f})")
+
+    print(f"runs: {result['runs']}")
+    line("import chatwork_mcp", result["import_ms"])
+    line("  chatwork_mcp itself (tools etc.)", result["import_self_ms"])
+    line("spawn -> initialize response", result["initialize_ms"])
+    line("spawn -> tools/list response", result["tools_list_ms"])
+    print("direct imports of chatwork_mcp (median cumulative):")
+    for name, value in result["direct_imports_ms"].items():
+        print(f"  {name:<32}{value:>9.1f} ms")
+    for name in deferred:
+        state = "loaded at startup" if name in result["loaded_at_startup"] else "deferred"
+        print(f"{name}: {state}")
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="chatwork_mcp.py の起動時間のベンチマーク")
+    parser.add_argument("--runs", type=int, default=5, help="計測回数")
+    parser.add_argument("--top", type=int, default=10, help="表示する直接読み込みモジュールの数")
+    parser.add_argument("--deferred", default="aiohttp", help="起動時に読み込まれないはずのモジュール（カンマ区切り）")
+    parser.add_argument("--json", help="結果をJSONで保存するファイルのパス")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = _parse_args()
+    deferred = [name for name in args.deferred.split(",") if name]
+    result = run(args.runs, args.top, deferred)
+    _print_report(result, deferred)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    # 遅延読み込みの対象が起動時に読み込まれていれば失敗として終了する（CIでの回帰検出用）
+    if result["loaded_at_startup"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
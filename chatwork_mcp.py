@@ -1,22 +1,282 @@
 from mcp.server.fastmcp import FastMCP
-import aiohttp
+import asyncio
+import functools
 import os
 import json
+import logging
+import mmap
+import random
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager, contextmanager, suppress
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Iterator, List, Dict, Mapping, Optional, Tuple, Union
 from dotenv import load_dotenv
-from urllib.parse import unquote
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from urllib.parse import unquote, urlencode
+
+# aiohttpは読み込みに時間がかかるため、起動時には読み込まず最初のAPIリクエストで読み込む
+if TYPE_CHECKING:
+    import aiohttp
 
 # 環境変数の読み込み
 load_dotenv()
 
-# MCPサーバーのインスタンス作成
-mcp = FastMCP("ChatWork MCP Server")
+# stdioトランスポートでは標準出力がMCPの通信に使われるため、ログは標準エラー出力（logging）へ出す
+logger = logging.getLogger(__name__)
 
 # 環境変数からAPIトークンを取得
 CHATWORK_API_TOKEN = os.getenv("CHATWORK_API_TOKEN")
 
+# 複数のAPIトークン（プロファイル）。CHATWORK_API_TOKEN_<名前> で追加し、各ツールの profile 引数で選択する
+API_TOKEN_ENV_PREFIX = "CHATWORK_API_TOKEN_"
+DEFAULT_PROFILE = os.getenv("CHATWORK_DEFAULT_PROFILE", "default").lower()  # profile を省略した場合に使うプロファイル
+
+# コネクションプールの設定（環境変数で上書き可能）
+CONNECTION_LIMIT = int(os.getenv("CHATWORK_CONNECTION_LIMIT", "20"))  # 全体の同時接続数上限
+CONNECTION_LIMIT_PER_HOST = int(os.getenv("CHATWORK_CONNECTION_LIMIT_PER_HOST", "10"))  # ホストごとの同時接続数上限
+DNS_CACHE_TTL = int(os.getenv("CHATWORK_DNS_CACHE_TTL", "300"))  # DNSキャッシュの保持秒数
+KEEPALIVE_TIMEOUT = float(os.getenv("CHATWORK_KEEPALIVE_TIMEOUT", "60"))  # アイドル接続の保持秒数
+
+# ChatWork APIのエンドポイントとレート制限の設定
+CHATWORK_API_BASE_URL = os.getenv("CHATWORK_API_BASE_URL", "https://api.chatwork.com/v2")  # 検証用の代替サーバーに向ける場合に変更
+RATE_LIMIT_REQUESTS = int(os.getenv("CHATWORK_RATE_LIMIT_REQUESTS", "300"))  # 期間あたりのリクエスト上限
+RATE_LIMIT_PERIOD = float(os.getenv("CHATWORK_RATE_LIMIT_PERIOD", "300"))  # レート制限の期間（秒）
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("CHATWORK_RATE_LIMIT_MAX_RETRIES", "3"))  # 429受信時の最大リトライ回数
+RATE_LIMIT_RETRY_BASE_DELAY = float(os.getenv("CHATWORK_RATE_LIMIT_RETRY_BASE_DELAY", "1"))  # リトライ待機の基準秒数
+RATE_LIMIT_RETRY_MAX_DELAY = float(os.getenv("CHATWORK_RATE_LIMIT_RETRY_MAX_DELAY", "60"))  # リトライ待機の上限秒数
+
+# タイムアウトの設定（0を指定するとその上限を設けない）
+REQUEST_TIMEOUT = float(os.getenv("CHATWORK_REQUEST_TIMEOUT", "30"))  # 1回のHTTPリクエスト（接続待ちからレスポンスの読み込みまで）の上限秒数
+CONNECT_TIMEOUT = float(os.getenv("CHATWORK_CONNECT_TIMEOUT", "10"))  # TCP/TLS接続の確立の上限秒数
+TOOL_TIMEOUT = float(os.getenv("CHATWORK_TOOL_TIMEOUT", "120"))  # ツール1回の実行時間の上限秒数
+TOOL_TIMEOUTS = os.getenv("CHATWORK_TOOL_TIMEOUTS", "")  # ツールごとの上限（"get_rooms=10,sync_room_messages=600" の形式）
+# 多数のAPI呼び出しやファイル処理を行うツールは、CHATWORK_TOOL_TIMEOUTS で指定しない限り上限を設けない
+UNBOUNDED_TOOLS = ("sync_room_messages", "convert_message_archive", "post_room_tasks_batch", "put_room_task_status_batch")
+
+# 冪等なGET（get_room_message, get_room_task）のヘッジリクエスト（CHATWORK_HEDGE_ENABLED=1 で有効）
+# 応答がレイテンシの HEDGE_PERCENTILE パーセンタイルを超えても返らない場合に2回目を送り、先に成功した方を使う
+HEDGE_ENABLED = os.getenv("CHATWORK_HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("CHATWORK_HEDGE_PERCENTILE", "95"))  # 2回目を送るまでの待機に使うパーセンタイル
+HEDGE_MIN_DELAY = float(os.getenv("CHATWORK_HEDGE_MIN_DELAY", "0.05"))  # 2回目を送るまでの最短の待機秒数
+HEDGE_MIN_SAMPLES = int(os.getenv("CHATWORK_HEDGE_MIN_SAMPLES", "20"))  # エンドポイントごとに必要なレイテンシの計測数
+HEDGE_MAX_RATIO = float(os.getenv("CHATWORK_HEDGE_MAX_RATIO", "0.1"))  # 対象のリクエストに対する2回目の送信数の上限の割合
+HEDGE_RESERVED_REQUESTS = int(os.getenv("CHATWORK_HEDGE_RESERVED_REQUESTS", "50"))  # 2回目の送信時に他のツール用に残すリクエスト数
+
+# 読み取り系APIのキャッシュ設定（TTLを0にするとそのエンドポイントはキャッシュしない）
+CACHE_MAX_ENTRIES = int(os.getenv("CHATWORK_CACHE_MAX_ENTRIES", "1024"))  # キャッシュの最大件数
+CACHE_TTL_ROOMS = float(os.getenv("CHATWORK_CACHE_TTL_ROOMS", "30"))  # ルーム一覧
+CACHE_TTL_ROOM_TASKS = float(os.getenv("CHATWORK_CACHE_TTL_ROOM_TASKS", "60"))  # ルームのタスク一覧
+CACHE_TTL_ROOM_TASK = float(os.getenv("CHATWORK_CACHE_TTL_ROOM_TASK", "60"))  # タスク詳細
+CACHE_TTL_MY_TASKS = float(os.getenv("CHATWORK_CACHE_TTL_MY_TASKS", "60"))  # 自分のタスク一覧
+CACHE_TTL_ROOM_MESSAGE = float(os.getenv("CHATWORK_CACHE_TTL_ROOM_MESSAGE", "300"))  # メッセージ詳細
+
+# 複数ルーム同期の設定
+SYNC_MAX_CONCURRENCY = int(os.getenv("CHATWORK_SYNC_MAX_CONCURRENCY", "5"))  # 同時に取得するルーム数の上限
+SYNC_STATE_FILENAME = "sync_state.json"  # 保存先ディレクトリに置く同期状態ファイル
+
+# バックグラウンドでの未読監視の設定（CHATWORK_WATCH_ENABLED=1 で有効）
+WATCH_ENABLED = os.getenv("CHATWORK_WATCH_ENABLED", "0") == "1"
+WATCH_MIN_INTERVAL = float(os.getenv("CHATWORK_WATCH_MIN_INTERVAL", "30"))  # 更新があった場合のポーリング間隔（秒）
+WATCH_MAX_INTERVAL = float(os.getenv("CHATWORK_WATCH_MAX_INTERVAL", "300"))  # 更新がない場合に延ばす間隔の上限（秒）
+WATCH_SAVE_DIR = os.getenv("CHATWORK_WATCH_SAVE_DIR")  # 指定した場合は更新のあったルームの差分も取得して保存
+
+# 一括書き込みの設定
+BATCH_MAX_CONCURRENCY = int(os.getenv("CHATWORK_BATCH_MAX_CONCURRENCY", "5"))  # 同時に実行する操作数の上限
+
+# メトリクスの設定（ファイルを指定した場合はPrometheusのテキスト形式で定期的に書き出す）
+METRICS_FILE = os.getenv("CHATWORK_METRICS_FILE")
+METRICS_WRITE_INTERVAL = float(os.getenv("CHATWORK_METRICS_WRITE_INTERVAL", "15"))  # 書き出し間隔（秒）
+
+# APIレスポンスのJSONデコードに使うコーデック（auto: orjsonがあれば使用, orjson, json: 標準ライブラリ）
+JSON_CODEC = os.getenv("CHATWORK_JSON_CODEC", "auto")
+
+# 書き込みのアウトボックス（SQLiteファイルを指定した場合に有効。投稿を即座に受け付け、レート制限の範囲で送信する）
+OUTBOX_PATH = os.getenv("CHATWORK_OUTBOX_PATH")
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("CHATWORK_OUTBOX_MAX_ATTEMPTS", "5"))  # 未送信が確実な失敗の再送回数の上限
+OUTBOX_RETRY_DELAY = float(os.getenv("CHATWORK_OUTBOX_RETRY_DELAY", "30"))  # 再送までの待機の基準秒数（試行ごとに倍）
+OUTBOX_RESERVED_REQUESTS = int(os.getenv("CHATWORK_OUTBOX_RESERVED_REQUESTS", "30"))  # 送信時に他のツール用に残すリクエスト数
+OUTBOX_POLL_INTERVAL = float(os.getenv("CHATWORK_OUTBOX_POLL_INTERVAL", "1"))  # 共有状態を使う場合に他のワーカーの登録を確認する間隔（秒）
+
+# MCPのトランスポート（stdio, streamable-http, sse）。HTTPの場合は CHATWORK_MCP_HOST:CHATWORK_MCP_PORT で待ち受ける
+MCP_TRANSPORT = os.getenv("CHATWORK_MCP_TRANSPORT", "stdio")
+MCP_HOST = os.getenv("CHATWORK_MCP_HOST", "127.0.0.1")
+MCP_PORT = int(os.getenv("CHATWORK_MCP_PORT", "8000"))
+MCP_WORKERS = int(os.getenv("CHATWORK_MCP_WORKERS", "1"))  # ワーカープロセス数（2以上は streamable-http のステートレスモードのみ）
+
+# ワーカープロセス間で共有する状態（レスポンスキャッシュとレート制限の予算）のSQLiteファイル
+# CHATWORK_MCP_WORKERS が2以上で未指定の場合は、一時ディレクトリに作成します
+SHARED_STATE_PATH = os.getenv("CHATWORK_SHARED_STATE_PATH")
+LEADER_LEASE_SECONDS = float(os.getenv("CHATWORK_LEADER_LEASE_SECONDS", "15"))  # バックグラウンド処理の担当の有効期間（秒）
+
+# メッセージを蓄積するローカルストア（保存先ディレクトリに置くSQLiteファイル）
+MESSAGE_STORE_FILENAME = "messages.db"
+
+# get_room_messages などが保存するメッセージ履歴の形式（txt: 日付・時刻ごとのテキスト, compressed: 圧縮アーカイブ, both: 両方）
+ARCHIVE_FORMAT = os.getenv("CHATWORK_ARCHIVE_FORMAT", "txt")
+ARCHIVE_FILENAME = "messages.cwa"  # ルームごとのディレクトリに置く圧縮アーカイブ（インデックスは messages.cwa.idx）
+ARCHIVE_BLOCK_MESSAGES = int(os.getenv("CHATWORK_ARCHIVE_BLOCK_MESSAGES", "256"))  # 1ブロックに格納するメッセージ数の上限
+
+def _get_http_session(profile: "ApiProfile") -> "aiohttp.ClientSession":
+    """プロファイルの全ツールで共有するHTTPセッションを取得します
+
+    未生成の場合や、セッションが閉じられている場合は新たに生成します（aiohttpもここで読み込みます）。
+    keep-alive接続とDNSキャッシュを再利用するため、ツールごとにセッションを作らないでください。
+    接続プールはプロファイルごとに持つため、あるプロファイルの遅い応答が他のプロファイルの接続を塞ぐことはありません。
+
+    Args:
+        profile (ApiProfile): リクエストに使うプロファイル
+
+    Returns:
+        aiohttp.ClientSession: 共有HTTPセッション
+    """
+    if profile.session is None or profile.session.closed:
+        import aiohttp
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        )
+        # aiohttpの既定（合計5分）では、応答が止まった接続でツールが長時間待たされるため上限を短くする
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT or None, sock_connect=CONNECT_TIMEOUT or None)
+        profile.session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[_build_trace_config()])
+    return profile.session
+
+async def _close_http_session() -> None:
+    """全プロファイルのHTTPセッションを閉じ、プール中の接続を解放します"""
+    for profile in _api_profiles.values():
+        if profile.session is not None and not profile.session.closed:
+            await profile.session.close()
+        profile.session = None
+
+async def _wait_cancelled(task: "asyncio.Task[Any]") -> None:
+    """キャンセルしたタスクの終了を待ちます
+
+    タスクが例外で終了していた場合もログに残すだけにし、呼び出し元の後始末（セッションやストアを閉じる処理）を止めません。
+    """
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception("バックグラウンド処理が異常終了しました")
+
+class BackgroundLeader:
+    """バックグラウンド処理（未読の監視・メトリクスの書き出し・アウトボックスの送信）を担当するワーカーの選出
+
+    共有状態がない場合は、このプロセスが常に担当です。複数のワーカーで共有する場合は、SharedState の
+    リースを取得・延長できている間だけ担当となります。担当のワーカーが終了すると、リースの期限が切れた後に
+    他のワーカーが引き継ぎ、送信中のまま残ったアウトボックスの投稿を unknown にしてから送信を再開します。
+    """
+
+    LEASE_NAME = "background"
+
+    def __init__(self, lease_seconds: float):
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._holding = False
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    @property
+    def active(self) -> bool:
+        """このプロセスがバックグラウンド処理の担当かどうか"""
+        return _shared_state is None or self._holding
+
+    async def run(self) -> None:
+        """キャンセルされるまで、担当である間バックグラウンド処理を実行します"""
+        try:
+            if _shared_state is None:
+                self._start()
+                await asyncio.Event().wait()
+            while True:
+                try:
+                    held = await asyncio.to_thread(_shared_state.hold_lease, self.LEASE_NAME, self.owner, self.lease_seconds)
+                except sqlite3.Error:
+                    # 延長できたか分からないため、二重に実行しないよう担当を降りる
+                    held = False
+                if held and not self._holding:
+                    self._holding = True
+                    if OUTBOX_PATH:
+                        await asyncio.to_thread(_get_outbox().recover_interrupted)
+                    self._start()
+                elif not held and self._holding:
+                    self._holding = False
+                    await self._stop()
+                await asyncio.sleep(self.lease_seconds / 3)
+        finally:
+            await self._stop()
+            if self._holding:
+                self._holding = False
+                with suppress(sqlite3.Error):
+                    _shared_state.release_lease(self.LEASE_NAME, self.owner)
+
+    def _start(self) -> None:
+        if WATCH_ENABLED:
+            self._tasks.append(asyncio.create_task(_room_watcher.run()))
+        if METRICS_FILE:
+            self._tasks.append(asyncio.create_task(_write_metrics_periodically(METRICS_FILE, METRICS_WRITE_INTERVAL)))
+        if OUTBOX_PATH:
+            _outbox_sender.start()
+
+    async def _stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            await _wait_cancelled(task)
+        self._tasks.clear()
+        await _outbox_sender.stop()
+
+_background_leader = BackgroundLeader(LEADER_LEASE_SECONDS)
+
+# lifespan に入っている数（HTTPではMCPのセッションやリクエストごとにも入るため、最初と最後だけ処理する）
+_lifespan_depth = 0
+_leader_task: Optional["asyncio.Task[None]"] = None
+
+@asynccontextmanager
+async def lifespan(server: FastMCP) -> AsyncIterator[None]:
+    """サーバーの終了時に、共有HTTPセッションとローカルストアを閉じます
+
+    MCPの initialize に素早く応答できるよう、HTTPセッション（とaiohttpの読み込み）は
+    起動時には行わず、最初のAPIリクエストで生成します。
+    CHATWORK_WATCH_ENABLED=1 の場合は、未読状態を監視するバックグラウンド処理も実行します。
+    CHATWORK_METRICS_FILE を指定した場合は、メトリクスを定期的にファイルへ書き出します。
+    CHATWORK_OUTBOX_PATH を指定した場合は、前回の終了時に残っていた投稿の送信を再開します。
+    複数のワーカーで共有状態を使う場合、これらのバックグラウンド処理は担当の1ワーカーだけが実行します。
+    入れ子で呼ばれた場合（HTTPのワーカーの中のMCPのセッション）は、外側の呼び出しだけが開始と終了を行います。
+    """
+    global _lifespan_depth, _leader_task
+    _lifespan_depth += 1
+    if _lifespan_depth == 1:
+        _leader_task = asyncio.create_task(_background_leader.run())
+    try:
+        yield
+    finally:
+        _lifespan_depth -= 1
+        if _lifespan_depth == 0:
+            _leader_task.cancel()
+            await _wait_cancelled(_leader_task)
+            _leader_task = None
+            await _close_http_session()
+            _close_message_stores()
+            _close_outbox()
+
+# MCPサーバーのインスタンス作成
+mcp = FastMCP("ChatWork MCP Server", lifespan=lifespan)
+
 # レスポンスの型定義
 class Room(Dict):
     room_id: int
@@ -54,537 +314,4329 @@ class Task(Dict):
     status: str  # "open" または "done"
     limit_type: str  # "date" または "time"
 
-@mcp.tool()
-async def get_rooms() -> List[Room]:
-    """ChatWorkのルーム一覧を取得します
-    
-    Returns:
-        List[Room]: ルーム情報のリスト
-        
+class MessageReply(Dict):
+    account_id: int  # 返信先の投稿者
+    room_id: Optional[int]  # 返信先メッセージのルーム
+    message_id: Optional[str]  # 返信先メッセージのID
+
+class MessageQuote(Dict):
+    account_id: Optional[int]  # 引用元の投稿者
+    time: Optional[int]  # 引用元の投稿日時
+    text: str
+
+class MessageInfo(Dict):
+    title: str
+    body: str
+
+class ParsedMessage(Dict):
+    text: str  # タグを除いた本文（引用と情報ブロックは含まない。コードブロックは```で囲んで含む）
+    mentions: List[int]  # [To:id] で宛先に指定されたアカウントID
+    to_all: bool  # [toall] で全員宛てか
+    replies: List[MessageReply]
+    quotes: List[MessageQuote]
+    infos: List[MessageInfo]
+    code_blocks: List[str]
+
+class RoomUnread(Dict):
+    room_id: int
+    name: str
+    unread_num: int
+    mention_num: int
+    mytask_num: int
+    last_update_time: int
+
+class UnreadSummary(Dict):
+    total_unread: int  # 全ルームの未読メッセージ数の合計
+    total_mentions: int  # 全ルームのメンション数の合計
+    rooms: List[RoomUnread]  # 未読またはメンションのあるルーム（メンション数・未読数の多い順）
+    updated_at: Optional[int]  # ルーム一覧を取得した日時（UNIXタイムスタンプ）
+    watching: bool  # バックグラウンドで監視中か
+    last_error: Optional[str]  # 直近の監視で発生したエラー
+
+class BatchItemResult(Dict):
+    index: int  # 指定された操作リスト内の位置
+    ok: bool
+    result: Any  # 成功時のAPIレスポンス
+    error: str  # 失敗時のエラーメッセージ
+
+class BatchResult(Dict):
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]  # 操作リストと同じ順序
+
+class CompactTable(Dict):
+    columns: List[str]  # 列名
+    rows: List[List[Any]]  # 1要素1行の値（アカウント・ルームの列はIDで参照）
+    accounts: Dict[str, Account]  # account_id → アカウント情報（重複を除いて1度だけ記載）
+    rooms: Dict[str, Room]  # room_id → ルーム情報（重複を除いて1度だけ記載）
+
+class MessageSearchResult(Message):
+    room_id: int
+    score: float  # 関連度（小さいほど関連が高い）
+
+class TaskQueryResult(Dict):
+    tasks: Union[List[Task], CompactTable]  # 期限の早い順（期限なしは最後）
+    total: int  # 条件に合うタスクの総数（limitで切り詰める前）
+    now: int  # 期限の判定に使った現在時刻（UNIXタイムスタンプ）
+    synced_room_ids: List[int]  # get_room_tasks で全タスクを取り込み済みのルーム
+    my_tasks_synced_at: Dict[str, int]  # get_my_tasks でstatusごとに取り込んだ日時
+
+class RoomSyncResult(Dict):
+    room_id: int
+    name: str
+    messages: Union[List[Message], CompactTable]  # compact=1の場合は列形式の表
+
+class RoomSyncError(Dict):
+    room_id: int
+    name: str
+    error: str
+
+class SyncResult(Dict):
+    rooms: List[RoomSyncResult]  # メッセージを取得したルーム
+    skipped_room_ids: List[int]  # 前回の同期から更新がなかったルーム
+    errors: List[RoomSyncError]  # 取得に失敗したルーム
+
+class OutboxEntry(Dict):
+    idempotency_key: str
+    kind: str  # "message"（メッセージの投稿）または "task"（タスクの作成）
+    profile: str  # 投稿に使うプロファイル名
+    room_id: int
+    status: str  # pending, sending, sent, failed, unknown（Outbox を参照）
+    attempts: int  # 送信を試みた回数
+    result: Optional[Dict[str, Any]]  # 投稿済みの場合はAPIのレスポンス（message_id や task_ids）
+    error: Optional[str]  # 直近の失敗の内容
+    created_at: int
+    updated_at: int
+
+class OutboxStatus(Dict):
+    sender_running: bool  # 送信処理が動作中か
+    last_errors: Dict[str, str]  # プロファイル名 → 送信処理の直近のエラー
+    counts: Dict[str, int]  # 状態ごとの件数
+    entries: List[OutboxEntry]
+
+class ArchiveConversion(Dict):
+    room_id: int
+    txt_files: int  # 変換したtxtファイル数
+    txt_bytes: int  # 変換したtxtファイルの合計サイズ
+    messages: int  # txtから読み取ったメッセージ数（重複を除く）
+    appended: int  # アーカイブに追加したメッセージ数（ローカルストアから補ったものを含む）
+    archive_bytes: int  # 変換後のアーカイブ（インデックスを含む）のサイズ
+    removed_txt: bool  # 変換したtxtファイルを削除したか
+
+class AccountRecord:
+    """メモリ上で保持するアカウント情報（AccountDirectoryで共有し、メッセージごとに複製しない）"""
+
+    __slots__ = ("account_id", "name", "avatar_image_url")
+
+    def __init__(self, account_id: int, name: str, avatar_image_url: str):
+        self.account_id = account_id
+        self.name = name
+        self.avatar_image_url = avatar_image_url
+
+    def to_dict(self) -> Account:
+        return {"account_id": self.account_id, "name": self.name, "avatar_image_url": self.avatar_image_url}
+
+class AccountDirectory:
+    """アカウント情報を account_id ごとに1つだけ保持する共有ディレクトリ
+
+    同じ投稿者のメッセージは同じ AccountRecord を参照するため、メッセージ数が増えても
+    アカウント情報の分だけメモリが増えることはありません。名前やアイコンが変わった場合は
+    以降のメッセージから新しいレコードを参照します（以前のメッセージは当時の内容のまま）。
+    ワーカースレッドからも呼ばれますが、dictの参照・代入のみのためロックは不要です。
+    """
+
+    def __init__(self):
+        self._accounts: Dict[int, AccountRecord] = {}
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def intern(self, account_id: int, name: str, avatar_image_url: str) -> AccountRecord:
+        record = self._accounts.get(account_id)
+        if record is None or record.name != name or record.avatar_image_url != avatar_image_url:
+            record = AccountRecord(account_id, sys.intern(name), sys.intern(avatar_image_url))
+            self._accounts[account_id] = record
+        return record
+
+    def get(self, account_id: int) -> Optional[AccountRecord]:
+        return self._accounts.get(account_id)
+
+    def from_api(self, account: Mapping[str, Any]) -> AccountRecord:
+        return self.intern(account["account_id"], account.get("name", ""), account.get("avatar_image_url", ""))
+
+# サーバー全体で共有するアカウントディレクトリ
+_account_directory = AccountDirectory()
+
+# レコードのスロットで、APIのレスポンスに含まれなかった項目を表す値
+_MISSING: Any = object()
+
+class _Record:
+    """APIのオブジェクトをメモリ上で保持するための __slots__ ベースの基底クラス
+
+    _FIELDS に挙げた項目をスロットに持ち、それ以外の項目（APIに追加された項目など）は
+    extra にまとめて保持するため、to_dict() でAPIのレスポンスと同じ内容に戻せます。
+    """
+
+    __slots__ = ("extra",)
+    _FIELDS: Tuple[str, ...] = ()
+    _ACCOUNT_FIELDS: Tuple[str, ...] = ()  # AccountDirectoryで共有する項目
+
+    @classmethod
+    def from_api(cls, value: Mapping[str, Any], accounts: Optional[AccountDirectory] = None) -> "_Record":
+        if accounts is None:
+            accounts = _account_directory
+        record = cls.__new__(cls)
+        for field in cls._FIELDS:
+            item = value.get(field, _MISSING)
+            if field in cls._ACCOUNT_FIELDS and isinstance(item, Mapping):
+                item = accounts.from_api(item)
+            setattr(record, field, item)
+        extra = {key: item for key, item in value.items() if key not in cls._FIELDS}
+        record.extra = extra or None
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for field in self._FIELDS:
+            item = getattr(self, field)
+            if item is _MISSING:
+                continue
+            result[field] = item.to_dict() if isinstance(item, AccountRecord) else item
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+class RoomRecord(_Record):
+    __slots__ = (
+        "room_id", "name", "type", "role", "sticky", "unread_num", "mention_num", "mytask_num",
+        "message_num", "file_num", "task_num", "icon_path", "last_update_time"
+    )
+    _FIELDS = __slots__
+
+class MessageRecord(_Record):
+    __slots__ = ("message_id", "account", "body", "send_time", "update_time")
+    _FIELDS = __slots__
+    _ACCOUNT_FIELDS = ("account",)
+
+class TaskRecord(_Record):
+    # my/tasks は account の代わりに room を含む（room は extra に、account は _MISSING として保持）
+    __slots__ = (
+        "task_id", "account", "assigned_by_account", "message_id", "body",
+        "limit_time", "status", "limit_type"
+    )
+    _FIELDS = __slots__
+    _ACCOUNT_FIELDS = ("account", "assigned_by_account")
+
+def _to_records(value: Any, model: type) -> Any:
+    """APIのレスポンス（オブジェクトまたはその配列）をレコードに変換します"""
+    if isinstance(value, list):
+        return tuple(model.from_api(item) for item in value)
+    if isinstance(value, dict):
+        return model.from_api(value)
+    return value
+
+def _from_records(value: Any) -> Any:
+    """_to_records で変換したレコードを、APIのレスポンスと同じ形式のdictに戻します"""
+    if isinstance(value, tuple):
+        return [item.to_dict() for item in value]
+    if isinstance(value, _Record):
+        return value.to_dict()
+    return value
+
+class LatencyStats(Dict):
+    count: int
+    mean_ms: float
+    p50_ms: float  # ヒストグラムのバケットから推定した値
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+
+class ToolMetrics(LatencyStats):
+    errors: Dict[str, int]  # 例外の型名 → 件数
+
+class RateLimitMetrics(Dict):
+    capacity: int  # 期間あたりのリクエスト上限
+    remaining: int  # 現在利用可能なリクエスト数
+    server_remaining: Optional[int]  # 直近のレスポンスの x-ratelimit-remaining
+    blocked_seconds: float  # 429などによる送信停止の残り秒数
+
+class ServerMetrics(Dict):
+    uptime_seconds: float
+    tools: Dict[str, ToolMetrics]  # ツール名 → 実行時間と失敗件数
+    http_phases: Dict[str, LatencyStats]  # pool_wait, dns, connect, server, request, read_decode, store_upsert, archive_write
+    http_status: Dict[str, int]  # ステータスコード → レスポンス件数（リトライ分を含む）
+    network_errors: int
+    http_timeouts: int  # CHATWORK_REQUEST_TIMEOUT / CHATWORK_CONNECT_TIMEOUT を超えたリクエスト数（network_errors にも含む）
+    retries_429: int
+    cache: Dict[str, int]  # hits, misses, coalesced
+    hedge: Dict[str, int]  # sent: 2回目を送った件数, won: 2回目が先に成功した件数
+    rate_limit: RateLimitMetrics  # profile を省略した場合に使うプロファイルのレート制限
+    profiles: Dict[str, RateLimitMetrics]  # プロファイル名 → レート制限（APIトークンが設定されているもの）
+
+class RateLimiter:
+    """ChatWork APIのレート制限（5分あたり300リクエスト）に合わせたトークンバケット
+
+    リクエスト前に acquire() でトークンを1つ消費し、残量がなければ補充されるまで待機します。
+    レスポンスの x-ratelimit-* ヘッダで残量を補正するため、他のクライアントと予算を
+    共有している場合でも、サーバー側の残量を超えてリクエストを送ることはありません。
+    """
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period  # 1秒あたりの補充量
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0  # サーバーから制限超過を通知された場合の解除時刻
+        self.server_remaining: Optional[int] = None  # 直近のレスポンスで通知された残量
+        self._lock = asyncio.Lock()
+
+    @property
+    def remaining(self) -> int:
+        """現在利用可能なリクエスト数"""
+        self._refill(time.monotonic())
+        return int(self._tokens)
+
+    @property
+    def blocked_seconds(self) -> float:
+        """送信を停止している残り秒数"""
+        return max(self._blocked_until - time.monotonic(), 0.0)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """トークンを1つ取得します（残量がない場合は到着順に待機）"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    async def budget(self) -> Tuple[int, float, Optional[int]]:
+        """(現在利用可能なリクエスト数, 送信を停止している残り秒数, 直近のレスポンスで通知された残量) を返します"""
+        return self.remaining, self.blocked_seconds, self.server_remaining
+
+    async def update(self, headers: Mapping[str, str]) -> None:
+        """レスポンスのレート制限ヘッダでバケットの状態を補正します
+
+        Args:
+            headers: レスポンスヘッダ（x-ratelimit-remaining, x-ratelimit-reset を参照）
+        """
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+        except (KeyError, ValueError):
+            return
+        self.server_remaining = remaining
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens = min(self._tokens, float(remaining))
+        if remaining <= 0:
+            await self.block(_seconds_until_reset(headers))
+
+    async def block(self, seconds: float) -> None:
+        """指定秒数の間、新たなリクエストを送らないようにします"""
+        self._tokens = min(self._tokens, 0.0)
+        self._blocked_until = max(self._blocked_until, time.monotonic() + max(seconds, 0.0))
+
+def _seconds_until_reset(headers: Mapping[str, str]) -> float:
+    """レスポンスヘッダから制限解除までの秒数を求めます（不明な場合は0）"""
+    retry_after = headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    reset = headers.get("x-ratelimit-reset")
+    if reset is not None:
+        try:
+            return max(float(reset) - time.time(), 0.0)
+        except ValueError:
+            pass
+    return 0.0
+
+class SharedState:
+    """複数のワーカープロセスで共有する状態を保持するSQLiteファイル
+
+    プロファイルごとのレート制限の予算、レスポンスキャッシュ、バックグラウンド処理の担当（リース）を保持します。
+    更新は BEGIN IMMEDIATE のトランザクションで行い、プロセス間で排他します。
+    時刻はプロセス間で比較できるよう、monotonic ではなく time.time() を使います。
+    いずれの操作も1回の短いトランザクションで終わりますが、他のプロセスの書き込み中は待たされるため、
+    非同期の処理からは asyncio.to_thread で呼び出してください。
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_budget (
+            profile TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,
+            blocked_until REAL NOT NULL,
+            server_remaining INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            value TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_response_cache_path ON response_cache (path);
+        CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at ON response_cache (expires_at);
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # トランザクションは明示的に開始する（isolation_level=None）。他のプロセスの書き込み中は最大10秒待つ
+        self._conn = sqlite3.connect(str(db_path), timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _budget_row(self, conn: sqlite3.Connection, profile: str, capacity: int, rate: float, now: float) -> Tuple[float, float, Optional[int]]:
+        """補充を反映したプロファイルの (トークン数, 送信停止の解除時刻, サーバーの残量) を返します"""
+        row = conn.execute(
+            "SELECT tokens, updated, blocked_until, server_remaining FROM rate_budget WHERE profile = ?", (profile,)
+        ).fetchone()
+        if row is None:
+            return float(capacity), 0.0, None
+        tokens, updated, blocked_until, server_remaining = row
+        return min(capacity, tokens + max(now - updated, 0.0) * rate), blocked_until, server_remaining
+
+    def _save_budget(
+        self, conn: sqlite3.Connection, profile: str, tokens: float, now: float, blocked_until: float, server_remaining: Optional[int]
+    ) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO rate_budget (profile, tokens, updated, blocked_until, server_remaining) VALUES (?, ?, ?, ?, ?)",
+            (profile, tokens, now, blocked_until, server_remaining)
+        )
+
+    def budget(self, profile: str, capacity: int, rate: float) -> Tuple[float, float, Optional[int]]:
+        """プロファイルの (トークン数, 送信停止の残り秒数, サーバーの残量) を返します"""
+        now = time.time()
+        with self._lock:
+            tokens, blocked_until, server_remaining = self._budget_row(self._conn, profile, capacity, rate, now)
+        return tokens, max(blocked_until - now, 0.0), server_remaining
+
+    def take_token(self, profile: str, capacity: int, rate: float) -> float:
+        """トークンを1つ取得します
+
+        Returns:
+            float: 取得できた場合は0、できなかった場合は取得できるまでの秒数
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            tokens, blocked_until, server_remaining = self._budget_row(conn, profile, capacity, rate, now)
+            if blocked_until > now:
+                wait = blocked_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._save_budget(conn, profile, tokens, now, blocked_until, server_remaining)
+        return wait
+
+    def restrict_budget(
+        self,
+        profile: str,
+        capacity: int,
+        rate: float,
+        max_tokens: float,
+        block_seconds: float = 0.0,
+        server_remaining: Optional[int] = None
+    ) -> None:
+        """トークン数を max_tokens 以下に減らし、必要なら block_seconds の間送信を停止します"""
+        now = time.time()
+        with self._transaction() as conn:
+            tokens, blocked_until, previous_remaining = self._budget_row(conn, profile, capacity, rate, now)
+            self._save_budget(
+                conn, profile, min(tokens, max_tokens), now,
+                max(blocked_until, now + block_seconds) if block_seconds > 0 else blocked_until,
+                server_remaining if server_remaining is not None else previous_remaining
+            )
+
+    def cache_get(self, key: str) -> Optional[str]:
+        """有効期限内のキャッシュの値（JSON）を返します"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def cache_set(self, key: str, path: str, value: str, ttl: float, max_entries: int) -> None:
+        """値を保存し、件数が上限を超えた分を有効期限の近いものから破棄します"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, path, expires_at, value) VALUES (?, ?, ?, ?)",
+                (key, path, now + ttl, value)
+            )
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            excess = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY expires_at LIMIT ?)",
+                    (excess,)
+                )
+
+    def cache_invalidate(self, paths: Optional[Tuple[str, ...]]) -> None:
+        """指定したパス（None の場合は全て）のキャッシュを破棄し、世代番号を進めます"""
+        with self._transaction() as conn:
+            if paths is None:
+                conn.execute("DELETE FROM response_cache")
+            else:
+                conn.executemany("DELETE FROM response_cache WHERE path = ?", [(path,) for path in paths])
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES ('cache_generation', 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1"
+            )
+
+    def cache_generation(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM counters WHERE name = 'cache_generation'").fetchone()
+        return row[0] if row is not None else 0
+
+    def hold_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """リースを取得または延長します
+
+        Returns:
+            bool: 取得できた場合はTrue（他の所有者が期限内のリースを持っている場合はFalse）
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)", (name, owner, now + ttl)
+            )
+        return True
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """所有しているリースを解放します"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# ワーカープロセス間で共有する状態（CHATWORK_SHARED_STATE_PATH を指定した場合のみ）
+_shared_state = SharedState(Path(SHARED_STATE_PATH).expanduser()) if SHARED_STATE_PATH else None
+
+class SharedRateLimiter:
+    """SharedState に予算を置き、同じAPIトークンを使う全ワーカープロセスで共有するトークンバケット
+
+    RateLimiter と同じ操作を持ちます。プロセス内の待機は到着順に行い、プロセス間の取り合いは
+    SharedState のトランザクションで排他します。他のワーカーの書き込み待ちでイベントループを止めないよう、
+    SharedState の操作は asyncio.to_thread で実行します。
+    """
+
+    def __init__(self, state: SharedState, profile: str, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period  # 1秒あたりの補充量
+        self._state = state
+        self._profile = profile
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """トークンを1つ取得します（残量がない場合は到着順に待機）"""
+        async with self._lock:
+            while True:
+                wait = await asyncio.to_thread(self._state.take_token, self._profile, self.capacity, self.rate)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+    async def budget(self) -> Tuple[int, float, Optional[int]]:
+        """(現在利用可能なリクエスト数（全ワーカー合計）, 送信を停止している残り秒数,
+        いずれかのワーカーが直近に受け取ったレスポンスで通知された残量) を返します"""
+        tokens, blocked_seconds, server_remaining = await asyncio.to_thread(
+            self._state.budget, self._profile, self.capacity, self.rate
+        )
+        return int(tokens), blocked_seconds, server_remaining
+
+    async def update(self, headers: Mapping[str, str]) -> None:
+        """レスポンスのレート制限ヘッダで共有の予算を補正します"""
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+        except (KeyError, ValueError):
+            return
+        block_seconds = _seconds_until_reset(headers) if remaining <= 0 else 0.0
+        await asyncio.to_thread(
+            self._state.restrict_budget, self._profile, self.capacity, self.rate, float(remaining), block_seconds, remaining
+        )
+
+    async def block(self, seconds: float) -> None:
+        """指定秒数の間、全ワーカーで新たなリクエストを送らないようにします"""
+        await asyncio.to_thread(self._state.restrict_budget, self._profile, self.capacity, self.rate, 0.0, max(seconds, 0.0))
+
+class ApiProfile:
+    """APIトークン（プロファイル）ごとのHTTPセッションとレート制限
+
+    ChatWorkのレート制限はトークンごとに課されるため、プロファイルごとにトークンバケットを持ち、
+    あるプロファイルが制限に達しても他のプロファイルのリクエストは待たせません。
+    共有状態（CHATWORK_SHARED_STATE_PATH）を使う場合は、予算を全ワーカープロセスで共有します。
+    """
+
+    def __init__(self, name: str, token: Optional[str]):
+        self.name = name
+        self.token = token
+        self.rate_limiter: Union[RateLimiter, SharedRateLimiter] = (
+            SharedRateLimiter(_shared_state, name, RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD) if _shared_state is not None
+            else RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD)
+        )
+        self.session: Optional["aiohttp.ClientSession"] = None  # 最初のAPIリクエストで生成
+
+def _load_api_profiles() -> Dict[str, ApiProfile]:
+    """環境変数からプロファイルを読み込みます
+
+    CHATWORK_API_TOKEN は "default"、CHATWORK_API_TOKEN_<名前> は <名前>（小文字）のプロファイルになります。
+    profile を省略した場合に使うプロファイル（CHATWORK_DEFAULT_PROFILE）は、トークンが未設定でも登録します。
+    """
+    profiles = {"default": ApiProfile("default", CHATWORK_API_TOKEN)}
+    for key, value in sorted(os.environ.items()):
+        if key.startswith(API_TOKEN_ENV_PREFIX) and len(key) > len(API_TOKEN_ENV_PREFIX) and value:
+            name = key[len(API_TOKEN_ENV_PREFIX):].lower()
+            profiles[name] = ApiProfile(name, value)
+    profiles.setdefault(DEFAULT_PROFILE, ApiProfile(DEFAULT_PROFILE, None))
+    return profiles
+
+# プロファイル名 → プロファイル
+_api_profiles = _load_api_profiles()
+
+def _get_profile(name: Optional[str] = None) -> ApiProfile:
+    """プロファイルを取得します（省略時は CHATWORK_DEFAULT_PROFILE）
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        ValueError: プロファイルのAPIトークンが設定されていない場合
+    """
+    name = DEFAULT_PROFILE if name is None else name.lower()
+    profile = _api_profiles.get(name)
+    if profile is None or not profile.token:
+        if name == "default":
+            raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+        raise ValueError(
+            f"プロファイル「{name}」のAPIトークンが設定されていません。"
+            f"環境変数 {API_TOKEN_ENV_PREFIX}{name.upper()} を設定してください。"
+        )
+    return profile
+
+def _configured_profiles() -> List[ApiProfile]:
+    """APIトークンが設定されているプロファイルの一覧"""
+    return [profile for profile in _api_profiles.values() if profile.token]
+
+class TTLCache:
+    """有効期限付きのLRUキャッシュ
+
+    キーは "プロファイル名|APIのパス（クエリ付き）" で、件数が上限を超えると最も古く参照されたものから破棄します。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.generation = 0  # 破棄のたびに増える世代番号（破棄前に開始した取得結果の保存を防ぐ）
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """キャッシュを参照します
+
+        Returns:
+            Tuple[bool, Any]: (ヒットしたか, 値)
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """値を有効期限（秒）付きで保存します"""
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *paths: str) -> None:
+        """指定したパスのキャッシュを全プロファイル分破棄します
+
+        Args:
+            *paths: 破棄するAPIのパス（"/my/tasks" は "/my/tasks?status=open" なども破棄）
+        """
+        self.generation += 1
+        for key in list(self._entries):
+            if key.split("?", 1)[0].rpartition("|")[2] in paths:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """全てのキャッシュを破棄します"""
+        self.generation += 1
+        self._entries.clear()
+
+class SharedResponseCache:
+    """SharedState に値を置き、全ワーカープロセスで共有するレスポンスキャッシュ
+
+    TTLCache と同じ操作を非同期で持ちます（SharedState の操作は asyncio.to_thread で実行します）。
+    値はJSONで保存するため、レコードはAPIのレスポンスと同じ形式のdictに戻して保存し、取得した値もdictです。
+    件数が上限を超えると有効期限の近いものから破棄します。
+    """
+
+    def __init__(self, state: SharedState, max_entries: int):
+        self.max_entries = max_entries
+        self._state = state
+
+    async def current_generation(self) -> int:
+        """破棄のたびに増える世代番号（全ワーカー共通）"""
+        return await asyncio.to_thread(self._state.cache_generation)
+
+    async def get(self, key: str) -> Tuple[bool, Any]:
+        value = await asyncio.to_thread(self._state.cache_get, key)
+        if value is None:
+            return False, None
+        return True, _get_json_codec().loads(value.encode("utf-8"))
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        path = key.split("?", 1)[0].rpartition("|")[2]
+        data = _get_json_codec().dumps(_from_records(value))
+        await asyncio.to_thread(self._state.cache_set, key, path, data, ttl, self.max_entries)
+
+    async def invalidate(self, *paths: str) -> None:
+        await asyncio.to_thread(self._state.cache_invalidate, paths)
+
+    async def clear(self) -> None:
+        await asyncio.to_thread(self._state.cache_invalidate, None)
+
+# 全ツールで共有するレスポンスキャッシュ（共有状態を使う場合は全ワーカーで共有）
+_response_cache: Union[TTLCache, SharedResponseCache] = (
+    SharedResponseCache(_shared_state, CACHE_MAX_ENTRIES) if _shared_state is not None else TTLCache(CACHE_MAX_ENTRIES)
+)
+
+# 以下はレスポンスキャッシュの種類によらず使える操作です（共有キャッシュはイベントループの外で実行します）
+
+async def _cache_get(key: str) -> Tuple[bool, Any]:
+    if isinstance(_response_cache, SharedResponseCache):
+        return await _response_cache.get(key)
+    return _response_cache.get(key)
+
+async def _cache_set(key: str, value: Any, ttl: float) -> None:
+    if isinstance(_response_cache, SharedResponseCache):
+        await _response_cache.set(key, value, ttl)
+    else:
+        _response_cache.set(key, value, ttl)
+
+async def _cache_invalidate(*paths: str) -> None:
+    if isinstance(_response_cache, SharedResponseCache):
+        await _response_cache.invalidate(*paths)
+    else:
+        _response_cache.invalidate(*paths)
+
+async def _cache_generation() -> int:
+    if isinstance(_response_cache, SharedResponseCache):
+        return await _response_cache.current_generation()
+    return _response_cache.generation
+
+class LatencyHistogram:
+    """固定バケットのレイテンシヒストグラム
+
+    サンプルを保持しないため、呼び出し回数が増えてもメモリ使用量は一定です。
+    パーセンタイルはバケット内を線形補間して推定します（Prometheusの histogram_quantile と同じ方法）。
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # 最後の要素は上限なし（+Inf）
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """q（0〜1）分位点の推定値（秒）"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.BUCKETS[index - 1] if index > 0 else 0.0
+                upper = self.BUCKETS[index] if index < len(self.BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+        return self.max
+
+    def stats(self) -> LatencyStats:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p90_ms": round(self.quantile(0.9) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+class Metrics:
+    """ツール・HTTPの各段階の所要時間と、ステータスコードごとの件数を集計します
+
+    ツールの実行時間は _instrumented、HTTPの段階（接続待ち・DNS・接続・サーバー応答）は
+    aiohttpのトレースフック、レスポンスの読み込みとデコードやファイル書き込みは各処理で記録します。
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN
+    def __init__(self):
+        self.started = time.time()
+        self.tool_latency: Dict[str, LatencyHistogram] = {}
+        self.tool_errors: Dict[str, Dict[str, int]] = {}
+        self.phase_latency: Dict[str, LatencyHistogram] = {}
+        self.http_status: Dict[int, int] = {}
+        self.network_errors = 0
+        self.http_timeouts = 0
+        self.retries_429 = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.coalesced = 0  # 実行中の同一GETに相乗りした件数
+        self.hedges_sent = 0  # ヘッジとして2回目のリクエストを送った件数
+        self.hedges_won = 0  # 2回目のリクエストが先に成功した件数
+
+    def observe_tool(self, name: str, seconds: float, error: Optional[str] = None) -> None:
+        histogram = self.tool_latency.get(name)
+        if histogram is None:
+            histogram = self.tool_latency[name] = LatencyHistogram()
+        histogram.observe(seconds)
+        if error is not None:
+            errors = self.tool_errors.setdefault(name, {})
+            errors[error] = errors.get(error, 0) + 1
+
+    def observe_phase(self, phase: str, seconds: float) -> None:
+        histogram = self.phase_latency.get(phase)
+        if histogram is None:
+            histogram = self.phase_latency[phase] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def count_status(self, status: int) -> None:
+        self.http_status[status] = self.http_status.get(status, 0) + 1
+
+    async def snapshot(self) -> ServerMetrics:
+        """現在の集計値を返します（レート制限の残量は呼び出し時点の値）"""
+        rate_limits = await self._rate_limits()
+        default = _api_profiles[DEFAULT_PROFILE]
+        return {
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "tools": {
+                name: {**histogram.stats(), "errors": dict(self.tool_errors.get(name, {}))}
+                for name, histogram in sorted(self.tool_latency.items())
+            },
+            "http_phases": {phase: histogram.stats() for phase, histogram in sorted(self.phase_latency.items())},
+            "http_status": {str(status): count for status, count in sorted(self.http_status.items())},
+            "network_errors": self.network_errors,
+            "http_timeouts": self.http_timeouts,
+            "retries_429": self.retries_429,
+            "cache": {"hits": self.cache_hits, "misses": self.cache_misses, "coalesced": self.coalesced},
+            "hedge": {"sent": self.hedges_sent, "won": self.hedges_won},
+            "rate_limit": rate_limits[default.name] if default.name in rate_limits else await self._rate_limit(default.rate_limiter),
+            "profiles": rate_limits
+        }
+
+    @staticmethod
+    async def _rate_limit(limiter: "RateLimiter") -> RateLimitMetrics:
+        # 共有状態では読み出しがSQLiteへの問い合わせになるため、1回の budget() でまとめて読む
+        remaining, blocked_seconds, server_remaining = await limiter.budget()
+        return {
+            "capacity": limiter.capacity,
+            "remaining": remaining,
+            "server_remaining": server_remaining,
+            "blocked_seconds": round(blocked_seconds, 3)
         }
+
+    async def _rate_limits(self) -> Dict[str, RateLimitMetrics]:
+        """APIトークンが設定されているプロファイルごとのレート制限（プロファイル名 → 値）"""
+        return {profile.name: await self._rate_limit(profile.rate_limiter) for profile in _configured_profiles()}
+
+    async def to_prometheus(self) -> str:
+        """Prometheusのテキスト形式（text/plain; version=0.0.4）で出力します"""
+        lines: List[str] = []
+
+        def histogram(name: str, help_text: str, label: str, histograms: Dict[str, LatencyHistogram]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for value, hist in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(LatencyHistogram.BUCKETS, hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {hist.count}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {hist.sum}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {hist.count}')
+
+        def single(name: str, metric_type: str, help_text: str, value: Any) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {value}")
+
+        histogram("chatwork_mcp_tool_duration_seconds", "Tool call duration.", "tool", self.tool_latency)
+        lines.append("# HELP chatwork_mcp_tool_errors_total Tool calls that raised, by exception type.")
+        lines.append("# TYPE chatwork_mcp_tool_errors_total counter")
+        for name, errors in sorted(self.tool_errors.items()):
+            for error, count in sorted(errors.items()):
+                lines.append(f'chatwork_mcp_tool_errors_total{{tool="{name}",error="{error}"}} {count}')
+        histogram("chatwork_mcp_http_phase_duration_seconds", "Duration of each HTTP request phase.", "phase", self.phase_latency)
+        lines.append("# HELP chatwork_mcp_http_responses_total ChatWork API responses by status code.")
+        lines.append("# TYPE chatwork_mcp_http_responses_total counter")
+        for status, count in sorted(self.http_status.items()):
+            lines.append(f'chatwork_mcp_http_responses_total{{status="{status}"}} {count}')
+        single("chatwork_mcp_http_network_errors_total", "counter", "Requests that failed without a response.", self.network_errors)
+        single("chatwork_mcp_http_timeouts_total", "counter", "Requests that exceeded the request or connect timeout.", self.http_timeouts)
+        single("chatwork_mcp_http_retries_429_total", "counter", "Requests retried after a 429 response.", self.retries_429)
+        single("chatwork_mcp_cache_hits_total", "counter", "GET requests served from the response cache.", self.cache_hits)
+        single("chatwork_mcp_cache_misses_total", "counter", "GET requests sent to the API.", self.cache_misses)
+        single("chatwork_mcp_cache_coalesced_total", "counter", "GET requests that joined an identical in-flight request.", self.coalesced)
+        single("chatwork_mcp_hedge_sent_total", "counter", "Hedged second attempts sent for slow GET requests.", self.hedges_sent)
+        single("chatwork_mcp_hedge_won_total", "counter", "Hedged second attempts that answered first.", self.hedges_won)
+        rate_limits = await self._rate_limits()
+        for name, help_text in (
+            ("capacity", "Request budget per rate limit period."),
+            ("remaining", "Requests currently available in the local budget."),
+            ("server_remaining", "Last x-ratelimit-remaining reported by the API."),
+            ("blocked_seconds", "Seconds until requests may be sent again.")
+        ):
+            lines.append(f"# HELP chatwork_mcp_rate_limit_{name} {help_text}")
+            lines.append(f"# TYPE chatwork_mcp_rate_limit_{name} gauge")
+            for profile_name, rate_limit in rate_limits.items():
+                if rate_limit[name] is not None:
+                    lines.append(f'chatwork_mcp_rate_limit_{name}{{profile="{profile_name}"}} {rate_limit[name]}')
+        return "\n".join(lines) + "\n"
+
+# サーバー全体で共有するメトリクス
+_metrics = Metrics()
+
+class ToolTimeoutError(RuntimeError):
+    """ツールの実行時間が上限（CHATWORK_TOOL_TIMEOUT / CHATWORK_TOOL_TIMEOUTS）を超えたエラー"""
+
+# ツール名 → 実行時間の上限秒数（CHATWORK_TOOL_TIMEOUTS の解析結果）
+_tool_timeouts: Optional[Dict[str, float]] = None
+
+def _tool_timeout(name: str) -> Optional[float]:
+    """ツールの実行時間の上限秒数を返します（上限を設けない場合はNone）"""
+    global _tool_timeouts
+    if _tool_timeouts is None:
+        timeouts = {}
+        for item in filter(None, (item.strip() for item in TOOL_TIMEOUTS.split(","))):
+            tool, _, seconds = item.partition("=")
+            try:
+                timeouts[tool.strip()] = float(seconds)
+            except ValueError:
+                raise RuntimeError(f"CHATWORK_TOOL_TIMEOUTS の値が不正です: {item}（ツール名=秒数 のカンマ区切りで指定してください）")
+        _tool_timeouts = timeouts
+    timeout = _tool_timeouts.get(name, 0.0 if name in UNBOUNDED_TOOLS else TOOL_TIMEOUT)
+    return timeout if timeout > 0 else None
+
+def _instrumented(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """ツールの実行時間と、送出した例外の型をメトリクスに記録するデコレータ
+
+    実行時間が上限を超えた場合は、ツールをキャンセルして ToolTimeoutError を送出します。
+    MCPクライアントからリクエストがキャンセルされた場合も同じく、実行中のAPIリクエストまでキャンセルされます。
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        error = None
         try:
-            async with session.get(
-                "https://api.chatwork.com/v2/rooms",
-                headers=headers
-            ) as response:
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+            timeout = _tool_timeout(name)
+            if timeout is None:
+                return await func(*args, **kwargs)
+            try:
+                return await asyncio.wait_for(func(*args, **kwargs), timeout)
+            except asyncio.TimeoutError:
+                raise ToolTimeoutError(
+                    f"{name} が {timeout:g} 秒以内に完了しなかったため中止しました"
+                    "（CHATWORK_TOOL_TIMEOUT / CHATWORK_TOOL_TIMEOUTS で変更できます）"
+                ) from None
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _metrics.observe_tool(name, time.perf_counter() - started, error)
 
-@mcp.tool()
-async def get_room_messages(room_id: int, save_dir_path: str, force: int = 0) -> List[Message]:
-    """チャットのメッセージ一覧を取得します
-    
-    Args:
-        room_id (int): チャットルームのID
+    return wrapper
+
+def _build_trace_config() -> "aiohttp.TraceConfig":
+    """HTTPリクエストの段階ごとの所要時間を記録するトレース設定を作成します
+
+    接続待ち（pool_wait）、DNS解決（dns）、TCP/TLS接続（connect）、ヘッダ送信から
+    レスポンスヘッダ受信まで（server）、リクエスト開始からレスポンスヘッダ受信まで（request）を記録します。
+    """
+    import aiohttp
+    trace_config = aiohttp.TraceConfig()
+
+    def mark(key: str) -> Callable[..., Awaitable[None]]:
+        async def callback(session: "aiohttp.ClientSession", context: Any, params: Any) -> None:
+            setattr(context, key, time.perf_counter())
+        return callback
+
+    def record(key: str, phase: str) -> Callable[..., Awaitable[None]]:
+        async def callback(session: "aiohttp.ClientSession", context: Any, params: Any) -> None:
+            started = getattr(context, key, None)
+            if started is not None:
+                _metrics.observe_phase(phase, time.perf_counter() - started)
+        return callback
+
+    trace_config.on_request_start.append(mark("request_started"))
+    trace_config.on_connection_queued_start.append(mark("queued"))
+    trace_config.on_connection_queued_end.append(record("queued", "pool_wait"))
+    trace_config.on_dns_resolvehost_start.append(mark("dns_started"))
+    trace_config.on_dns_resolvehost_end.append(record("dns_started", "dns"))
+    trace_config.on_connection_create_start.append(mark("connect_started"))
+    trace_config.on_connection_create_end.append(record("connect_started", "connect"))
+    trace_config.on_request_headers_sent.append(mark("headers_sent"))
+    trace_config.on_request_end.append(record("headers_sent", "server"))
+    trace_config.on_request_end.append(record("request_started", "request"))
+    return trace_config
+
+def _write_metrics_file(path: str, text: str) -> None:
+    """Prometheusのテキスト形式のメトリクスをファイルへ書き出します（node_exporterのtextfile collector向け）"""
+    target = Path(path)
+    temp_file = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    temp_file.write_text(text, encoding="utf-8")
+    # 読み取り側が書きかけのファイルを読まないよう、置き換えで反映する
+    os.replace(temp_file, target)
+
+async def _write_metrics_periodically(path: str, interval: float) -> None:
+    """キャンセルされるまで、一定間隔でメトリクスファイルを更新します"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(_write_metrics_file, path, await _metrics.to_prometheus())
+            except (OSError, sqlite3.Error):
+                # 書き出し先の一時的な不具合ではツールの処理を止めず、次回に再試行する
+                pass
+    finally:
+        # 終了時点の値も残す
+        with suppress(OSError, sqlite3.Error):
+            _write_metrics_file(path, await _metrics.to_prometheus())
+
+def _cache_key(profile: str, path: str, params: Optional[Dict[str, Any]]) -> str:
+    """プロファイル名・パス・クエリパラメータからキャッシュキーを生成します
+
+    参照できるルームやタスクはトークンごとに異なるため、プロファイルごとに別のキーにします。
+    """
+    if not params:
+        return f"{profile}|{path}"
+    return f"{profile}|{path}?{urlencode(sorted(params.items()))}"
+
+class JsonCodec:
+    """JSONのデコード・エンコードに使う関数の組
+
+    loads はレスポンスの生のバイト列を受け取ってデコードします（orjson は str への変換を挟みません）。
+    dumps は非ASCII文字をエスケープせずに文字列を返します（ensure_ascii=False 相当）。
+    """
+
+    def __init__(self, name: str, loads: Callable[[bytes], Any], dumps: Callable[[Any], str]):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+def _stdlib_json_codec() -> JsonCodec:
+    # json.loads にバイト列を渡すと文字コードの判定が入りかえって遅いため、UTF-8として変換してから渡す
+    return JsonCodec("json", lambda body: json.loads(body.decode("utf-8")), lambda value: json.dumps(value, ensure_ascii=False))
+
+def _orjson_codec() -> JsonCodec:
+    import orjson
+    return JsonCodec("orjson", orjson.loads, lambda value: orjson.dumps(value).decode("utf-8"))
+
+_JSON_CODECS: Dict[str, Callable[[], JsonCodec]] = {
+    "json": _stdlib_json_codec,
+    "orjson": _orjson_codec
+}
+
+# 最初のデコード時に決定するコーデック（起動時間に影響しないよう読み込みを遅らせる）
+_json_codec: Optional[JsonCodec] = None
+
+def _get_json_codec() -> JsonCodec:
+    """CHATWORK_JSON_CODEC に従ってJSONコーデックを選びます
+
+    auto の場合は orjson がインストールされていれば使い、なければ標準ライブラリの json を使います。
+
+    Raises:
+        RuntimeError: CHATWORK_JSON_CODEC の値が不正な場合、または指定したライブラリがない場合
+    """
+    global _json_codec
+    if _json_codec is None:
+        if JSON_CODEC == "auto":
+            try:
+                _json_codec = _orjson_codec()
+            except ImportError:
+                _json_codec = _stdlib_json_codec()
+        elif JSON_CODEC in _JSON_CODECS:
+            try:
+                _json_codec = _JSON_CODECS[JSON_CODEC]()
+            except ImportError:
+                raise RuntimeError(f"CHATWORK_JSON_CODEC={JSON_CODEC} が指定されていますが、{JSON_CODEC} がインストールされていません")
+        else:
+            raise RuntimeError(f"CHATWORK_JSON_CODEC の値が不正です: {JSON_CODEC}（auto, {', '.join(_JSON_CODECS)} のいずれかを指定してください）")
+    return _json_codec
+
+# 実行中のGETリクエスト（キャッシュキー → 先行リクエストのタスク）
+_inflight_requests: Dict[str, "asyncio.Task[Any]"] = {}
+# 実行中のGETリクエストごとの、結果を待っている呼び出し元の数
+_inflight_waiters: Dict["asyncio.Task[Any]", int] = {}
+
+class RequestNotSentError(RuntimeError):
+    """APIがリクエストを処理しなかったことが確実なエラー
+
+    4xxの応答、429でのリトライの上限超過、接続の確立前の失敗が該当します。
+    5xxの応答や送信後の切断など、書き込みが反映されたか分からないエラーは通常の RuntimeError です。
+    アウトボックスはこの区別により、二重投稿の恐れがない場合だけ再送します。
+
+    Attributes:
+        retryable (bool): 時間をおいて再送すれば成功しうるか（429、接続の失敗）
+    """
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+async def _read_response(response: "aiohttp.ClientResponse", error_messages: Optional[Dict[int, str]]) -> Any:
+    """APIレスポンスのステータスを検査し、JSONを返します（429以外）"""
+    if response.status == 400:
+        error_body = await response.text()
+        raise RequestNotSentError(f"リクエストが不正です: {error_body}")
+    if response.status == 401:
+        raise ValueError("APIトークンが無効です")
+    if error_messages and response.status in error_messages:
+        error_type = RequestNotSentError if response.status < 500 else RuntimeError
+        raise error_type(error_messages[response.status])
+    if not response.ok:
+        error_body = await response.text()
+        error_type = RequestNotSentError if response.status < 500 else RuntimeError
+        raise error_type(f"APIエラー: ステータスコード {response.status}, 詳細: {error_body}")
+    if response.status == 204:
+        return None
+
+    # response.json() は常に標準ライブラリでデコードするため、本文のバイト列をコーデックに渡す
+    started = time.perf_counter()
+    body = await response.read()
+    try:
+        value = _get_json_codec().loads(body)
+    except ValueError as e:
+        raise RuntimeError(f"APIレスポンスの解析に失敗しました: {str(e)}")
+    _metrics.observe_phase("read_decode", time.perf_counter() - started)
+    return value
+
+async def _request_api(
+    method: str,
+    path: str,
+    *,
+    params: Optional[Dict[str, Any]] = None,
+    data: Optional[Dict[str, str]] = None,
+    error_messages: Optional[Dict[int, str]] = None,
+    cache_ttl: float = 0,
+    model: Optional[type] = None,
+    profile: Optional[str] = None,
+    hedge: bool = False,
+    coalesce: bool = True
+) -> Any:
+    """ChatWork APIへリクエストを送信し、レスポンスのJSONを返します
+
+    送信前にレート制限のトークンを取得し、429を受け取った場合はジッター付きの
+    指数バックオフで RATE_LIMIT_MAX_RETRIES 回までリトライします。
+    cache_ttl を指定したGETは、有効期限内であればAPIを呼ばずにキャッシュから返します。
+    同じパス・パラメータのGETが実行中の場合は新たに送信せず、先行リクエストの結果を共有します。
+    結果を待つ呼び出し元が全員キャンセルされた場合は、実行中のリクエストもキャンセルします。
+
+    Args:
+        method (str): HTTPメソッド
+        path (str): エンドポイントのパス（例: "/rooms"）
+        params (Dict[str, Any], optional): クエリパラメータ
+        data (Dict[str, str], optional): フォーム形式で送信するパラメータ
+        error_messages (Dict[int, str], optional): ステータスコードごとのエラーメッセージ（403, 404など）
+        cache_ttl (float, optional): GETのレスポンスをキャッシュする秒数（0の場合はキャッシュしない）
+        model (type, optional): キャッシュに保持する際のレコード型（RoomRecordなど）
+                               指定した場合はdictのままではなくレコードに変換して保持し、メモリを節約します
+        profile (str, optional): リクエストに使うプロファイル名（省略時は CHATWORK_DEFAULT_PROFILE）
+        hedge (bool, optional): 冪等なGETで、CHATWORK_HEDGE_ENABLED=1 の場合にヘッジリクエストを使うか
+        coalesce (bool, optional): 実行中の同じGETと結果を共有するか
+                                   呼び出すたびにサーバー側の状態が進むGET（差分取得など）では False を指定します
+
+    Returns:
+        Any: レスポンスのJSON（204 No Contentの場合はNone）
+
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    api_profile = _get_profile(profile)
+    if method != "GET" or not coalesce:
+        return await _send_request(method, path, params=params, data=data, error_messages=error_messages, profile=api_profile)
+
+    key = _cache_key(api_profile.name, path, params)
+    if cache_ttl > 0:
+        hit, value = await _cache_get(key)
+        if hit:
+            _metrics.cache_hits += 1
+            return _from_records(value)
+
+    task = _inflight_requests.get(key)
+    if task is not None:
+        _metrics.coalesced += 1
+    else:
+        _metrics.cache_misses += 1
+        task = asyncio.ensure_future(_fetch_and_cache(key, path, params, error_messages, cache_ttl, model, api_profile, hedge))
+        _inflight_requests[key] = task
+        task.add_done_callback(lambda done: _finish_inflight(key, done))
+    _inflight_waiters[task] = _inflight_waiters.get(task, 0) + 1
+    try:
+        # 呼び出し元がキャンセルされても、他に待機者がいる間はリクエスト自体を継続する
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # 結果を使う呼び出し元がいなくなった場合は、応答を待たずに接続ごと中止する
+        if _inflight_waiters[task] == 1 and not task.done():
+            task.cancel()
+        raise
+    finally:
+        _inflight_waiters[task] -= 1
+        if not _inflight_waiters[task]:
+            del _inflight_waiters[task]
+
+async def _fetch_and_cache(
+    key: str,
+    path: str,
+    params: Optional[Dict[str, Any]],
+    error_messages: Optional[Dict[int, str]],
+    cache_ttl: float,
+    model: Optional[type],
+    profile: ApiProfile,
+    hedge: bool
+) -> Any:
+    """GETリクエストを送信し、必要に応じて結果をキャッシュします"""
+    generation = await _cache_generation()
+    if hedge and HEDGE_ENABLED:
+        value = await _send_hedged_get(path, params, error_messages, profile)
+    else:
+        value = await _send_request("GET", path, params=params, data=None, error_messages=error_messages, profile=profile)
+    # 送信中に書き込みによる破棄があった場合は、古い可能性があるため保存しない
+    if cache_ttl > 0 and await _cache_generation() == generation:
+        await _cache_set(key, _to_records(value, model) if model is not None else value, cache_ttl)
+    return value
+
+def _finish_inflight(key: str, task: "asyncio.Task[Any]") -> None:
+    """完了したGETリクエストを実行中の一覧から取り除きます"""
+    if _inflight_requests.get(key) is task:
+        del _inflight_requests[key]
+    # 待機者が全員キャンセルされた場合でも、未取得の例外として警告されないようにする
+    if not task.cancelled():
+        task.exception()
+
+async def _send_request(
+    method: str,
+    path: str,
+    *,
+    params: Optional[Dict[str, Any]],
+    data: Optional[Dict[str, str]],
+    error_messages: Optional[Dict[int, str]],
+    profile: ApiProfile
+) -> Any:
+    """プロファイルのレート制限とリトライを適用してAPIへリクエストを送信します（引数は _request_api と同じ）"""
+    import aiohttp
+    session = _get_http_session(profile)
+    rate_limiter = profile.rate_limiter
+    headers = {
+        "X-ChatWorkToken": profile.token
+    }
+    if data is not None:
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        await rate_limiter.acquire()
+        try:
+            async with session.request(
+                method,
+                f"{CHATWORK_API_BASE_URL}{path}",
+                headers=headers,
+                params=params,
+                data=data
+            ) as response:
+                await rate_limiter.update(response.headers)
+                _metrics.count_status(response.status)
+                if response.status != 429:
+                    return await _read_response(response, error_messages)
+
+                reset_wait = _seconds_until_reset(response.headers)
+                await rate_limiter.block(reset_wait)
+                if attempt == RATE_LIMIT_MAX_RETRIES:
+                    raise RequestNotSentError("APIリクエスト制限を超過しました（5分あたり300リクエスト）", retryable=True)
+        except (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError) as e:
+            # 接続を確立できなかった場合は、リクエストは送信されていない
+            _metrics.network_errors += 1
+            if isinstance(e, aiohttp.ConnectionTimeoutError):
+                _metrics.http_timeouts += 1
+                raise RequestNotSentError(f"ChatWork APIへの接続が {CONNECT_TIMEOUT:g} 秒以内に確立できませんでした", retryable=True)
+            raise RequestNotSentError(f"ネットワークエラー: {str(e)}", retryable=True)
+        except asyncio.TimeoutError:
+            # 送信後に応答が止まった場合は、書き込みが反映されたか分からない
+            _metrics.network_errors += 1
+            _metrics.http_timeouts += 1
+            raise RuntimeError(f"ChatWork APIが {REQUEST_TIMEOUT:g} 秒以内に応答しませんでした（CHATWORK_REQUEST_TIMEOUT で変更できます）")
+        except aiohttp.ClientError as e:
+            _metrics.network_errors += 1
+            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+
+        _metrics.retries_429 += 1
+        # ジッター付き指数バックオフ（解除時刻が分かる場合はそれ以上待つ）
+        backoff = RATE_LIMIT_RETRY_BASE_DELAY * (2 ** attempt)
+        await asyncio.sleep(min(max(reset_wait, backoff) + random.uniform(0, backoff), RATE_LIMIT_RETRY_MAX_DELAY))
+
+class HedgePolicy:
+    """ヘッジリクエストを送るかどうかと、送るまでの待機時間を決めます
+
+    エンドポイント（パスの数値をまとめたもの）ごとにレイテンシを計測し、HEDGE_PERCENTILE パーセンタイルを
+    待機時間とします。2回目の送信は対象のリクエスト1件ごとに HEDGE_MAX_RATIO 件分の枠が貯まる方式で数を
+    抑え、レート制限の残量が HEDGE_RESERVED_REQUESTS 以下の場合や送信停止中は送りません。
+    """
+
+    MAX_CREDIT = 10.0  # 枠を貯められる上限（静かな期間の後に2回目の送信が集中しないようにする）
+
+    def __init__(self, percentile: float, min_delay: float, min_samples: int, max_ratio: float, reserved: int):
+        self.quantile = percentile / 100
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.reserved = reserved
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self._credit = 0.0
+
+    @staticmethod
+    def route(path: str) -> str:
+        """パスの数値部分をまとめたエンドポイント名（例: /rooms/{id}/messages/{id}）"""
+        return re.sub(r"/\d+", "/{id}", path)
+
+    def delay(self, route: str) -> Optional[float]:
+        """2回目を送るまでの待機秒数（計測数が足りない場合はNone）
+
+        対象のリクエストごとに1回呼び出します。
+        """
+        self._credit = min(self._credit + self.max_ratio, self.MAX_CREDIT)
+        histogram = self.latency.get(route)
+        if histogram is None or histogram.count < self.min_samples:
+            return None
+        return max(histogram.quantile(self.quantile), self.min_delay)
+
+    async def acquire(self, rate_limiter: Union[RateLimiter, SharedRateLimiter]) -> bool:
+        """2回目を送ってよい場合は枠を1つ消費してTrueを返します"""
+        if self._credit < 1:
+            return False
+        remaining, blocked_seconds, _ = await rate_limiter.budget()
+        if blocked_seconds > 0 or remaining <= self.reserved or self._credit < 1:
+            return False
+        self._credit -= 1
+        return True
+
+    def observe(self, route: str, seconds: float) -> None:
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = LatencyHistogram()
+        histogram.observe(seconds)
+
+_hedge_policy = HedgePolicy(HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, HEDGE_MAX_RATIO, HEDGE_RESERVED_REQUESTS)
+
+async def _send_hedged_get(
+    path: str,
+    params: Optional[Dict[str, Any]],
+    error_messages: Optional[Dict[int, str]],
+    profile: ApiProfile
+) -> Any:
+    """冪等なGETを送信し、応答が遅い場合は2回目を送って先に成功した方の結果を返します"""
+    route = _hedge_policy.route(path)
+    started = time.perf_counter()
+    attempts = [asyncio.ensure_future(
+        _send_request("GET", path, params=params, data=None, error_messages=error_messages, profile=profile)
+    )]
+    try:
+        delay = _hedge_policy.delay(route)
+        if delay is not None:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and await _hedge_policy.acquire(profile.rate_limiter):
+                _metrics.hedges_sent += 1
+                attempts.append(asyncio.ensure_future(
+                    _send_request("GET", path, params=params, data=None, error_messages=error_messages, profile=profile)
+                ))
+
+        pending = set(attempts)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in sorted(done, key=attempts.index):
+                if attempt.exception() is None:
+                    if attempt is not attempts[0]:
+                        _metrics.hedges_won += 1
+                    # 2回目が先に成功した場合は1回目の経過時間（実際の所要時間の下限）を記録し、分布の裾を保つ
+                    _hedge_policy.observe(route, time.perf_counter() - started)
+                    return attempt.result()
+                error = error or attempt.exception()
+        raise error
+    finally:
+        for attempt in attempts:
+            if not attempt.done():
+                attempt.cancel()
+            elif not attempt.cancelled():
+                attempt.exception()
+
+# ChatWork記法のタグ（[To:1]、[rp aid=1 to=2-3]、[info]...[/info] など）
+_MARKUP_TAG_PATTERN = re.compile(
+    r"\[(/?)(To|toall|rp|qtmeta|qt|info|title|code|hr|task|download|preview|piconname|picon|dtext)"
+    r"((?:[: ][^\]]*)?)\]"
+)
+_MARKUP_ATTR_PATTERN = re.compile(r"(\w+)=([^\s\]]+)")
+# 閉じタグを持つタグ（codeは内部を解析しないため別扱い）
+_MARKUP_CONTAINER_TAGS = {"info", "title", "qt", "task", "download"}
+
+def _parse_markup_attrs(arg: str) -> Dict[str, str]:
+    """タグの引数（":123" や " aid=1 to=2-3"）を辞書に変換します"""
+    if arg.startswith(":"):
+        return {"id": arg[1:]}
+    return dict(_MARKUP_ATTR_PATTERN.findall(arg))
+
+def _markup_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value is not None and value.isdigit() else None
+
+def parse_chatwork_markup(body: str) -> ParsedMessage:
+    """ChatWork記法のメッセージ本文を1回の走査で解析し、構造化した形式に変換します
+
+    宛先（[To:id]、[toall]）、返信（[rp ...]）、引用（[qt][qtmeta ...]...[/qt]）、
+    情報ブロック（[info][title]...[/title]...[/info]）、コードブロック（[code]...[/code]）、
+    区切り線（[hr]）を扱い、それ以外の文字列はプレーンテキストとして残します。
+    対応する開始タグのない閉じタグは無視し、閉じられていないタグは本文の終わりで閉じます。
+
+    Args:
+        body (str): メッセージ本文
+
+    Returns:
+        ParsedMessage: 解析結果
+    """
+    result: ParsedMessage = {
+        "text": "",
+        "mentions": [],
+        "to_all": False,
+        "replies": [],
+        "quotes": [],
+        "infos": [],
+        "code_blocks": []
+    }
+    root: List[str] = []
+    # 開いているタグのスタック（タグ名, 属性, タグ内の文字列）
+    stack: List[Tuple[str, Dict[str, str], List[str]]] = []
+    # スタック中のタグ名ごとの数（対応する開始タグの有無や引用内かどうかを、スタックを走査せずに判定する）
+    open_counts: Counter = Counter()
+    parts = root
+
+    def close_tag() -> None:
+        nonlocal parts
+        tag, attrs, inner = stack.pop()
+        open_counts[tag] -= 1
+        parts = stack[-1][2] if stack else root
+        text = "".join(inner).strip()
+        if tag == "title" and stack and stack[-1][0] == "info":
+            stack[-1][1]["title"] = text
+        elif tag == "info":
+            result["infos"].append({"title": attrs.get("title", ""), "body": text})
+        elif tag == "qt":
+            result["quotes"].append({
+                "account_id": _markup_int(attrs.get("aid")),
+                "time": _markup_int(attrs.get("time")),
+                "text": text
+            })
+        else:
+            parts.append(text)
+
+    pos = 0
+    while True:
+        match = _MARKUP_TAG_PATTERN.search(body, pos)
+        if match is None:
+            parts.append(body[pos:])
+            break
+        parts.append(body[pos:match.start()])
+        pos = match.end()
+        closing, tag, arg = match.groups()
+
+        if closing:
+            # 対応する開始タグまでのタグを閉じる（なければ無視）
+            if open_counts[tag]:
+                while stack[-1][0] != tag:
+                    close_tag()
+                close_tag()
+        elif tag == "code":
+            # コードブロックの内部はタグとして解析しない
+            end = body.find("[/code]", pos)
+            code = (body[pos:] if end < 0 else body[pos:end]).strip("\n")
+            pos = len(body) if end < 0 else end + len("[/code]")
+            result["code_blocks"].append(code)
+            parts.append(f"\n```\n{code}\n```\n")
+        elif tag in _MARKUP_CONTAINER_TAGS:
+            stack.append((tag, _parse_markup_attrs(arg), []))
+            open_counts[tag] += 1
+            parts = stack[-1][2]
+        elif tag == "To":
+            # 引用内の宛先はこのメッセージの宛先として扱わない
+            account_id = _markup_int(arg[1:])
+            in_quote = open_counts["qt"] > 0
+            if account_id is not None and not in_quote and account_id not in result["mentions"]:
+                result["mentions"].append(account_id)
+            parts.append("@")
+        elif tag == "toall":
+            result["to_all"] = True
+            parts.append("@all ")
+        elif tag == "rp":
+            attrs = _parse_markup_attrs(arg)
+            room_id, _, message_id = attrs.get("to", "").partition("-")
+            result["replies"].append({
+                "account_id": _markup_int(attrs.get("aid")),
+                "room_id": _markup_int(room_id),
+                "message_id": message_id or None
+            })
+            parts.append("Re @")
+        elif tag == "qtmeta":
+            if stack and stack[-1][0] == "qt":
+                stack[-1][1].update(_parse_markup_attrs(arg))
+        elif tag == "hr":
+            parts.append("\n----\n")
+        # picon, piconname, preview, dtext は表示用のタグのため本文からは除く
+
+    while stack:
+        close_tag()
+
+    text = "".join(root)
+    result["text"] = re.sub(r"\n{3,}", "\n\n", text).strip()
+    return result
+
+def _markup_plain_text(body: str) -> str:
+    """メッセージ本文からタグを除き、引用・情報ブロックを含めた全文を返します（検索用）"""
+    parsed = parse_chatwork_markup(body)
+    texts = [parsed["text"]]
+    texts.extend(quote["text"] for quote in parsed["quotes"])
+    for info in parsed["infos"]:
+        texts.extend((info["title"], info["body"]))
+    return "\n".join(texts)
+
+def _with_parsed_markup(message: Message) -> Dict[str, Any]:
+    """メッセージの本文を解析済みの構造化形式に置き換えた複製を返します"""
+    parsed = dict(message)
+    parsed["body"] = parse_chatwork_markup(message["body"])
+    return parsed
+
+def _project_fields(item: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """指定した項目だけを含む辞書を返します（"account.name" のようなネストした項目も指定可）"""
+    projected: Dict[str, Any] = {}
+    for field in fields:
+        key, _, sub_key = field.partition(".")
+        if key not in item:
+            continue
+        value = item[key]
+        if not sub_key:
+            projected[key] = value
+        elif isinstance(value, dict) and sub_key in value:
+            target = projected.setdefault(key, {})
+            # 同じ項目全体が既に指定されている場合は元の辞書を書き換えない
+            if target is not value:
+                target[sub_key] = value[sub_key]
+    return projected
+
+def _to_compact_table(items: List[Dict[str, Any]]) -> CompactTable:
+    """辞書のリストを列形式の表に変換します
+
+    アカウント（account_idを持つ辞書）とルーム（room_idを持つ辞書）は accounts / rooms に
+    1度だけ記載し、行にはそのIDだけを入れます。
+    """
+    columns: List[str] = []
+    column_index: Dict[str, int] = {}
+    accounts: Dict[str, Account] = {}
+    rooms: Dict[str, Room] = {}
+    encoded_items = []
+    for item in items:
+        encoded = {}
+        for key, value in item.items():
+            if isinstance(value, dict) and "account_id" in value:
+                accounts.setdefault(str(value["account_id"]), {k: v for k, v in value.items() if k != "account_id"})
+                value = value["account_id"]
+            elif isinstance(value, dict) and "room_id" in value:
+                rooms.setdefault(str(value["room_id"]), {k: v for k, v in value.items() if k != "room_id"})
+                value = value["room_id"]
+            if key not in column_index:
+                column_index[key] = len(columns)
+                columns.append(key)
+            encoded[key] = value
+        encoded_items.append(encoded)
+    return {
+        "columns": columns,
+        "rows": [[encoded.get(column) for column in columns] for encoded in encoded_items],
+        "accounts": accounts,
+        "rooms": rooms
+    }
+
+def _shape_list(
+    items: List[Dict[str, Any]],
+    fields: Optional[List[str]],
+    compact: int
+) -> Union[List[Dict[str, Any]], CompactTable]:
+    """一覧系ツールの結果に項目の絞り込みと列形式への変換を適用します"""
+    if fields:
+        items = [_project_fields(item, fields) for item in items]
+    if compact == 1:
+        return _to_compact_table(items)
+    return items
+
+class MessageStore:
+    """取得したメッセージを (room_id, message_id) 単位で蓄積するSQLiteのローカルストア
+
+    差分取得（force=0）で得たメッセージも含めて全件を追記・更新するため、
+    APIを呼ばずに過去のメッセージを参照できます。編集されたメッセージは
+    update_time が新しい場合のみ上書きし、以前の本文は message_history に残します。
+    ブロッキングI/Oのため、非同期処理からは asyncio.to_thread 経由で呼び出してください。
+    """
+
+    _INDEX_VERSION = 1  # 全文検索インデックスの形式（変更時は既存のインデックスを作り直す）
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            room_id INTEGER NOT NULL,
+            message_id TEXT NOT NULL,
+            account_id INTEGER NOT NULL,
+            account_name TEXT NOT NULL,
+            avatar_image_url TEXT NOT NULL,
+            body TEXT NOT NULL,
+            send_time INTEGER NOT NULL,
+            update_time INTEGER NOT NULL,
+            PRIMARY KEY (room_id, message_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_room_send_time ON messages (room_id, send_time);
+        CREATE TABLE IF NOT EXISTS message_history (
+            room_id INTEGER NOT NULL,
+            message_id TEXT NOT NULL,
+            body TEXT NOT NULL,
+            update_time INTEGER NOT NULL,
+            PRIMARY KEY (room_id, message_id, update_time)
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_messages_history
+        BEFORE UPDATE OF body ON messages
+        WHEN old.body != new.body
+        BEGIN
+            INSERT OR IGNORE INTO message_history (room_id, message_id, body, update_time)
+            VALUES (old.room_id, old.message_id, old.body, old.update_time);
+        END;
+        CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5 (
+            terms, tokenize = 'unicode61 remove_diacritics 0'
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_messages_index_insert
+        AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO message_index (rowid, terms) VALUES (new.rowid, cw_search_terms(new.body));
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_messages_index_update
+        AFTER UPDATE OF body ON messages
+        WHEN old.body != new.body
+        BEGIN
+            DELETE FROM message_index WHERE rowid = old.rowid;
+            INSERT INTO message_index (rowid, terms) VALUES (new.rowid, cw_search_terms(new.body));
+        END;
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # ワーカースレッドから利用するため、スレッド間の排他はロックで行う
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 全文検索インデックスはトリガーから更新するため、分割関数を先に登録する
+        self._conn.create_function(
+            "cw_search_terms", 1, lambda body: " ".join(_search_terms(_markup_plain_text(body))), deterministic=True
+        )
+        self._conn.executescript(self._SCHEMA)
+        with self._conn:
+            # 記法のタグを含めて索引付けされた旧形式のインデックスは作り直す
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] < self._INDEX_VERSION:
+                self._conn.execute("DELETE FROM message_index")
+                self._conn.execute(f"PRAGMA user_version = {self._INDEX_VERSION}")
+            # インデックス導入前に蓄積されたメッセージを索引付け
+            self._conn.execute(
+                """
+                INSERT INTO message_index (rowid, terms)
+                SELECT rowid, cw_search_terms(body) FROM messages
+                WHERE rowid NOT IN (SELECT rowid FROM message_index)
+                """
+            )
+        self._lock = threading.Lock()
+
+    def upsert(self, room_id: int, messages: List[MessageRecord]) -> None:
+        """メッセージを追加し、更新日時が新しいものは上書きします"""
+        rows = [
+            (
+                room_id,
+                str(msg.message_id),
+                msg.account.account_id,
+                msg.account.name,
+                msg.account.avatar_image_url,
+                msg.body,
+                msg.send_time,
+                msg.update_time if msg.update_time is not _MISSING else 0
+            )
+            for msg in messages
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO messages (
+                    room_id, message_id, account_id, account_name, avatar_image_url,
+                    body, send_time, update_time
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (room_id, message_id) DO UPDATE SET
+                    account_name = excluded.account_name,
+                    avatar_image_url = excluded.avatar_image_url,
+                    body = excluded.body,
+                    update_time = excluded.update_time
+                WHERE excluded.update_time > messages.update_time
+                """,
+                rows
+            )
+
+    def query(self, room_id: int, limit: int, since: Optional[int] = None) -> List[MessageRecord]:
+        """ルームのメッセージを送信日時の昇順で返します
+
+        Args:
+            room_id (int): チャットルームのID
+            limit (int): 最大件数（sinceがない場合は最新のlimit件）
+            since (int, optional): この日時（UNIXタイムスタンプ）以降に送信されたメッセージのみ返す
+        """
+        with self._lock:
+            if since is None:
+                rows = self._conn.execute(
+                    """
+                    SELECT * FROM (
+                        SELECT message_id, account_id, account_name, avatar_image_url, body, send_time, update_time
+                        FROM messages WHERE room_id = ?
+                        ORDER BY send_time DESC, message_id DESC LIMIT ?
+                    ) ORDER BY send_time, message_id
+                    """,
+                    (room_id, limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    """
+                    SELECT message_id, account_id, account_name, avatar_image_url, body, send_time, update_time
+                    FROM messages WHERE room_id = ? AND send_time >= ?
+                    ORDER BY send_time, message_id LIMIT ?
+                    """,
+                    (room_id, since, limit)
+                ).fetchall()
+        return [self._to_record(*row) for row in rows]
+
+    @staticmethod
+    def _to_record(
+        message_id: str,
+        account_id: int,
+        account_name: str,
+        avatar_image_url: str,
+        body: str,
+        send_time: int,
+        update_time: int
+    ) -> MessageRecord:
+        """行をメッセージのレコードに変換します（アカウント情報は共有ディレクトリのものを参照）"""
+        record = MessageRecord.__new__(MessageRecord)
+        record.message_id = message_id
+        record.account = _account_directory.intern(account_id, account_name, avatar_image_url)
+        record.body = body
+        record.send_time = send_time
+        record.update_time = update_time
+        record.extra = None
+        return record
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        room_id: Optional[int] = None,
+        account_id: Optional[int] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None
+    ) -> List[MessageSearchResult]:
+        """全文検索インデックスからメッセージを検索し、関連度順に返します
+
+        Args:
+            query (str): 検索語（空白区切りの語は全て含むものを検索）
+            limit (int): 最大件数
+            room_id (int, optional): 対象とするチャットルームのID
+            account_id (int, optional): 対象とする投稿者のアカウントID
+            since (int, optional): この日時（UNIXタイムスタンプ）以降に送信されたメッセージのみ対象
+            until (int, optional): この日時（UNIXタイムスタンプ）より前に送信されたメッセージのみ対象
+        """
+        match = _search_match_expression(query)
+        if not match:
+            return []
+        conditions = ["message_index MATCH ?"]
+        args: List[Any] = [match]
+        for column, operator, value in (
+            ("m.room_id", "=", room_id),
+            ("m.account_id", "=", account_id),
+            ("m.send_time", ">=", since),
+            ("m.send_time", "<", until)
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                args.append(value)
+        args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT m.room_id, m.message_id, m.account_id, m.account_name, m.avatar_image_url,
+                       m.body, m.send_time, m.update_time, bm25(message_index) AS score
+                FROM message_index JOIN messages AS m ON m.rowid = message_index.rowid
+                WHERE {" AND ".join(conditions)}
+                ORDER BY score, m.send_time DESC
+                LIMIT ?
+                """,
+                args
+            ).fetchall()
+        return [
+            {"room_id": row[0], **self._to_record(*row[1:8]).to_dict(), "score": row[8]}
+            for row in rows
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# 検索語の抽出（英数字は単語単位、それ以外の文字の連続は日本語などとしてbigramに分割）
+_SEARCH_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[^\W_a-z0-9]+")
+
+def _search_terms(text: str) -> List[str]:
+    """検索インデックス用にテキストを語へ分割します
+
+    日本語のように単語の区切りがない文字の連続は2文字ずつ（bigram）に分割し、
+    末尾の1文字も語として加えます。これにより1文字の検索語も前方一致で検索できます。
+    """
+    terms = []
+    for token in _SEARCH_TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if token.isascii():
+            terms.append(token)
+            continue
+        terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+        terms.append(token[-1])
+    return terms
+
+def _search_match_expression(query: str) -> str:
+    """検索語をFTS5のMATCH式（全ての語を含む）に変換します"""
+    expressions = []
+    for token in _SEARCH_TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", query).lower()):
+        if token.isascii():
+            expressions.append(f'"{token}"')
+        elif len(token) == 1:
+            expressions.append(f'"{token}"*')
+        else:
+            expressions.extend(f'"{token[i:i + 2]}"' for i in range(len(token) - 1))
+    return " ".join(expressions)
+
+# 保存先ディレクトリごとに開いたローカルストア
+_message_stores: Dict[str, MessageStore] = {}
+# 保存先ディレクトリごとのローカルストアを開く処理のロック（同時に呼ばれても1回だけ開く）
+_message_store_locks: Dict[str, asyncio.Lock] = {}
+
+async def _get_message_store(normalized_path: str) -> MessageStore:
+    """保存先ディレクトリのローカルストアを取得します（未作成の場合は作成）
+
+    初めて開く際は未索引のメッセージ（インデックスの形式を更新した後はストア全体）を索引付けするため、
+    イベントループを止めないようワーカースレッドで開きます。
+    """
+    store = _message_stores.get(normalized_path)
+    if store is not None:
+        return store
+    async with _message_store_locks.setdefault(normalized_path, asyncio.Lock()):
+        store = _message_stores.get(normalized_path)
+        if store is None:
+            store = await asyncio.to_thread(MessageStore, Path(normalized_path) / MESSAGE_STORE_FILENAME)
+            _message_stores[normalized_path] = store
+    return store
+
+def _close_message_stores() -> None:
+    """開いている全てのローカルストアを閉じます"""
+    for store in _message_stores.values():
+        store.close()
+    _message_stores.clear()
+
+class ArchiveBlock:
+    """アーカイブのインデックスの1エントリ（1ブロック分）"""
+
+    __slots__ = ("offset", "length", "count", "min_send_time", "max_send_time", "min_message_id", "max_message_id")
+
+    def __init__(
+        self, offset: int, length: int, count: int,
+        min_send_time: int, max_send_time: int, min_message_id: int, max_message_id: int
+    ):
+        self.offset = offset
+        self.length = length  # ブロックヘッダを含むバイト数
+        self.count = count
+        self.min_send_time = min_send_time
+        self.max_send_time = max_send_time
+        self.min_message_id = min_message_id  # メッセージIDを持たないメッセージ（txtから変換）だけの場合は0
+        self.max_message_id = max_message_id
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+    def covers_time(self, since: Optional[int], until: Optional[int]) -> bool:
+        return (since is None or self.max_send_time >= since) and (until is None or self.min_send_time < until)
+
+    def covers_id(self, message_id: int) -> bool:
+        return self.min_message_id <= message_id <= self.max_message_id
+
+class MessageArchive:
+    """ルームのメッセージを圧縮ブロックに格納する追記型のアーカイブ
+
+    データファイル（messages.cwa）には、メッセージをAPIのレスポンスと同じ形式のJSONで1行1件にし、
+    最大 block_messages 件ごとにzlibで圧縮したブロックを追記します。各ブロックは BLOCK_HEADER
+    （マジック・圧縮後の長さ・件数）で始まります。インデックス（messages.cwa.idx）はブロックごとの
+    固定長エントリ（位置・長さ・件数・送信日時とメッセージIDの範囲）の配列で、読み出し時は
+    メモリマップしたインデックスから条件に当てはまるブロックを選び、そのブロックだけを展開します。
+
+    追記は、末尾のブロックに空きがあればそのブロックにまとめ直します。まとめ直したブロックは、今回の追記で
+    書き込む範囲より後ろへ先に書いてインデックスをそちらへ向けてから元の位置に書くため、書き換えの間も
+    インデックスは常に書き込みを終えたブロックを指し、途中で終了してもアーカイブは壊れません
+    （インデックスが指していない末尾のデータは次の追記で切り詰めます）。
+    ブロッキングI/Oのため、非同期処理からは asyncio.to_thread 経由で呼び出してください。
+    """
+
+    INDEX_HEADER = struct.Struct("<4sI")  # マジック, 形式のバージョン
+    INDEX_ENTRY = struct.Struct("<QIIqqqq")  # ArchiveBlock の各項目
+    BLOCK_HEADER = struct.Struct("<4sII")  # マジック, 圧縮後の長さ, 件数
+    INDEX_MAGIC = b"CWAI"
+    BLOCK_MAGIC = b"CWAB"
+    VERSION = 1
+
+    def __init__(self, data_path: Path, block_messages: int):
+        self.data_path = data_path
+        self.index_path = data_path.with_name(data_path.name + ".idx")
+        self.block_messages = max(block_messages, 1)
+
+    @property
+    def size(self) -> int:
+        """データファイルとインデックスの合計バイト数"""
+        return sum(path.stat().st_size for path in (self.data_path, self.index_path) if path.exists())
+
+    @contextmanager
+    def _locked(self, shared: bool = False) -> Iterator[None]:
+        """同じアーカイブへのアクセスを、スレッド間とプロセス間（POSIXのみ）で排他します
+
+        追記は末尾のブロックやファイルを書き換えるため、読み出しも shared=True でロックを取ります
+        （プロセス間では読み出しどうしは同時に行えます）。
+        """
+        with _archive_locks.setdefault(self.data_path, threading.Lock()):
+            if not shared:
+                self.data_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                import fcntl
+            except ImportError:  # Windows ではプロセス間の排他を行わない
+                yield
+                return
+            # ルームのディレクトリをロックする（ロック用のファイルを増やさない）
+            fd = os.open(self.data_path.parent, os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def blocks(self) -> List[ArchiveBlock]:
+        """全ブロックのエントリを返します"""
+        if not self.index_path.exists():
+            return []
+        with self._locked(shared=True):
+            return self._read_index()
+
+    def _read_index(self) -> List[ArchiveBlock]:
+        """インデックスをメモリマップして、全ブロックのエントリを返します（ロックを取った状態で呼び出します。書きかけのエントリは無視）"""
+        if not self.index_path.exists():
+            return []
+        with open(self.index_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < self.INDEX_HEADER.size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, version = self.INDEX_HEADER.unpack_from(mapped)
+                if magic != self.INDEX_MAGIC or version != self.VERSION:
+                    raise RuntimeError(f"メッセージアーカイブのインデックスの形式が不正です: {self.index_path}")
+                count = (len(mapped) - self.INDEX_HEADER.size) // self.INDEX_ENTRY.size
+                return [
+                    ArchiveBlock(*self.INDEX_ENTRY.unpack_from(mapped, self.INDEX_HEADER.size + i * self.INDEX_ENTRY.size))
+                    for i in range(count)
+                ]
+
+    def _read_block(self, f: Any, block: ArchiveBlock) -> List[Dict[str, Any]]:
+        f.seek(block.offset)
+        try:
+            magic, length, count = self.BLOCK_HEADER.unpack(f.read(self.BLOCK_HEADER.size))
+            if magic == self.BLOCK_MAGIC and self.BLOCK_HEADER.size + length == block.length and count == block.count:
+                loads = _get_json_codec().loads
+                return [loads(line) for line in zlib.decompress(f.read(length)).split(b"\n")]
+        except (struct.error, zlib.error, ValueError):
+            pass
+        raise RuntimeError(f"メッセージアーカイブが壊れています: {self.data_path}（位置 {block.offset}）")
+
+    @staticmethod
+    def _encode_block(messages: List[Dict[str, Any]]) -> Tuple[bytes, Tuple[int, int, int, int]]:
+        """ブロックのバイト列と、(送信日時の最小, 最大, メッセージIDの最小, 最大) を返します"""
+        dumps = _get_json_codec().dumps
+        body = zlib.compress("\n".join(dumps(message) for message in messages).encode("utf-8"))
+        send_times = [message.get("send_time") or 0 for message in messages]
+        message_ids = [_archive_message_id(message) for message in messages]
+        message_ids = [message_id for message_id in message_ids if message_id] or [0]
+        header = MessageArchive.BLOCK_HEADER.pack(MessageArchive.BLOCK_MAGIC, len(body), len(messages))
+        return header + body, (min(send_times), max(send_times), min(message_ids), max(message_ids))
+
+    @staticmethod
+    def _message_key(message: Dict[str, Any]) -> Tuple[Any, ...]:
+        """重複の判定に使うキー（メッセージIDがない場合は送信日時と本文）"""
+        message_id = _archive_message_id(message)
+        return ("id", message_id) if message_id else ("text", message.get("send_time"), message.get("body"))
+
+    def _new_messages(self, f: Any, blocks: List[ArchiveBlock], messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """アーカイブにまだないメッセージだけを返します（候補のブロックだけを展開して確認）"""
+        max_message_id = max((block.max_message_id for block in blocks), default=0)
+        block_keys: Dict[int, set] = {}
+        seen = set()
+        new_messages = []
+        for message in messages:
+            key = self._message_key(message)
+            if key in seen:
+                continue
+            seen.add(key)
+            message_id = key[1] if key[0] == "id" else 0
+            if not message_id or message_id <= max_message_id:
+                send_time = message.get("send_time") or 0
+                candidates = [
+                    i for i, block in enumerate(blocks)
+                    if (block.covers_id(message_id) if message_id else block.covers_time(send_time, send_time + 1))
+                ]
+                for i in candidates:
+                    if i not in block_keys:
+                        block_keys[i] = {self._message_key(stored) for stored in self._read_block(f, blocks[i])}
+                if any(key in block_keys[i] for i in candidates):
+                    continue
+            new_messages.append(message)
+        return new_messages
+
+    def _write_index_entries(self, index_file: Any, start: int, blocks: List[ArchiveBlock]) -> None:
+        index_file.seek(self.INDEX_HEADER.size + start * self.INDEX_ENTRY.size)
+        for block in blocks:
+            index_file.write(self.INDEX_ENTRY.pack(
+                block.offset, block.length, block.count,
+                block.min_send_time, block.max_send_time, block.min_message_id, block.max_message_id
+            ))
+        index_file.flush()
+        os.fsync(index_file.fileno())
+
+    def append(self, messages: List[Dict[str, Any]]) -> int:
+        """メッセージを追記します（アーカイブに既にあるメッセージは除きます）
+
+        Args:
+            messages (List[Dict[str, Any]]): APIのレスポンスと同じ形式のメッセージ
+
+        Returns:
+            int: 追記した件数
+        """
+        if not messages:
+            return 0
+        with self._locked():
+            blocks = self._read_index()
+            with open(self.data_path, "r+b" if self.data_path.exists() else "w+b") as f, \
+                    open(self.index_path, "r+b" if self.index_path.exists() else "w+b") as index_file:
+                messages = self._new_messages(f, blocks, messages)
+                if not messages:
+                    return 0
+                if not blocks:
+                    index_file.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, self.VERSION))
+                # インデックスが指していない書きかけのデータとエントリを切り詰める
+                end = blocks[-1].end if blocks else 0
+                f.truncate(end)
+                index_file.truncate(self.INDEX_HEADER.size + len(blocks) * self.INDEX_ENTRY.size)
+
+                appended = len(messages)
+                position = end
+                slot = len(blocks)
+                if blocks and blocks[-1].count < self.block_messages:
+                    # 空きのある末尾のブロックは、新しいメッセージとまとめて書き直す
+                    tail = blocks[-1]
+                    messages = self._read_block(f, tail) + messages
+                    position, slot = tail.offset, slot - 1
+                chunks = [messages[i:i + self.block_messages] for i in range(0, len(messages), self.block_messages)]
+                encoded = [(self._encode_block(chunk), len(chunk)) for chunk in chunks]
+                write_end = position + sum(len(data) for (data, _), _ in encoded)
+                if slot < len(blocks):
+                    # 元のブロックを上書きする前に、今回書き込む範囲より後ろへ同じ内容を書いてインデックスをそちらへ向ける
+                    (data, stats), count = encoded[0]
+                    staged = ArchiveBlock(max(end, write_end), len(data), count, *stats)
+                    f.seek(staged.offset)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._write_index_entries(index_file, slot, [staged])
+                new_blocks = []
+                f.seek(position)
+                for (data, stats), count in encoded:
+                    f.write(data)
+                    new_blocks.append(ArchiveBlock(position, len(data), count, *stats))
+                    position += len(data)
+                f.flush()
+                os.fsync(f.fileno())
+                self._write_index_entries(index_file, slot, new_blocks)
+                index_file.truncate(self.INDEX_HEADER.size + (slot + len(new_blocks)) * self.INDEX_ENTRY.size)
+                # 書き直しの退避先は、インデックスが新しいブロックを指した後で切り詰める
+                f.truncate(position)
+        return appended
+
+    def query(
+        self,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        message_ids: Optional[List[int]] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """送信日時の範囲やメッセージIDでメッセージを読み出します
+
+        範囲とIDに当てはまるブロックだけを展開します。limit を指定した場合、since があれば
+        古い順、なければ新しい順にブロックを読み、limit 件が確定した時点で残りのブロックは読みません。
+
+        Returns:
+            Tuple[List[Dict[str, Any]], int]: 送信日時の昇順のメッセージ（最大 limit 件）と、展開したブロック数
+        """
+        if not self.index_path.exists():
+            return [], 0
+        with self._locked(shared=True):
+            return self._query(since, until, message_ids, limit)
+
+    def _query(
+        self,
+        since: Optional[int],
+        until: Optional[int],
+        message_ids: Optional[List[int]],
+        limit: Optional[int]
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        ids = set(message_ids) if message_ids else None
+        blocks = [
+            block for block in self._read_index()
+            if block.covers_time(since, until) and (ids is None or any(block.covers_id(i) for i in ids))
+        ]
+        oldest_first = since is not None or limit is None
+        blocks.sort(key=(lambda block: block.min_send_time) if oldest_first else (lambda block: -block.max_send_time))
+
+        def sort_key(message: Dict[str, Any]) -> Tuple[int, int]:
+            return message.get("send_time") or 0, _archive_message_id(message)
+
+        results: List[Dict[str, Any]] = []
+        read = 0
+        if not blocks:
+            return results, read
+        with open(self.data_path, "rb") as f:
+            for block in blocks:
+                if limit is not None and len(results) >= limit:
+                    boundary = results[limit - 1]["send_time"] if oldest_first else results[-limit]["send_time"]
+                    if (block.min_send_time > boundary) if oldest_first else (block.max_send_time < boundary):
+                        break
+                read += 1
+                for message in self._read_block(f, block):
+                    send_time = message.get("send_time") or 0
+                    if (since is not None and send_time < since) or (until is not None and send_time >= until):
+                        continue
+                    if ids is not None and _archive_message_id(message) not in ids:
+                        continue
+                    results.append(message)
+                results.sort(key=sort_key)
+        if limit is not None:
+            results = results[:limit] if oldest_first else results[-limit:]
+        return results, read
+
+# アーカイブのファイルごとのロック
+_archive_locks: Dict[Path, threading.Lock] = {}
+
+def _archive_message_id(message: Mapping[str, Any]) -> int:
+    """インデックスに使う数値のメッセージID（IDがない、または数値でない場合は0）"""
+    message_id = message.get("message_id")
+    try:
+        return int(message_id) if message_id is not None else 0
+    except (TypeError, ValueError):
+        return 0
+
+def _get_message_archive(normalized_path: str, room_id: int) -> MessageArchive:
+    """保存先ディレクトリにあるルームの圧縮アーカイブ（ファイルは最初の追記で作成）"""
+    return MessageArchive(Path(normalized_path) / f"room_{room_id}" / ARCHIVE_FILENAME, ARCHIVE_BLOCK_MESSAGES)
+
+def _archive_formats() -> Tuple[bool, bool]:
+    """CHATWORK_ARCHIVE_FORMAT から (txtで保存するか, 圧縮アーカイブに保存するか) を返します
+
+    Raises:
+        RuntimeError: CHATWORK_ARCHIVE_FORMAT の値が不正な場合
+    """
+    formats = {"txt": (True, False), "compressed": (False, True), "both": (True, True)}
+    if ARCHIVE_FORMAT not in formats:
+        raise RuntimeError(f"CHATWORK_ARCHIVE_FORMAT の値が不正です: {ARCHIVE_FORMAT}（txt, compressed, both のいずれか）")
+    return formats[ARCHIVE_FORMAT]
+
+class Outbox:
+    """投稿（メッセージの投稿・タスクの作成）を冪等キー単位で永続化するSQLiteのアウトボックス
+
+    各投稿は次のように状態が変わります。
+
+        pending → sending → sent     投稿済み（同じキーで再度呼び出すと、保存した結果を返す）
+                          → pending  429や接続の失敗など、未送信が確実で再送できる失敗
+                          → failed   4xxなど、未送信が確実な失敗（同じキーで登録し直すと再送できる）
+                          → unknown  送信後の切断や5xx、送信中の終了で、投稿されたか分からない
+
+    unknown の投稿は二重投稿を避けるため自動では再送しません。
+    ブロッキングI/Oのため、非同期処理からは asyncio.to_thread 経由で呼び出してください。
+    """
+
+    STATUSES = ("pending", "sending", "sent", "failed", "unknown")
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            idempotency_key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            room_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            profile TEXT NOT NULL DEFAULT 'default'
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_status_created_at ON outbox (status, created_at);
+    """
+
+    _COLUMNS = "idempotency_key, kind, profile, room_id, status, attempts, result, error, created_at, updated_at"
+
+    def __init__(self, db_path: Path, recover: bool = True):
+        self.db_path = db_path
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # ワーカースレッドから利用するため、スレッド間の排他はロックで行う
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # 受け付けた投稿を失わないよう、コミットごとにディスクへ同期する
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(self._SCHEMA)
+        with self._conn:
+            # プロファイル導入前のアウトボックスには列を追加する（既存の投稿は "default" で送信）
+            if "profile" not in [row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")]:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN profile TEXT NOT NULL DEFAULT 'default'")
+        self._lock = threading.Lock()
+        # 複数のワーカーで共有する場合は、他のワーカーが送信中の投稿があるため、送信処理の担当が引き継ぐ際に行う
+        if recover:
+            self.recover_interrupted()
+
+    def recover_interrupted(self) -> int:
+        """前回の終了時に送信中だった投稿を unknown にします（投稿されたかどうか分からないため）
+
+        Returns:
+            int: unknown にした投稿の件数
+        """
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE outbox SET status = 'unknown', error = ?, updated_at = ? WHERE status = 'sending'",
+                ("送信中にサーバーが終了しました", time.time())
+            ).rowcount
+
+    @staticmethod
+    def _to_entry(row: Tuple[Any, ...]) -> OutboxEntry:
+        key, kind, profile, room_id, status, attempts, result, error, created_at, updated_at = row
+        return {
+            "idempotency_key": key,
+            "kind": kind,
+            "profile": profile,
+            "room_id": room_id,
+            "status": status,
+            "attempts": attempts,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "created_at": int(created_at),
+            "updated_at": int(updated_at)
+        }
+
+    def _select(self, key: str) -> Optional[Tuple[Any, ...]]:
+        return self._conn.execute(
+            f"SELECT {self._COLUMNS}, payload FROM outbox WHERE idempotency_key = ?", (key,)
+        ).fetchone()
+
+    def register(
+        self, key: str, kind: str, profile: str, room_id: int, payload: Dict[str, str], status: str
+    ) -> Tuple[OutboxEntry, bool]:
+        """投稿を登録します
+
+        同じキーが登録済みの場合は何もせずに既存の投稿を返します。ただし failed の投稿は
+        指定した状態に戻し、再送できるようにします。status に "sending" を指定した場合は、
+        呼び出し元がそのまま送信するものとして試行回数を数えます。
+
+        Returns:
+            Tuple[OutboxEntry, bool]: 投稿と、新たに登録（または再登録）したかどうか
+
+        Raises:
+            ValueError: 同じキーで内容の異なる投稿が登録済みの場合
+        """
+        payload_json = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        attempts = 1 if status == "sending" else 0
+        now = time.time()
+        with self._lock, self._conn:
+            # 先に挿入して書き込みロックを取ることで、他のプロセスと同じキーを同時に登録しても1件にする
+            if self._conn.execute(
+                f"INSERT OR IGNORE INTO outbox ({self._COLUMNS}, payload) VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, ?, ?, ?)",
+                (key, kind, profile, room_id, status, attempts, now, now, payload_json)
+            ).rowcount == 1:
+                return self._to_entry(self._select(key)[:10]), True
+            row = self._select(key)
+            if (row[1], row[2], row[3], row[10]) != (kind, profile, room_id, payload_json):
+                raise ValueError(f"idempotency_key「{key}」は内容の異なる投稿に使用されています")
+            if row[4] != "failed":
+                return self._to_entry(row[:10]), False
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, error = NULL, updated_at = ? WHERE idempotency_key = ?",
+                (status, attempts, now, key)
+            )
+            return self._to_entry(self._select(key)[:10]), True
+
+    def claim(self, profile: str) -> Optional[Tuple[OutboxEntry, Dict[str, str]]]:
+        """プロファイルの最も古い pending の投稿を sending にして、投稿の内容とともに返します"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"""
+                SELECT {self._COLUMNS}, payload FROM outbox
+                WHERE status = 'pending' AND profile = ?
+                ORDER BY created_at
+                LIMIT 1
+                """,
+                (profile,)
+            ).fetchone()
+            if row is None:
+                return None
+            # 他のプロセスが先に取り出していた場合は何もしない
+            if self._conn.execute(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1, updated_at = ? "
+                "WHERE idempotency_key = ? AND status = 'pending'",
+                (time.time(), row[0])
+            ).rowcount == 0:
+                return None
+            return self._to_entry(self._select(row[0])[:10]), json.loads(row[10])
+
+    def finish(self, key: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        """送信を試みた結果を記録します"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, result = ?, error = ?, updated_at = ? WHERE idempotency_key = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), key)
+            )
+
+    def get(self, key: str) -> Optional[OutboxEntry]:
+        with self._lock:
+            row = self._select(key)
+        return self._to_entry(row[:10]) if row is not None else None
+
+    def entries(self, status: Optional[str], limit: int) -> List[OutboxEntry]:
+        """投稿を新しい順に返します（status を指定した場合はその状態のみ）"""
+        condition, args = ("WHERE status = ?", [status]) if status is not None else ("", [])
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM outbox {condition} ORDER BY created_at DESC LIMIT ?",
+                args + [limit]
+            ).fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        counts = dict.fromkeys(self.STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# CHATWORK_OUTBOX_PATH のアウトボックス（最初の利用時に開く）
+_outbox: Optional[Outbox] = None
+
+def _get_outbox() -> Outbox:
+    """アウトボックスを取得します
+
+    Raises:
+        ValueError: アウトボックスが無効（CHATWORK_OUTBOX_PATH が未設定）の場合
+    """
+    global _outbox
+    if not OUTBOX_PATH:
+        raise ValueError("アウトボックスが無効です。環境変数 CHATWORK_OUTBOX_PATH にSQLiteファイルのパスを設定してください。")
+    if _outbox is None:
+        _outbox = Outbox(Path(OUTBOX_PATH).expanduser(), recover=_shared_state is None)
+    return _outbox
+
+def _close_outbox() -> None:
+    """アウトボックスを開いている場合は閉じます"""
+    global _outbox
+    if _outbox is not None:
+        _outbox.close()
+        _outbox = None
+
+class OutboxSender:
+    """アウトボックスの pending の投稿を、プロファイルごとに登録順に1件ずつ送信するバックグラウンド処理
+
+    レート制限はプロファイルごとに課されるため、送信処理もプロファイルごとに分け、
+    あるプロファイルの投稿が溜まっていても他のプロファイルの投稿は待たせません。
+    送信前にレート制限の残量を確認し、reserved_requests 件は他のツールのために残します。
+    429の上限超過や接続の失敗で送れなかった場合は、原因がレート制限やネットワークにあるため
+    そのプロファイルの送信を止め、待機時間を倍々に延ばしてから同じ投稿を再送します（投稿の順序は変わりません）。
+    複数のワーカーで共有する場合は、バックグラウンド処理を担当するワーカーだけが送信し、
+    他のワーカーが登録した投稿は poll_interval 秒ごとに確認します。
+    """
+
+    def __init__(self, reserved_requests: int, retry_delay: float, max_attempts: int, poll_interval: Optional[float] = None):
+        self.reserved_requests = reserved_requests
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval  # None の場合は登録の通知があるまで待機
+        self.last_errors: Dict[str, str] = {}  # プロファイル名 → 直近の送信エラー
+        self._tasks: Dict[str, "asyncio.Task[None]"] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks.values())
+
+    def start(self) -> None:
+        """APIトークンが設定されている全プロファイルの送信処理を開始します（実行中のものはそのまま）"""
+        for profile in _configured_profiles():
+            task = self._tasks.get(profile.name)
+            if task is None or task.done():
+                self._wakeups.setdefault(profile.name, asyncio.Event())
+                self._tasks[profile.name] = asyncio.create_task(self.run(profile))
+
+    def notify(self, profile: str) -> None:
+        """新たな投稿が登録されたことを通知します（送信処理が止まっていれば開始します）
+
+        バックグラウンド処理の担当でないワーカーでは何もしません（担当のワーカーが定期的に確認して送信します）。
+        """
+        if not _background_leader.active:
+            return
+        self.start()
+        self._wakeups[profile].set()
+
+    async def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        for task in self._tasks.values():
+            await _wait_cancelled(task)
+        self._tasks.clear()
+
+    async def _wait_for_budget(self, rate_limiter: Union[RateLimiter, SharedRateLimiter]) -> None:
+        """レート制限の残量が予約分を上回るまで待機します"""
+        reserved = min(self.reserved_requests, rate_limiter.capacity - 1)
+        while True:
+            remaining, blocked_seconds, _ = await rate_limiter.budget()
+            if blocked_seconds <= 0 and remaining > reserved:
+                return
+            await asyncio.sleep(max(blocked_seconds, 1 / rate_limiter.rate))
+
+    async def run(self, profile: ApiProfile) -> None:
+        """キャンセルされるまで、プロファイルの pending の投稿を送信し続けます"""
+        outbox = _get_outbox()
+        wakeup = self._wakeups[profile.name]
+        failures = 0
+        while True:
+            try:
+                wakeup.clear()
+                # 待機中の投稿が sending のまま残らないよう、残量を確認してから取り出す
+                await self._wait_for_budget(profile.rate_limiter)
+                claimed = await asyncio.to_thread(outbox.claim, profile.name)
+                if claimed is None:
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+                    continue
+                entry, payload = claimed
+                key = entry["idempotency_key"]
+                try:
+                    result = await _deliver_outbox_payload(entry["kind"], entry["room_id"], payload, profile.name)
+                except asyncio.CancelledError:
+                    outbox.finish(key, "unknown", error="送信中にキャンセルされました")
+                    raise
+                except (ValueError, RuntimeError) as e:
+                    self.last_errors[profile.name] = str(e)
+                    if isinstance(e, RequestNotSentError) and e.retryable and entry["attempts"] < self.max_attempts:
+                        await asyncio.to_thread(outbox.finish, key, "pending", error=str(e))
+                        failures += 1
+                        await asyncio.sleep(min(self.retry_delay * 2 ** (failures - 1), RATE_LIMIT_PERIOD))
+                        continue
+                    await asyncio.to_thread(outbox.finish, key, _failed_outbox_status(e), error=str(e))
+                else:
+                    self.last_errors.pop(profile.name, None)
+                    await asyncio.to_thread(outbox.finish, key, "sent", result=result)
+                failures = 0
+            except sqlite3.Error as e:
+                # アウトボックスの読み書きに失敗しても送信処理は止めず、待機時間を延ばして再試行する
+                # （送信中に記録できなかった投稿は sending のまま残り、次の起動時に unknown になる）
+                self.last_errors[profile.name] = f"{type(e).__name__}: {e}"
+                failures += 1
+                await asyncio.sleep(min(self.retry_delay * 2 ** (failures - 1), RATE_LIMIT_PERIOD))
+
+# サーバー全体で共有するアウトボックスの送信処理（lifespanまたは最初の登録で起動）
+_outbox_sender = OutboxSender(
+    OUTBOX_RESERVED_REQUESTS, OUTBOX_RETRY_DELAY, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_INTERVAL if _shared_state is not None else None
+)
+
+def _failed_outbox_status(error: Exception) -> str:
+    """送信に失敗した投稿の状態（未送信が確実なら failed、そうでなければ unknown）"""
+    return "failed" if isinstance(error, (RequestNotSentError, ValueError)) else "unknown"
+
+async def _deliver_outbox_payload(kind: str, room_id: int, payload: Dict[str, str], profile: str) -> Any:
+    """アウトボックスに登録された内容で投稿します"""
+    if kind == "message":
+        return await _send_room_message(room_id, payload, profile)
+    return await _send_room_tasks(room_id, payload, profile)
+
+async def _post_via_outbox(
+    kind: str, room_id: int, payload: Dict[str, str], idempotency_key: Optional[str], queue: int, profile: str
+) -> Any:
+    """冪等キーまたは queue=1 を指定した投稿を、アウトボックスを通して処理します
+
+    queue=1 の場合は登録だけを行い、投稿の状態（OutboxEntry）をすぐに返します。
+    queue=0 の場合はその場で送信し、同じキーで投稿済みであれば送信せずに前回の結果を返します。
+    """
+    outbox = _get_outbox()
+    if queue == 1:
+        entry, registered = await asyncio.to_thread(
+            outbox.register, idempotency_key or uuid.uuid4().hex, kind, profile, room_id, payload, "pending"
+        )
+        if registered:
+            _outbox_sender.notify(profile)
+        return entry
+
+    entry, registered = await asyncio.to_thread(outbox.register, idempotency_key, kind, profile, room_id, payload, "sending")
+    if not registered:
+        if entry["status"] == "sent":
+            return entry["result"]
+        if entry["status"] == "unknown":
+            raise RuntimeError(
+                f"idempotency_key「{idempotency_key}」の投稿は、投稿されたかどうか確認できていません（{entry['error']}）。"
+                "二重投稿を避けるため再送しません。チャットルームを確認してください"
+            )
+        raise RuntimeError(f"idempotency_key「{idempotency_key}」の投稿は送信待ちまたは送信中です。get_outbox_statusで状態を確認してください")
+
+    try:
+        result = await _deliver_outbox_payload(kind, room_id, payload, profile)
+    except asyncio.CancelledError:
+        outbox.finish(idempotency_key, "unknown", error="送信中にキャンセルされました")
+        raise
+    except (ValueError, RuntimeError) as e:
+        await asyncio.to_thread(outbox.finish, idempotency_key, _failed_outbox_status(e), error=str(e))
+        raise
+    await asyncio.to_thread(outbox.finish, idempotency_key, "sent", result=result)
+    return result
+
+class IndexedTask:
+    """タスクインデックスの1件（複数の取得元から得た情報をまとめて保持）"""
+
+    __slots__ = (
+        "task_id", "room_id", "room", "account", "assigned_by_account", "message_id",
+        "body", "limit_time", "status", "limit_type", "mine"
+    )
+
+    def __init__(self, task_id: int, room_id: int):
+        self.task_id = task_id
+        self.room_id = room_id
+        self.room: Optional[Dict[str, Any]] = None  # get_my_tasks で得たルーム情報
+        self.account: Optional[AccountRecord] = None  # 担当者（get_my_tasks では含まれない）
+        self.assigned_by_account: Optional[AccountRecord] = None
+        self.message_id: Optional[str] = None
+        self.body = ""
+        self.limit_time = 0
+        self.status = "open"
+        self.limit_type = "date"
+        self.mine = False  # 自分に割り当てられたタスクか
+
+    def sort_key(self) -> Tuple[int, int]:
+        # 期限なし（limit_time=0）は最後に並べる
+        return (self.limit_time if self.limit_time > 0 else TaskIndex.NO_LIMIT, self.task_id)
+
+    def to_dict(self) -> Task:
+        task: Dict[str, Any] = {"task_id": self.task_id}
+        task["room"] = self.room or {"room_id": self.room_id}
+        if self.account is not None:
+            task["account"] = self.account.to_dict()
+        if self.assigned_by_account is not None:
+            task["assigned_by_account"] = self.assigned_by_account.to_dict()
+        task.update(
+            message_id=self.message_id,
+            body=self.body,
+            limit_time=self.limit_time,
+            status=self.status,
+            limit_type=self.limit_type
+        )
+        return task
+
+class TaskIndex:
+    """全ルームのタスクを task_id ごとに保持し、期限順の並びで検索できるようにするインデックス
+
+    タスク系のツール（get_room_tasks, get_my_tasks, get_room_task, post_room_tasks,
+    put_room_task_status）の結果を取り込んで更新し、検索時にはAPIを呼びません。
+    並びは (期限, task_id) の昇順のリストで、ステータスごとに全体・ルーム別・担当者別・
+    自分のタスクの4種類を持つため、期限の範囲による検索は二分探索で O(log n + 件数) です。
+    """
+
+    NO_LIMIT = 2 ** 62  # 期限なしのタスクの並び順に使う値
+
+    def __init__(self):
+        self._tasks: Dict[int, IndexedTask] = {}
+        self._orderings: Dict[Tuple[Any, ...], List[Tuple[int, int]]] = {}
+        self.room_synced_at: Dict[int, int] = {}  # ルームの全タスクを取り込んだ日時
+        self.my_tasks_synced_at: Dict[str, int] = {}  # 自分のタスクをstatusごとに取り込んだ日時
+        self.my_account_id: Optional[int] = None  # 両方の取得元に現れたタスクから判明した自分のID
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    @staticmethod
+    def _ordering_keys(task: IndexedTask) -> List[Tuple[Any, ...]]:
+        keys: List[Tuple[Any, ...]] = [("all", task.status), ("room", task.status, task.room_id)]
+        if task.account is not None:
+            keys.append(("account", task.status, task.account.account_id))
+        if task.mine:
+            keys.append(("mine", task.status))
+        return keys
+
+    def _unlink(self, task: IndexedTask) -> None:
+        entry = task.sort_key()
+        for key in self._ordering_keys(task):
+            ordering = self._orderings[key]
+            del ordering[bisect_left(ordering, entry)]
+            if not ordering:
+                del self._orderings[key]
+
+    def _link(self, task: IndexedTask) -> None:
+        entry = task.sort_key()
+        for key in self._ordering_keys(task):
+            insort(self._orderings.setdefault(key, []), entry)
+
+    def upsert(self, room_id: Optional[int], value: Mapping[str, Any], mine: bool = False) -> Optional[IndexedTask]:
+        """APIのタスク（ルームのタスク一覧・詳細、または自分のタスク一覧の形式）を取り込みます"""
+        task_id = value.get("task_id")
+        room = value.get("room")
+        if room_id is None and isinstance(room, Mapping):
+            room_id = room.get("room_id")
+        if task_id is None or room_id is None:
+            return None
+        task = self._tasks.get(task_id)
+        if task is None:
+            task = self._tasks[task_id] = IndexedTask(task_id, room_id)
+        else:
+            self._unlink(task)
+        task.room_id = room_id
+        if isinstance(room, Mapping):
+            task.room = dict(room)
+        for field in ("account", "assigned_by_account"):
+            account = value.get(field)
+            if isinstance(account, Mapping):
+                setattr(task, field, _account_directory.from_api(account))
+            elif isinstance(account, AccountRecord):
+                setattr(task, field, account)
+        for field in ("message_id", "body", "limit_time", "status", "limit_type"):
+            if value.get(field) is not None:
+                setattr(task, field, value[field])
+        if mine:
+            task.mine = True
+        elif self.my_account_id is not None and task.account is not None:
+            task.mine = task.account.account_id == self.my_account_id
+        if task.mine and task.account is not None:
+            self.my_account_id = task.account.account_id
+        self._link(task)
+        return task
+
+    def remove(self, task_id: int) -> None:
+        task = self._tasks.pop(task_id, None)
+        if task is not None:
+            self._unlink(task)
+
+    def set_status(self, task_id: int, status: str) -> None:
+        """インデックス済みのタスクのステータスだけを更新します"""
+        task = self._tasks.get(task_id)
+        if task is not None and task.status != status:
+            self._unlink(task)
+            task.status = status
+            self._link(task)
+
+    def replace_room(self, room_id: int, tasks: List[Mapping[str, Any]]) -> None:
+        """ルームの全タスクを取り込み、一覧に含まれなくなったタスクを取り除きます"""
+        seen = {task.task_id for task in (self.upsert(room_id, value) for value in tasks) if task is not None}
+        stale = [
+            task_id
+            for status in ("open", "done")
+            for _, task_id in self._orderings.get(("room", status, room_id), [])
+            if task_id not in seen
+        ]
+        for task_id in stale:
+            self.remove(task_id)
+        self.room_synced_at[room_id] = int(time.time())
+
+    def replace_mine(self, status: str, tasks: List[Mapping[str, Any]]) -> None:
+        """自分のタスク（指定したstatusの全件）を取り込み、一覧に含まれなくなったタスクを取り除きます"""
+        seen = {task.task_id for task in (self.upsert(None, value, mine=True) for value in tasks) if task is not None}
+        stale = [task_id for _, task_id in self._orderings.get(("mine", status), []) if task_id not in seen]
+        for task_id in stale:
+            # ステータスが変わったか削除されたタスク（次に取得されるまで索引から外す）
+            self.remove(task_id)
+        self.my_tasks_synced_at[status] = int(time.time())
+
+    def query(
+        self,
+        status: str,
+        start: int,
+        end: int,
+        limit: int,
+        room_id: Optional[int] = None,
+        account_id: Optional[int] = None,
+        mine: bool = False
+    ) -> Tuple[int, List[IndexedTask]]:
+        """期限が [start, end) のタスクを期限の早い順に返します
+
+        担当者・自分のタスク・ルームのうち指定された最も絞り込める並びを二分探索し、
+        残りの条件はその範囲内で確認します。
+
+        Returns:
+            Tuple[int, List[IndexedTask]]: (条件に合う総数, 先頭からlimit件)
+        """
+        if account_id is not None:
+            key: Tuple[Any, ...] = ("account", status, account_id)
+        elif mine:
+            key = ("mine", status)
+        elif room_id is not None:
+            key = ("room", status, room_id)
+        else:
+            key = ("all", status)
+        ordering = self._orderings.get(key, [])
+        lower = bisect_left(ordering, (start, -1))
+        upper = bisect_left(ordering, (end, -1))
+        if (room_id is None or key[0] == "room") and (not mine or key[0] == "mine"):
+            # 並びだけで条件が決まる場合は、範囲の先頭limit件だけを参照する
+            return upper - lower, [self._tasks[task_id] for _, task_id in ordering[lower:min(upper, lower + limit)]]
+
+        matched = []
+        total = 0
+        for _, task_id in ordering[lower:upper]:
+            task = self._tasks[task_id]
+            if (room_id is not None and task.room_id != room_id) or (mine and not task.mine):
+                continue
+            total += 1
+            if len(matched) < limit:
+                matched.append(task)
+        return total, matched
+
+# サーバー全体で共有するタスクインデックス（タスク系のツールの結果で更新）
+# プロファイル名 → タスクインデックス（参照できるタスクと「自分」がプロファイルごとに異なるため分ける）
+_task_indexes: Dict[str, TaskIndex] = {}
+
+def _get_task_index(profile: str) -> TaskIndex:
+    """プロファイルのタスクインデックスを取得します（未作成の場合は作成）"""
+    index = _task_indexes.get(profile)
+    if index is None:
+        index = _task_indexes[profile] = TaskIndex()
+    return index
+
+@mcp.tool()
+@_instrumented
+async def get_rooms(fields: Optional[List[str]] = None, compact: int = 0, profile: Optional[str] = None) -> Union[List[Room], CompactTable]:
+    """ChatWorkのルーム一覧を取得します
+    
+    Args:
+        fields (List[str], optional): 返す項目名のリスト（例: ["room_id", "name", "unread_num"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントやルームは accounts / rooms に1度だけ記載し、行からはIDで参照します
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Union[List[Room], CompactTable]: ルーム情報のリスト（compact=1の場合は列形式の表）
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    profile = _get_profile(profile).name
+
+    rooms = await _request_api("GET", "/rooms", cache_ttl=CACHE_TTL_ROOMS, model=RoomRecord, profile=profile)
+    return _shape_list(rooms, fields, compact)
+
+def _normalize_save_dir_path(save_dir_path: str) -> str:
+    """メッセージの保存先として指定されたパスを検証し、正規化したパスを返します
+
+    Args:
+        save_dir_path (str): メッセージを保存するディレクトリのパス
+
+    Returns:
+        str: 正規化されたパス
+
+    Raises:
+        ValueError: save_dir_pathが未指定、または不正な形式の場合
+    """
+    # save_dir_pathのバリデーションと正規化
+    if not save_dir_path or save_dir_path == "":
+        raise ValueError(
+            "save_dir_pathの指定が必要です。\n"
+            "以下の手順で実行してください：\n"
+            "1. pwdコマンドを実行してカレントディレクトリを取得\n"
+            "2. 取得したパスをsave_dir_pathに指定して再実行\n"
+            "\n"
+            "例：\n"
+            "PS> pwd\n"
+            "Path: C:\\Users\\masak\\Documents\\MEGA\\mcp\n"
+            "\n"
+            "get_room_messages(\n"
+            "    room_id=357644346,\n"
+            "    save_dir_path=\"C:\\Users\\masak\\Documents\\MEGA\\mcp\",\n"
+            "    force=0\n"
+            ")"
+        )
+
+    # URLエンコードされたパスを適切に変換
+    normalized_path = unquote(save_dir_path)
+    
+    # Windowsパスの形式チェック
+    if os.name == 'nt' and not normalized_path.startswith(('C:\\', 'D:\\', 'E:\\')):
+        if normalized_path.startswith('/c/'):
+            # /c/... 形式を C:\... 形式に変換
+            normalized_path = f"C:{normalized_path[2:]}".replace('/', '\\')
+        else:
+            raise ValueError(
+                f"不正なパス形式です: {save_dir_path}\n"
+                "Windowsでは C:\\Users\\...のような形式で指定してください。\n"
+                "pwdコマンドで取得したパスをそのまま使用してください。"
+            )
+
+    return normalized_path
+
+def _format_message_text(body: str) -> str:
+    """保存ファイルの1件分のうち、区切り線と日時の行を除いた部分を整形します"""
+    # ChatWork記法を解析（改行コードはそのまま保持）
+    parsed = parse_chatwork_markup(body)
+
+    formatted_text = parsed['text']
+    for quote in parsed['quotes']:
+        formatted_text += f"\n引用：{quote['text']}"
+    # 投稿元（[info]タグの内容）
+    for info in parsed['infos']:
+        source = "\n".join(part for part in (info['title'], info['body']) if part)
+        formatted_text += f"\n投稿元：{source}"
+    return formatted_text
+
+def _format_legacy_message_text(body: str) -> str:
+    """記法を解析する前の形式（最初の[info]タグだけを投稿元として取り出し、他の記法はそのまま残す）で整形します
+
+    以前のバージョンで保存したファイルの本文部分と、ローカルストアのメッセージを照合するために使います。
+    """
+    source_url = ""
+    if '[info]' in body and '[/info]' in body:
+        info_start = body.find('[info]')
+        info_end = body.find('[/info]')
+        source_url = body[info_start+6:info_end].strip()
+        body = body[:info_start] + body[info_end+7:]
+    formatted_text = body.strip()
+    if source_url:
+        formatted_text += f"\n投稿元：{source_url}"
+    return formatted_text
+
+def _format_message(msg: MessageRecord) -> str:
+    """メッセージを保存ファイル用のテキストに整形します"""
+    # 送信時刻をJST（日本時間）に変換
+    send_time = datetime.fromtimestamp(msg.send_time)
+    formatted_time = send_time.strftime('%Y-%m-%d %H:%M:%S')
+
+    # メッセージの整形
+    formatted_msg = f"""===============================
+本文（日時：{formatted_time}）
+{_format_message_text(msg.body)}"""
+    formatted_msg += "\n==============================="
+    return formatted_msg
+
+# 保存ファイル（_format_message の出力を空行で連結したもの）の1件分
+_MESSAGE_FILE_ENTRY_PATTERN = re.compile(
+    r"={31}\n本文（日時：(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})）\n(.*?)\n={31}(?=\n\n={31}\n本文（日時：|\n*\Z)",
+    re.DOTALL
+)
+
+def _parse_message_file(text: str) -> List[Tuple[int, str]]:
+    """保存ファイルの内容を (送信日時のUNIXタイムスタンプ, 本文部分) のリストに戻します
+
+    保存ファイルにはメッセージIDや投稿者が含まれず、本文も記法を解析した後のテキストのため、
+    元のメッセージを完全には復元できません。
+    """
+    return [
+        (int(datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S').timestamp()), match.group(2))
+        for match in _MESSAGE_FILE_ENTRY_PATTERN.finditer(text)
+    ]
+
+# 保存ファイルごとの書き込みロック（同じファイルへの追記が競合しないようにする）
+_message_file_locks: Dict[Path, threading.Lock] = {}
+
+def _write_message_file(save_file: Path, messages: List[MessageRecord], append: bool) -> None:
+    """整形したメッセージを1件ずつファイルへ書き出します（ワーカースレッドで実行）
+
+    同じディレクトリの一時ファイルへ書き込んでから置き換えるため、途中で失敗しても
+    書きかけのファイルが残ることはありません。
+
+    Args:
+        save_file (Path): 保存先のファイル
+        messages (List[MessageRecord]): 保存するメッセージ
+        append (bool): 既存のファイルがある場合に追記するか（Falseの場合は上書き）
+    """
+    save_file.parent.mkdir(parents=True, exist_ok=True)
+    with _message_file_locks.setdefault(save_file, threading.Lock()):
+        tmp_file = save_file.with_name(f".{save_file.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                separator = ""
+                if append and save_file.exists():
+                    with open(save_file, "r", encoding="utf-8") as existing:
+                        shutil.copyfileobj(existing, f)
+                    separator = "\n\n"
+                for msg in messages:
+                    f.write(separator)
+                    f.write(_format_message(msg))
+                    separator = "\n\n"
+            os.replace(tmp_file, save_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+
+async def _fetch_room_messages(room_id: int, normalized_path: str, force: int, profile: str) -> List[Message]:
+    """メッセージ一覧を取得し、保存先ディレクトリへ書き出します
+
+    Args:
+        room_id (int): チャットルームのID
+        normalized_path (str): _normalize_save_dir_path で正規化した保存先のパス
+        force (int): 前回取得分からの差分を取得するか（1: 差分を取得しない, 0: 差分のみ取得）
+        profile (str): 取得に使うプロファイル名（差分は取得したトークンごとに管理されます）
+
+    Returns:
+        List[Message]: メッセージ情報のリスト（force=1の場合は保存先パスを含むメッセージのリスト）
+    """
+    messages = await _request_api(
+        "GET",
+        f"/rooms/{room_id}/messages",
+        params={"force": force},
+        error_messages={
+            403: "このチャットルームにアクセスする権限がありません",
+            404: "指定されたチャットルームが見つかりません"
+        },
+        profile=profile,
+        # 差分の取得はサーバー側の取得位置を進めるため、相乗りすると同じ差分を呼び出し元ごとに保存してしまう
+        coalesce=force == 1
+    ) or []
+
+    # ローカルストアとファイルへの書き出しには、アカウント情報を共有するレコードを使う
+    records = [MessageRecord.from_api(msg) for msg in messages]
+
+    # 差分のみの取得でも履歴が失われないよう、ローカルストアへ蓄積
+    if records:
+        store = await _get_message_store(normalized_path)
+        started = time.perf_counter()
+        await asyncio.to_thread(store.upsert, room_id, records)
+        _metrics.observe_phase("store_upsert", time.perf_counter() - started)
+
+    # メッセージを保存（force=1またはforce=0で差分がある場合）
+    if force == 1 or (force == 0 and messages):
+        write_txt, write_archive = _archive_formats()
+        now = datetime.now()
+        # 保存先ディレクトリの設定（正規化されたパスを使用）
+        base_dir = Path(normalized_path)
+        save_dir = base_dir / f"room_{room_id}/{now.strftime('%Y%m%d')}"
+
+        # ファイル名の設定（force=0の場合は差分ファイルであることを明記）
+        filename = f"{now.strftime('%H%M')}_{'diff' if force == 0 else 'full'}.txt"
+        save_file = save_dir / filename
+
+        # 整形と書き込みはイベントループを止めないようワーカースレッドで実行
+        started = time.perf_counter()
+        if write_txt:
+            await asyncio.to_thread(_write_message_file, save_file, records, force == 0)
+        if write_archive:
+            archive = _get_message_archive(normalized_path, room_id)
+            await asyncio.to_thread(archive.append, [record.to_dict() for record in records])
+            if not write_txt:
+                save_file = archive.data_path
+        _metrics.observe_phase("archive_write", time.perf_counter() - started)
+
+        # force=1の場合のみ、システムメッセージを返す
+        if force == 1:
+            return [{
+                "message_id": "system",
+                "account": {
+                    "account_id": 0,
+                    "name": "System",
+                    "avatar_image_url": ""
+                },
+                "body": f"メッセージ履歴を保存しました: {save_file.absolute()}",
+                "send_time": int(datetime.now().timestamp()),
+                "update_time": int(datetime.now().timestamp())
+            }]
+
+    return messages
+
+@mcp.tool()
+@_instrumented
+async def get_room_messages(
+    room_id: int,
+    save_dir_path: str,
+    force: int = 0,
+    parse_markup: int = 0,
+    fields: Optional[List[str]] = None,
+    compact: int = 0,
+    profile: Optional[str] = None
+) -> Union[List[Message], CompactTable]:
+    """チャットのメッセージ一覧を取得します
+    
+    Args:
+        room_id (int): チャットルームのID
+        save_dir_path (str): メッセージを保存するディレクトリのパス
+                            必ず事前にpwdコマンドで取得したパスを指定してください
+                            Windowsの場合、C:\\Users\\...のような形式で指定してください
+        force (int, optional): 前回取得分からの差分を取得するか（1: 差分を取得しない, 0: 差分のみ取得）
+                             通信量削減のため、ユーザーからの指示がない限り0（デフォルト値）を必ず利用
+        parse_markup (int, optional): 本文のChatWork記法を解析した構造化形式で返すか（0: しない, 1: する）
+                                     1の場合、bodyは本文・宛先・返信・引用などに分けた形式になります
+        fields (List[str], optional): 返す項目名のリスト（例: ["message_id", "account.name", "body"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントやルームは accounts / rooms に1度だけ記載し、行からはIDで参照します
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Union[List[Message], CompactTable]: メッセージ情報のリスト（force=1の場合は保存先パスを含むメッセージのリスト）
+                                           compact=1の場合は列形式の表
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合、またはsave_dir_pathが未指定の場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    profile = _get_profile(profile).name
+
+    normalized_path = _normalize_save_dir_path(save_dir_path)
+    messages = await _fetch_room_messages(room_id, normalized_path, force, profile)
+    if parse_markup == 1:
+        messages = [_with_parsed_markup(msg) for msg in messages]
+    return _shape_list(messages, fields, compact)
+
+@mcp.tool()
+@_instrumented
+async def get_room_message(room_id: int, message_id: int, parse_markup: int = 0, profile: Optional[str] = None) -> Message:
+    """チャットの特定のメッセージを取得します
+    
+    Args:
+        room_id (int): チャットルームのID
+        message_id (int): 取得するメッセージのID
+        parse_markup (int, optional): 本文のChatWork記法を解析した構造化形式で返すか（0: しない, 1: する）
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Message: メッセージ情報
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    profile = _get_profile(profile).name
+
+    message = await _request_api(
+        "GET",
+        f"/rooms/{room_id}/messages/{message_id}",
+        error_messages={
+            403: "このメッセージにアクセスする権限がありません",
+            404: "指定されたチャットルームまたはメッセージが見つかりません"
+        },
+        cache_ttl=CACHE_TTL_ROOM_MESSAGE,
+        model=MessageRecord,
+        profile=profile,
+        hedge=True
+    )
+    if parse_markup == 1:
+        return _with_parsed_markup(message)
+    return message
+
+@mcp.tool()
+@_instrumented
+async def get_room_tasks(
+    room_id: int,
+    fields: Optional[List[str]] = None,
+    compact: int = 0,
+    profile: Optional[str] = None
+) -> Union[List[Task], CompactTable]:
+    """チャットルームのタスク一覧を取得します
+    
+    Args:
+        room_id (int): チャットルームのID
+        fields (List[str], optional): 返す項目名のリスト（例: ["task_id", "body", "limit_time", "status"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントやルームは accounts / rooms に1度だけ記載し、行からはIDで参照します
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Union[List[Task], CompactTable]: タスク情報のリスト（compact=1の場合は列形式の表）
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    profile = _get_profile(profile).name
+
+    tasks = await _request_api(
+        "GET",
+        f"/rooms/{room_id}/tasks",
+        error_messages={
+            403: "このチャットルームにアクセスする権限がありません",
+            404: "指定されたチャットルームが見つかりません"
+        },
+        cache_ttl=CACHE_TTL_ROOM_TASKS,
+        model=TaskRecord,
+        profile=profile
+    )
+    _get_task_index(profile).replace_room(room_id, tasks or [])
+    return _shape_list(tasks, fields, compact)
+
+async def _fetch_my_tasks(status: str, profile: Optional[str]) -> List[Task]:
+    """自分のタスク一覧を取得し、タスクインデックスを更新します（get_my_tasks と query_tasks で共用）"""
+    profile = _get_profile(profile).name
+
+    if status not in ["open", "done"]:
+        raise ValueError('statusは"open"または"done"を指定してください')
+
+    tasks = await _request_api(
+        "GET", "/my/tasks", params={"status": status}, cache_ttl=CACHE_TTL_MY_TASKS, model=TaskRecord, profile=profile
+    )
+    _get_task_index(profile).replace_mine(status, tasks or [])
+    return tasks
+
+@mcp.tool()
+@_instrumented
+async def get_my_tasks(
+    status: str = "open",
+    fields: Optional[List[str]] = None,
+    compact: int = 0,
+    profile: Optional[str] = None
+) -> Union[List[Task], CompactTable]:
+    """自分に割り当てられたタスク一覧を取得します
+    
+    Args:
+        status (str, optional): タスクのステータス。"open"（未完了）または"done"（完了）。デフォルトは"open"
+        fields (List[str], optional): 返す項目名のリスト（例: ["task_id", "room.name", "body", "limit_time"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントやルームは accounts / rooms に1度だけ記載し、行からはIDで参照します
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Union[List[Task], CompactTable]: タスク情報のリスト（compact=1の場合は列形式の表）
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合、またはstatusの値が不正な場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    return _shape_list(await _fetch_my_tasks(status, profile), fields, compact)
+
+async def _send_room_tasks(room_id: int, params: Dict[str, str], profile: str) -> Task:
+    """タスクを作成し、キャッシュとタスクインデックスを更新します（post_room_tasks とアウトボックスで共用）"""
+    task = await _request_api(
+        "POST",
+        f"/rooms/{room_id}/tasks",
+        data=params,
+        error_messages={
+            403: "このチャットルームにアクセスする権限がありません",
+            404: "指定されたチャットルームが見つかりません"
+        },
+        profile=profile
+    )
+
+    # タスク一覧・自分のタスク・ルームのタスク数が変わるためキャッシュを破棄
+    await _cache_invalidate(f"/rooms/{room_id}/tasks", "/my/tasks", "/rooms")
+
+    # 作成したタスクをインデックスへ追加（task_idsは担当者ごとに1件ずつ、指定順に返される）
+    to_ids = [int(id) for id in params["to_ids"].split(",")]
+    task_ids = task.get("task_ids", []) if isinstance(task, dict) else []
+    if len(task_ids) == len(to_ids):
+        task_index = _get_task_index(profile)
+        for task_id, account_id in zip(task_ids, to_ids):
+            task_index.upsert(room_id, {
+                "task_id": task_id,
+                "account": _account_directory.get(account_id) or AccountRecord(account_id, "", ""),
+                "body": params["body"],
+                "limit_time": int(params.get("limit", 0)),
+                "status": "open",
+                "limit_type": params["limit_type"]
+            })
+    return task
+
+async def _post_room_tasks(
+    room_id: int,
+    body: str,
+    to_ids: List[int],
+    limit: Optional[int],
+    limit_type: str,
+    idempotency_key: Optional[str],
+    queue: int,
+    profile: Optional[str]
+) -> Union[Task, OutboxEntry]:
+    """タスクを作成します（post_room_tasks と post_room_tasks_batch で共用）"""
+    profile = _get_profile(profile).name
+
+    if limit_type not in ["date", "time"]:
+        raise ValueError('limit_typeは"date"または"time"を指定してください')
+
+    if not body:
+        raise ValueError("タスクの内容（body）は必須です")
+
+    if not to_ids:
+        raise ValueError("タスクの担当者（to_ids）は必須です")
+
+    # パラメータの準備
+    params = {
+        "body": body,
+        "limit_type": limit_type,
+        # to_idsをカンマ区切りの文字列に変換
+        "to_ids": ",".join(str(id) for id in to_ids)
+    }
+
+    # limitの処理（文字列として追加）
+    if limit is not None:
+        params["limit"] = str(limit)
+
+    if idempotency_key is not None or queue == 1:
+        return await _post_via_outbox("task", room_id, params, idempotency_key, queue, profile)
+    return await _send_room_tasks(room_id, params, profile)
+
+@mcp.tool()
+@_instrumented
+async def post_room_tasks(
+    room_id: int,
+    body: str,
+    to_ids: List[int],
+    limit: Optional[int] = None,
+    limit_type: str = "date",
+    idempotency_key: Optional[str] = None,
+    queue: int = 0,
+    profile: Optional[str] = None
+) -> Union[Task, OutboxEntry]:
+    """チャットルームにタスクを作成します
+    
+    Args:
+        room_id (int): チャットルームのID
+        body (str): タスクの内容
+        to_ids (List[int]): タスクの担当者のアカウントIDリスト
+        limit (int, optional): タスクの期限（UNIXタイムスタンプ）
+        limit_type (str, optional): 期限の種類。"date"（日付）または"time"（時間）。デフォルトは"date"
+        idempotency_key (str, optional): 二重作成を防ぐためのキー（アウトボックスが有効な場合のみ）
+                                        同じキーで作成済みであれば、APIを呼ばずに前回の結果を返します
+        queue (int, optional): アウトボックスに登録してすぐに返すか（0: しない, 1: する）
+                               登録した投稿はレート制限の範囲で順に送信され、結果は get_outbox_status で確認できます
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Union[Task, OutboxEntry]: 作成されたタスク情報（queue=1 の場合はアウトボックスに登録した投稿の状態）
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合、またはlimit_typeの値が不正な場合、
+                   またはアウトボックスが無効な状態で idempotency_key か queue=1 を指定した場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    return await _post_room_tasks(room_id, body, to_ids, limit, limit_type, idempotency_key, queue, profile)
+
+@mcp.tool()
+@_instrumented
+async def get_room_task(room_id: int, task_id: int, profile: Optional[str] = None) -> Task:
+    """チャットルームの特定のタスクを取得します
+    
+    Args:
+        room_id (int): チャットルームのID
+        task_id (int): タスクのID
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Task: タスク情報
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    profile = _get_profile(profile).name
+
+    task = await _request_api(
+        "GET",
+        f"/rooms/{room_id}/tasks/{task_id}",
+        error_messages={
+            403: "このタスクにアクセスする権限がありません",
+            404: "指定されたチャットルームまたはタスクが見つかりません"
+        },
+        cache_ttl=CACHE_TTL_ROOM_TASK,
+        model=TaskRecord,
+        profile=profile,
+        hedge=True
+    )
+    _get_task_index(profile).upsert(room_id, task)
+    return task
+
+async def _put_room_task_status(room_id: int, task_id: int, status: str, profile: Optional[str]) -> Task:
+    """タスクの状態を更新します（put_room_task_status と put_room_task_status_batch で共用）"""
+    profile = _get_profile(profile).name
+
+    if status not in ["open", "done"]:
+        raise ValueError('statusは"open"または"done"を指定してください')
+
+    # パラメータの準備（bodyパラメータにステータスを設定）
+    params = {
+        "body": status  # APIの仕様に従い、bodyパラメータにステータスを設定
+    }
+
+    task = await _request_api(
+        "PUT",
+        f"/rooms/{room_id}/tasks/{task_id}/status",
+        data=params,
+        error_messages={
+            403: "このタスクにアクセスする権限がありません",
+            404: "指定されたチャットルームまたはタスクが見つかりません"
+        },
+        profile=profile
+    )
+
+    # タスク詳細とそれを含む一覧のキャッシュを破棄
+    await _cache_invalidate(
+        f"/rooms/{room_id}/tasks/{task_id}",
+        f"/rooms/{room_id}/tasks",
+        "/my/tasks",
+        "/rooms"
+    )
+
+    # インデックスは再取得せずにその場で更新
+    task_index = _get_task_index(profile)
+    task_index.set_status(task_id, status)
+    if isinstance(task, dict) and "body" in task:
+        task_index.upsert(room_id, task)
+    return task
+
+@mcp.tool()
+@_instrumented
+async def put_room_task_status(room_id: int, task_id: int, status: str = "done", profile: Optional[str] = None) -> Task:
+    """チャットルームのタスクの状態を更新します
+    
+    Args:
+        room_id (int): チャットルームのID
+        task_id (int): タスクのID
+        status (str, optional): タスクの新しい状態。"open"（未完了）または"done"（完了）。デフォルトは"done"
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Task: 更新されたタスク情報
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合、またはstatusの値が不正な場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    return await _put_room_task_status(room_id, task_id, status, profile)
+
+@mcp.tool()
+@_instrumented
+async def query_tasks(
+    due: str = "overdue",
+    within_hours: float = 24,
+    account_id: Optional[int] = None,
+    mine: int = 0,
+    room_id: Optional[int] = None,
+    status: str = "open",
+    limit: int = 50,
+    refresh: int = 0,
+    fields: Optional[List[str]] = None,
+    compact: int = 0,
+    profile: Optional[str] = None
+) -> TaskQueryResult:
+    """全ルームのタスクを期限で検索します（ローカルのタスクインデックスを使用し、APIは呼びません）
+
+    インデックスは get_my_tasks, get_room_tasks, get_room_task, post_room_tasks, put_room_task_status の
+    結果で更新されます。自分のタスクであれば get_my_tasks（または refresh=1）の後に、
+    他の担当者のタスクであれば対象ルームの get_room_tasks の後に検索してください。
+
+    Args:
+        due (str, optional): 期限の条件
+                             "overdue": 期限切れ（期限が現在より前）
+                             "due_soon": 現在から within_hours 時間以内に期限を迎える
+                             "all": 期限を問わず全て（期限なしを含む）
+        within_hours (float, optional): due="due_soon" の場合の範囲（時間）。デフォルトは24
+        account_id (int, optional): 担当者のアカウントID
+        mine (int, optional): 自分に割り当てられたタスクのみに絞るか（0: しない, 1: する）
+        room_id (int, optional): チャットルームのID
+        status (str, optional): タスクのステータス。"open"（未完了）または"done"（完了）。デフォルトは"open"
+        limit (int, optional): 返す最大件数。デフォルトは50
+        refresh (int, optional): 検索前に get_my_tasks で自分のタスクを取り込み直すか（0: しない, 1: する）
+                                APIリクエストは1回のみです
+        fields (List[str], optional): 返すタスクの項目名のリスト（例: ["task_id", "room.room_id", "body", "limit_time"]）
+        compact (int, optional): tasks を列形式のコンパクトな表で返すか（0: しない, 1: する）
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+
+    Returns:
+        TaskQueryResult: 期限の早い順のタスク（期限なしは最後）と、インデックスの取り込み状況
+
+    Raises:
+        ValueError: 引数の値が不正な場合、またはプロファイルのAPIトークンが未設定の場合
+        RuntimeError: refresh=1 でのAPIリクエスト制限超過時やその他のエラー発生時
+    """
+    profile = _get_profile(profile).name
+
+    if due not in ["overdue", "due_soon", "all"]:
+        raise ValueError('dueは"overdue"、"due_soon"、"all"のいずれかを指定してください')
+
+    if status not in ["open", "done"]:
+        raise ValueError('statusは"open"または"done"を指定してください')
+
+    if within_hours <= 0:
+        raise ValueError("within_hoursには0より大きい値を指定してください")
+
+    if limit < 1:
+        raise ValueError("limitには1以上の値を指定してください")
+
+    if refresh == 1:
+        await _fetch_my_tasks(status, profile)
+
+    now = int(time.time())
+    if due == "overdue":
+        start, end = 1, now
+    elif due == "due_soon":
+        start, end = now, now + int(within_hours * 3600)
+    else:
+        start, end = 0, TaskIndex.NO_LIMIT + 1
+    task_index = _get_task_index(profile)
+    total, tasks = task_index.query(status, start, end, limit, room_id=room_id, account_id=account_id, mine=mine == 1)
+    return {
+        "tasks": _shape_list([task.to_dict() for task in tasks], fields, compact),
+        "total": total,
+        "now": now,
+        "synced_room_ids": sorted(task_index.room_synced_at),
+        "my_tasks_synced_at": dict(task_index.my_tasks_synced_at)
+    }
+
+async def _send_room_message(room_id: int, params: Dict[str, str], profile: str) -> Message:
+    """メッセージを投稿し、キャッシュを破棄します（post_room_messages とアウトボックスで共用）"""
+    message = await _request_api(
+        "POST",
+        f"/rooms/{room_id}/messages",
+        data=params,
+        error_messages={
+            403: "このチャットルームにアクセスする権限がありません",
+            404: "指定されたチャットルームが見つかりません"
+        },
+        profile=profile
+    )
+
+    # ルームのメッセージ数・最終更新時刻が変わるためキャッシュを破棄
+    await _cache_invalidate(f"/rooms/{room_id}/messages", "/rooms")
+    return message
+
+@mcp.tool()
+@_instrumented
+async def post_room_messages(
+    room_id: int,
+    body: str,
+    self_unread: int = 0,
+    idempotency_key: Optional[str] = None,
+    queue: int = 0,
+    profile: Optional[str] = None
+) -> Union[Message, OutboxEntry]:
+    """チャットにメッセージを投稿します
+    
+    Args:
+        room_id (int): チャットルームのID
+        body (str): メッセージの本文
+        self_unread (int, optional): 投稿したメッセージを自分の未読にするか（0: しない, 1: する）。デフォルトは0
+        idempotency_key (str, optional): 二重投稿を防ぐためのキー（アウトボックスが有効な場合のみ）
+                                        同じキーで投稿済みであれば、APIを呼ばずに前回の結果を返します
+        queue (int, optional): アウトボックスに登録してすぐに返すか（0: しない, 1: する）
+                               登録した投稿はレート制限の範囲で順に送信され、結果は get_outbox_status で確認できます
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+        
+    Returns:
+        Union[Message, OutboxEntry]: 投稿されたメッセージ情報（queue=1 の場合はアウトボックスに登録した投稿の状態）
+        
+    Raises:
+        ValueError: APIトークンが未設定、または無効な場合、またはbodyが空の場合、
+                   またはアウトボックスが無効な状態で idempotency_key か queue=1 を指定した場合
+        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+    """
+    profile = _get_profile(profile).name
+
+    if not body:
+        raise ValueError("メッセージの本文（body）は必須です")
+
+    # パラメータの準備
+    params = {
+        "body": body,
+        "self_unread": str(self_unread)
+    }
+
+    if idempotency_key is not None or queue == 1:
+        return await _post_via_outbox("message", room_id, params, idempotency_key, queue, profile)
+    return await _send_room_message(room_id, params, profile)
+
+@mcp.tool()
+@_instrumented
+async def get_outbox_status(
+    idempotency_key: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 20
+) -> OutboxStatus:
+    """アウトボックスに登録された投稿の状態を取得します（APIは呼びません）
+
+    状態は次のとおりです。
+        pending: 送信待ち（429や接続の失敗で再送を待っている場合を含む）
+        sending: 送信中
+        sent: 投稿済み（result にAPIのレスポンスが入ります）
+        failed: 投稿されなかった（同じ idempotency_key で投稿し直すと再送されます）
+        unknown: 投稿されたかどうか分からない（二重投稿を避けるため再送しません。チャットルームを確認してください）
+
+    Args:
+        idempotency_key (str, optional): 状態を確認する投稿のキー。指定した場合はその投稿のみを返します
+        status (str, optional): 指定した状態の投稿のみを返します
+        limit (int, optional): 返す最大件数（新しい順）。デフォルトは20
+
+    Returns:
+        OutboxStatus: 送信処理の状態、状態ごとの件数、投稿の一覧
+
+    Raises:
+        ValueError: アウトボックスが無効な場合、引数の値が不正な場合、または指定したキーの投稿がない場合
+    """
+    if status is not None and status not in Outbox.STATUSES:
+        raise ValueError(f"statusは{', '.join(Outbox.STATUSES)}のいずれかを指定してください")
+
+    if limit < 1:
+        raise ValueError("limitには1以上の値を指定してください")
+
+    outbox = _get_outbox()
+    if idempotency_key is not None:
+        entry = await asyncio.to_thread(outbox.get, idempotency_key)
+        if entry is None:
+            raise ValueError(f"idempotency_key「{idempotency_key}」の投稿は登録されていません")
+        entries = [entry]
+    else:
+        entries = await asyncio.to_thread(outbox.entries, status, limit)
+    return {
+        "sender_running": _outbox_sender.running,
+        "last_errors": dict(_outbox_sender.last_errors),
+        "counts": await asyncio.to_thread(outbox.counts),
+        "entries": entries
+    }
+
+def _load_sync_state(normalized_path: str) -> Dict[str, int]:
+    """前回の同期時点でのルームごとの最終更新時刻を読み込みます"""
+    state_file = Path(normalized_path) / SYNC_STATE_FILENAME
+    if not state_file.exists():
+        return {}
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f).get("rooms", {})
+    except (OSError, ValueError):
+        # 壊れた状態ファイルは無視して初回同期として扱う
+        return {}
+
+def _save_sync_state(normalized_path: str, rooms: Dict[str, int]) -> None:
+    """ルームごとの最終更新時刻を同期状態ファイルへ保存します"""
+    base_dir = Path(normalized_path)
+    base_dir.mkdir(parents=True, exist_ok=True)
+    with open(base_dir / SYNC_STATE_FILENAME, "w", encoding="utf-8") as f:
+        json.dump({"rooms": rooms}, f)
+
+async def _fetch_latest_rooms(profile: str) -> List[Room]:
+    """変更検知のため、キャッシュを使わずにルーム一覧を取得し、最新の内容でキャッシュを更新します"""
+    rooms = await _request_api("GET", "/rooms", profile=profile)
+    if CACHE_TTL_ROOMS > 0:
+        await _cache_set(_cache_key(profile, "/rooms", None), _to_records(rooms, RoomRecord), CACHE_TTL_ROOMS)
+    return rooms
+
+# 保存先ディレクトリごとの同期処理のロック（同期状態ファイルの更新が競合しないようにする）
+_sync_locks: Dict[str, asyncio.Lock] = {}
+
+async def _sync_rooms(
+    normalized_path: str, rooms: List[Room], force: int, max_concurrency: int, profile: str
+) -> SyncResult:
+    """前回の同期から更新のあったルームのメッセージを並列に取得し、同期状態を記録します
+
+    Args:
+        normalized_path (str): 正規化した保存先のパス
+        rooms (List[Room]): 対象のルーム（最新のルーム一覧から取得したもの）
+        force (int): 1の場合は更新の有無に関わらず全ルームの全メッセージを取得
+        max_concurrency (int): 同時に取得するルーム数の上限
+        profile (str): 取得に使うプロファイル名
+
+    Returns:
+        SyncResult: ルームごとのメッセージ、スキップしたルームのID、ルームごとのエラー
+    """
+    async with _sync_locks.setdefault(normalized_path, asyncio.Lock()):
+        state = _load_sync_state(normalized_path)
+        changed_rooms = []
+        skipped_room_ids = []
+        for room in rooms:
+            last_synced = state.get(str(room["room_id"]))
+            if force == 1:
+                changed = True
+            elif last_synced is None:
+                changed = room["unread_num"] > 0
+            else:
+                changed = room["last_update_time"] > last_synced
+            if changed:
+                changed_rooms.append(room)
+            else:
+                skipped_room_ids.append(room["room_id"])
+                state[str(room["room_id"])] = room["last_update_time"]
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def sync_room(room: Room) -> Tuple[Room, Optional[List[Message]], Optional[str]]:
+            async with semaphore:
+                try:
+                    messages = await _fetch_room_messages(room["room_id"], normalized_path, force, profile)
+                except (ValueError, RuntimeError) as e:
+                    return room, None, str(e)
+                except Exception as e:
+                    # 保存先への書き込み（OSError）などの失敗も、他のルームの取得と同期状態の記録を止めない
+                    return room, None, f"{type(e).__name__}: {e}"
+            return room, messages, None
+
+        results = await asyncio.gather(*(sync_room(room) for room in changed_rooms))
+
+        synced: List[RoomSyncResult] = []
+        errors: List[RoomSyncError] = []
+        for room, messages, error in results:
+            if error is not None:
+                errors.append({"room_id": room["room_id"], "name": room["name"], "error": error})
+                continue
+            synced.append({"room_id": room["room_id"], "name": room["name"], "messages": messages})
+            state[str(room["room_id"])] = room["last_update_time"]
+
+        _save_sync_state(normalized_path, state)
+
+        return {
+            "rooms": synced,
+            "skipped_room_ids": skipped_room_ids,
+            "errors": errors
+        }
+
+@mcp.tool()
+@_instrumented
+async def sync_room_messages(
+    save_dir_path: str,
+    room_ids: Optional[List[int]] = None,
+    force: int = 0,
+    max_concurrency: int = SYNC_MAX_CONCURRENCY,
+    fields: Optional[List[str]] = None,
+    compact: int = 0,
+    profile: Optional[str] = None
+) -> SyncResult:
+    """更新のあったチャットルームのメッセージをまとめて取得します
+
+    ルーム一覧の最終更新時刻（last_update_time）を前回の同期時と比較し、更新のあったルームだけを
+    並列に取得します。取得したメッセージはget_room_messagesと同じ形式で保存されます。
+    前回の同期記録がないルームは、未読（unread_num）がある場合のみ取得します。
+    同期状態は save_dir_path 配下の sync_state.json に記録されます。
+
+    Args:
         save_dir_path (str): メッセージを保存するディレクトリのパス
                             必ず事前にpwdコマンドで取得したパスを指定してください
                             Windowsの場合、C:\\Users\\...のような形式で指定してください
+        room_ids (List[int], optional): 対象とするチャットルームのIDリスト。省略時は全ルームが対象
         force (int, optional): 前回取得分からの差分を取得するか（1: 差分を取得しない, 0: 差分のみ取得）
-                             通信量削減のため、ユーザーからの指示がない限り0（デフォルト値）を必ず利用
-        
+                             1の場合は更新の有無に関わらず対象の全ルームを取得します
+        max_concurrency (int, optional): 同時に取得するルーム数の上限
+        fields (List[str], optional): 各ルームのメッセージで返す項目名のリスト（例: ["message_id", "account.name", "body"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 各ルームのメッセージを列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントは accounts に1度だけ記載し、行からはIDで参照します
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+
     Returns:
-        List[Message]: メッセージ情報のリスト（force=1の場合は保存先パスを含むメッセージのリスト）
-        
+        SyncResult: ルームごとのメッセージ、更新がなくスキップしたルームのID、ルームごとのエラー
+
     Raises:
         ValueError: APIトークンが未設定、または無効な場合、またはsave_dir_pathが未指定の場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        RuntimeError: ルーム一覧の取得でAPIリクエスト制限超過やその他のエラーが発生した場合
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    profile = _get_profile(profile).name
 
-    # save_dir_pathのバリデーションと正規化
-    if not save_dir_path or save_dir_path == "":
-        raise ValueError(
-            "save_dir_pathの指定が必要です。\n"
-            "以下の手順で実行してください：\n"
-            "1. pwdコマンドを実行してカレントディレクトリを取得\n"
-            "2. 取得したパスをsave_dir_pathに指定して再実行\n"
-            "\n"
-            "例：\n"
-            "PS> pwd\n"
-            "Path: C:\\Users\\masak\\Documents\\MEGA\\mcp\n"
-            "\n"
-            "get_room_messages(\n"
-            "    room_id=357644346,\n"
-            "    save_dir_path=\"C:\\Users\\masak\\Documents\\MEGA\\mcp\",\n"
-            "    force=0\n"
-            ")"
-        )
+    if max_concurrency < 1:
+        raise ValueError("max_concurrencyは1以上を指定してください")
 
-    # URLエンコードされたパスを適切に変換
-    normalized_path = unquote(save_dir_path)
-    
-    # Windowsパスの形式チェック
-    if os.name == 'nt' and not normalized_path.startswith(('C:\\', 'D:\\', 'E:\\')):
-        if normalized_path.startswith('/c/'):
-            # /c/... 形式を C:\... 形式に変換
-            normalized_path = f"C:{normalized_path[2:]}".replace('/', '\\')
-        else:
-            raise ValueError(
-                f"不正なパス形式です: {save_dir_path}\n"
-                "Windowsでは C:\\Users\\...のような形式で指定してください。\n"
-                "pwdコマンドで取得したパスをそのまま使用してください。"
-            )
+    normalized_path = _normalize_save_dir_path(save_dir_path)
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN
-        }
-        try:
-            async with session.get(
-                f"https://api.chatwork.com/v2/rooms/{room_id}/messages?force={force}",
-                headers=headers
-            ) as response:
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 403:
-                    raise RuntimeError("このチャットルームにアクセスする権限がありません")
-                if response.status == 404:
-                    raise RuntimeError("指定されたチャットルームが見つかりません")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}")
-                
-                messages = await response.json()
-
-                # メッセージを保存（force=1またはforce=0で差分がある場合）
-                if force == 1 or (force == 0 and messages):
-                    now = datetime.now()
-                    # 保存先ディレクトリの設定（正規化されたパスを使用）
-                    base_dir = Path(normalized_path)
-                    save_dir = base_dir / f"room_{room_id}/{now.strftime('%Y%m%d')}"
-                    save_dir.mkdir(parents=True, exist_ok=True)
-                    
-                    # ファイル名の設定（force=0の場合は差分ファイルであることを明記）
-                    filename = f"{now.strftime('%H%M')}_{'diff' if force == 0 else 'full'}.txt"
-                    save_file = save_dir / filename
-
-                    # メッセージの整形
-                    formatted_messages = []
-                    for msg in messages:
-                        # 送信時刻をJST（日本時間）に変換
-                        send_time = datetime.fromtimestamp(msg['send_time'])
-                        formatted_time = send_time.strftime('%Y-%m-%d %H:%M:%S')
-
-                        # 本文の取得（改行コードはそのまま保持）
-                        body = msg['body']
-
-                        # 投稿元URLの抽出（[info]タグ内のURL）
-                        source_url = ""
-                        if '[info]' in body and '[/info]' in body:
-                            info_start = body.find('[info]')
-                            info_end = body.find('[/info]')
-                            source_url = body[info_start+6:info_end].strip()
-                            # 本文から[info]タグを削除
-                            body = body[:info_start] + body[info_end+7:]
-
-                        # メッセージの整形
-                        formatted_msg = f"""===============================
-本文（日時：{formatted_time}）
-{body.strip()}"""
-                        if source_url:
-                            formatted_msg += f"\n投稿元：{source_url}"
-                        formatted_msg += "\n==============================="
-                        formatted_messages.append(formatted_msg)
-
-                    # ファイルに保存
-                    with open(save_file, "w", encoding="utf-8") as f:
-                        f.write("\n\n".join(formatted_messages))
-
-                    # force=1の場合のみ、システムメッセージを返す
-                    if force == 1:
-                        return [{
-                            "message_id": "system",
-                            "account": {
-                                "account_id": 0,
-                                "name": "System",
-                                "avatar_image_url": ""
-                            },
-                            "body": f"メッセージ履歴を保存しました: {save_file.absolute()}",
-                            "send_time": int(datetime.now().timestamp()),
-                            "update_time": int(datetime.now().timestamp())
-                        }]
-
-                return messages
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+    rooms = await _fetch_latest_rooms(profile)
+
+    if room_ids is not None:
+        targets = set(room_ids)
+        rooms = [room for room in rooms if room["room_id"] in targets]
+
+    result = await _sync_rooms(normalized_path, rooms, force, max_concurrency, profile)
+    for room in result["rooms"]:
+        room["messages"] = _shape_list(room["messages"], fields, compact)
+    return result
 
 @mcp.tool()
-async def get_room_message(room_id: int, message_id: int) -> Message:
-    """チャットの特定のメッセージを取得します
-    
+@_instrumented
+async def get_stored_messages(
+    room_id: int,
+    save_dir_path: str,
+    limit: int = 50,
+    since: Optional[int] = None,
+    parse_markup: int = 0,
+    fields: Optional[List[str]] = None,
+    compact: int = 0
+) -> Union[List[Message], CompactTable]:
+    """ローカルストアに蓄積済みのメッセージを取得します（APIは呼び出しません）
+
+    get_room_messages / sync_room_messages で取得したメッセージは、差分取得を含めて
+    save_dir_path 配下の messages.db に蓄積されています。このツールはそこから読み出します。
+
     Args:
         room_id (int): チャットルームのID
-        message_id (int): 取得するメッセージのID
-        
+        save_dir_path (str): get_room_messagesで指定したメッセージの保存先ディレクトリのパス
+        limit (int, optional): 取得する最大件数。デフォルトは50
+        since (int, optional): この日時（UNIXタイムスタンプ）以降に送信されたメッセージのみ取得
+                             省略時は最新のlimit件を取得
+        parse_markup (int, optional): 本文のChatWork記法を解析した構造化形式で返すか（0: しない, 1: する）
+        fields (List[str], optional): 返す項目名のリスト（例: ["message_id", "account.name", "body"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントやルームは accounts / rooms に1度だけ記載し、行からはIDで参照します
+
     Returns:
-        Message: メッセージ情報
-        
+        Union[List[Message], CompactTable]: メッセージ情報のリスト（送信日時の昇順。compact=1の場合は列形式の表）
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        ValueError: save_dir_pathが未指定の場合、またはlimitが1未満の場合
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    if limit < 1:
+        raise ValueError("limitは1以上を指定してください")
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN
-        }
-        try:
-            async with session.get(
-                f"https://api.chatwork.com/v2/rooms/{room_id}/messages/{message_id}",
-                headers=headers
-            ) as response:
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 403:
-                    raise RuntimeError("このメッセージにアクセスする権限がありません")
-                if response.status == 404:
-                    raise RuntimeError("指定されたチャットルームまたはメッセージが見つかりません")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+    normalized_path = _normalize_save_dir_path(save_dir_path)
+    store = await _get_message_store(normalized_path)
+    records = await asyncio.to_thread(store.query, room_id, limit, since)
+    messages = [record.to_dict() for record in records]
+    if parse_markup == 1:
+        messages = [_with_parsed_markup(msg) for msg in messages]
+    return _shape_list(messages, fields, compact)
 
 @mcp.tool()
-async def get_room_tasks(room_id: int) -> List[Task]:
-    """チャットルームのタスク一覧を取得します
-    
+@_instrumented
+async def search_messages(
+    query: str,
+    save_dir_path: str,
+    room_id: Optional[int] = None,
+    account_id: Optional[int] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    limit: int = 20,
+    parse_markup: int = 0,
+    fields: Optional[List[str]] = None,
+    compact: int = 0
+) -> Union[List[MessageSearchResult], CompactTable]:
+    """ローカルストアに蓄積済みのメッセージを全文検索します（APIは呼び出しません）
+
+    get_room_messages / sync_room_messages で取得したメッセージが検索対象です。
+    日本語は2文字単位で索引付けされているため、単語の区切りがなくても検索できます。
+
     Args:
-        room_id (int): チャットルームのID
-        
+        query (str): 検索語。空白で区切った場合は全ての語を含むメッセージを検索
+        save_dir_path (str): get_room_messagesで指定したメッセージの保存先ディレクトリのパス
+        room_id (int, optional): 対象とするチャットルームのID
+        account_id (int, optional): 対象とする投稿者のアカウントID
+        since (int, optional): この日時（UNIXタイムスタンプ）以降に送信されたメッセージのみ対象
+        until (int, optional): この日時（UNIXタイムスタンプ）より前に送信されたメッセージのみ対象
+        limit (int, optional): 取得する最大件数。デフォルトは20
+        parse_markup (int, optional): 本文のChatWork記法を解析した構造化形式で返すか（0: しない, 1: する）
+        fields (List[str], optional): 返す項目名のリスト（例: ["room_id", "message_id", "body"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントやルームは accounts / rooms に1度だけ記載し、行からはIDで参照します
+
     Returns:
-        List[Task]: タスク情報のリスト
-        
+        Union[List[MessageSearchResult], CompactTable]: 関連度順のメッセージ情報のリスト（ルームIDと関連度を含む）
+                                                       compact=1の場合は列形式の表
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        ValueError: queryまたはsave_dir_pathが未指定の場合、またはlimitが1未満の場合
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    if not query or not query.strip():
+        raise ValueError("検索語（query）は必須です")
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN
-        }
-        try:
-            async with session.get(
-                f"https://api.chatwork.com/v2/rooms/{room_id}/tasks",
-                headers=headers
-            ) as response:
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 403:
-                    raise RuntimeError("このチャットルームにアクセスする権限がありません")
-                if response.status == 404:
-                    raise RuntimeError("指定されたチャットルームが見つかりません")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+    if limit < 1:
+        raise ValueError("limitは1以上を指定してください")
+
+    normalized_path = _normalize_save_dir_path(save_dir_path)
+    store = await _get_message_store(normalized_path)
+    results = await asyncio.to_thread(store.search, query, limit, room_id, account_id, since, until)
+    if parse_markup == 1:
+        results = [_with_parsed_markup(result) for result in results]
+    return _shape_list(results, fields, compact)
 
 @mcp.tool()
-async def get_my_tasks(status: str = "open") -> List[Task]:
-    """自分に割り当てられたタスク一覧を取得します
-    
+@_instrumented
+async def get_archived_messages(
+    room_id: int,
+    save_dir_path: str,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    message_ids: Optional[List[str]] = None,
+    limit: int = 100,
+    parse_markup: int = 0,
+    fields: Optional[List[str]] = None,
+    compact: int = 0
+) -> Union[List[Message], CompactTable]:
+    """圧縮アーカイブに保存済みのメッセージを、送信日時の範囲やメッセージIDで取得します（APIは呼び出しません）
+
+    CHATWORK_ARCHIVE_FORMAT=compressed（または both）で get_room_messages / sync_room_messages が保存した
+    メッセージと、convert_message_archive でtxtから変換したメッセージが対象です。
+    インデックスから条件に当てはまる圧縮ブロックだけを展開するため、古い履歴でもディレクトリ全体を読みません。
+    txtから変換したメッセージは message_id と account が null で、body は記法を解析した後のテキストです。
+
     Args:
-        status (str, optional): タスクのステータス。"open"（未完了）または"done"（完了）。デフォルトは"open"
-        
+        room_id (int): チャットルームのID
+        save_dir_path (str): get_room_messagesで指定したメッセージの保存先ディレクトリのパス
+        since (int, optional): この日時（UNIXタイムスタンプ）以降に送信されたメッセージのみ取得
+                             省略時は最新のlimit件を取得
+        until (int, optional): この日時（UNIXタイムスタンプ）より前に送信されたメッセージのみ取得
+        message_ids (List[str], optional): 取得するメッセージIDのリスト
+        limit (int, optional): 取得する最大件数。デフォルトは100
+        parse_markup (int, optional): 本文のChatWork記法を解析した構造化形式で返すか（0: しない, 1: する）
+        fields (List[str], optional): 返す項目名のリスト（例: ["message_id", "account.name", "body"]）
+                                     "account.name" のようにネストした項目も指定できます。省略時は全項目
+        compact (int, optional): 列形式のコンパクトな表で返すか（0: しない, 1: する）
+                                1の場合、アカウントやルームは accounts / rooms に1度だけ記載し、行からはIDで参照します
+
     Returns:
-        List[Task]: タスク情報のリスト
-        
+        Union[List[Message], CompactTable]: メッセージ情報のリスト（送信日時の昇順。compact=1の場合は列形式の表）
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合、またはstatusの値が不正な場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        ValueError: save_dir_pathが未指定の場合、limitが1未満の場合、message_idsが数値でない場合、
+                    またはルームの圧縮アーカイブがない場合
+        RuntimeError: アーカイブが壊れている場合
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    if limit < 1:
+        raise ValueError("limitは1以上を指定してください")
+    ids = None
+    if message_ids:
+        try:
+            ids = [int(message_id) for message_id in message_ids]
+        except ValueError:
+            raise ValueError("message_idsには数値のメッセージIDを指定してください")
 
-    if status not in ["open", "done"]:
-        raise ValueError('statusは"open"または"done"を指定してください')
+    normalized_path = _normalize_save_dir_path(save_dir_path)
+    archive = _get_message_archive(normalized_path, room_id)
+    if not archive.index_path.exists():
+        raise ValueError(
+            f"ルーム{room_id}の圧縮アーカイブがありません: {archive.data_path}\n"
+            "CHATWORK_ARCHIVE_FORMAT=compressed（または both）で取得するか、convert_message_archive で変換してください。"
+        )
+    started = time.perf_counter()
+    messages, _ = await asyncio.to_thread(archive.query, since, until, ids, limit)
+    _metrics.observe_phase("archive_read", time.perf_counter() - started)
+    if parse_markup == 1:
+        messages = [_with_parsed_markup(msg) for msg in messages]
+    return _shape_list(messages, fields, compact)
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN
-        }
-        try:
-            async with session.get(
-                f"https://api.chatwork.com/v2/my/tasks?status={status}",
-                headers=headers
-            ) as response:
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+def _convert_room_archive(normalized_path: str, room_id: int, store: Optional[MessageStore], remove_txt: bool) -> ArchiveConversion:
+    """ルームのtxtファイルを圧縮アーカイブに変換します（ワーカースレッドで実行）"""
+    room_dir = Path(normalized_path) / f"room_{room_id}"
+    txt_files = sorted(
+        txt_file
+        for day_dir in room_dir.iterdir() if day_dir.is_dir() and len(day_dir.name) == 8 and day_dir.name.isdigit()
+        for txt_file in day_dir.glob("*.txt")
+    )
+    # 全件保存と差分保存のファイルには同じメッセージが重複して含まれる
+    entries: Dict[Tuple[int, str], None] = {}
+    for txt_file in txt_files:
+        for entry in _parse_message_file(txt_file.read_text(encoding="utf-8")):
+            entries.setdefault(entry)
+    txt_messages = len(entries)
+
+    # ローカルストアにあるメッセージは、IDや投稿者を含む元の形式で格納する
+    messages: List[Dict[str, Any]] = []
+    if store is not None:
+        for record in store.query(room_id, sys.maxsize, 0):
+            # 以前のバージョンで保存したファイルは、記法を残したままの形式で書かれている
+            entries.pop((record.send_time, _format_message_text(record.body)), None)
+            entries.pop((record.send_time, _format_legacy_message_text(record.body)), None)
+            messages.append(record.to_dict())
+    messages.extend(
+        {"message_id": None, "account": None, "body": text, "send_time": send_time, "update_time": send_time}
+        for send_time, text in entries
+    )
+    messages.sort(key=lambda message: message["send_time"])
+
+    archive = _get_message_archive(normalized_path, room_id)
+    appended = archive.append(messages)
+    txt_bytes = sum(txt_file.stat().st_size for txt_file in txt_files)
+    if remove_txt:
+        for txt_file in txt_files:
+            txt_file.unlink()
+        for day_dir in {txt_file.parent for txt_file in txt_files}:
+            with suppress(OSError):
+                day_dir.rmdir()  # 空になった日付ディレクトリのみ削除
+    return {
+        "room_id": room_id,
+        "txt_files": len(txt_files),
+        "txt_bytes": txt_bytes,
+        "messages": txt_messages,
+        "appended": appended,
+        "archive_bytes": archive.size,
+        "removed_txt": remove_txt
+    }
 
 @mcp.tool()
-async def post_room_tasks(
-    room_id: int,
-    body: str,
-    to_ids: List[int],
-    limit: Optional[int] = None,
-    limit_type: str = "date"
-) -> Task:
-    """チャットルームにタスクを作成します
-    
+@_instrumented
+async def convert_message_archive(
+    save_dir_path: str,
+    room_id: Optional[int] = None,
+    remove_txt: int = 0
+) -> List[ArchiveConversion]:
+    """保存済みのtxtファイル（room_*/YYYYMMDD/*.txt）を圧縮アーカイブに変換します（APIは呼び出しません）
+
+    全件保存と差分保存のファイルに重複して含まれるメッセージは1件にまとめます。
+    ローカルストア（messages.db）に同じメッセージがある場合は、メッセージIDや投稿者を含む元の形式で格納します。
+    既にアーカイブがある場合は、まだ含まれていないメッセージだけを追加します（何度実行しても重複しません）。
+
     Args:
-        room_id (int): チャットルームのID
-        body (str): タスクの内容
-        to_ids (List[int]): タスクの担当者のアカウントIDリスト
-        limit (int, optional): タスクの期限（UNIXタイムスタンプ）
-        limit_type (str, optional): 期限の種類。"date"（日付）または"time"（時間）。デフォルトは"date"
-        
+        save_dir_path (str): get_room_messagesで指定したメッセージの保存先ディレクトリのパス
+        room_id (int, optional): 変換するチャットルームのID。省略時は保存先の全ルーム
+        remove_txt (int, optional): 変換後にtxtファイルを削除するか（0: しない, 1: する）
+
     Returns:
-        Task: 作成されたタスク情報
-        
+        List[ArchiveConversion]: ルームごとの変換結果（変換前後のサイズを含む）
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合、またはlimit_typeの値が不正な場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        ValueError: save_dir_pathが未指定の場合、または指定したルームのtxtファイルがない場合
+        RuntimeError: 既存のアーカイブが壊れている場合
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    normalized_path = _normalize_save_dir_path(save_dir_path)
+    base_dir = Path(normalized_path)
+    if room_id is not None:
+        room_ids = [room_id]
+        if not (base_dir / f"room_{room_id}").is_dir():
+            raise ValueError(f"ルーム{room_id}の保存済みファイルがありません: {base_dir / f'room_{room_id}'}")
+    else:
+        room_ids = sorted(
+            int(room_dir.name[len("room_"):]) for room_dir in base_dir.glob("room_*")
+            if room_dir.is_dir() and room_dir.name[len("room_"):].isdigit()
+        )
+    # ローカルストアは既にある場合だけ使う（変換のためにデータベースを作らない）
+    store = await _get_message_store(normalized_path) if (base_dir / MESSAGE_STORE_FILENAME).exists() else None
+    results = []
+    for target in room_ids:
+        results.append(await asyncio.to_thread(_convert_room_archive, normalized_path, target, store, remove_txt == 1))
+    return results
 
-    if limit_type not in ["date", "time"]:
-        raise ValueError('limit_typeは"date"または"time"を指定してください')
+async def _run_batch(
+    operations: List[Dict[str, Any]],
+    handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+    max_concurrency: int,
+    profile: str
+) -> BatchResult:
+    """操作のリストを同時実行数を制限して実行し、操作ごとの結果をまとめます
 
-    if not body:
-        raise ValueError("タスクの内容（body）は必須です")
+    1件の失敗で全体を中断せず、失敗した操作はエラーメッセージとして結果に含めます。
+    他の操作は送信済みのことがあるため、形式の誤りなど想定外の例外も操作ごとの失敗として扱います。
+    同時実行数はプロファイル（各要素の "profile"、省略時は profile）ごとに数えるため、
+    レート制限で待たされているプロファイルの操作が、他のプロファイルの操作の枠を塞ぐことはありません。
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrencyは1以上を指定してください")
 
-    if not to_ids:
-        raise ValueError("タスクの担当者（to_ids）は必須です")
+    semaphores: Dict[str, asyncio.Semaphore] = {}
 
-    # パラメータの準備
-    params = {
-        "body": body,
-        "limit_type": limit_type,
-        # to_idsをカンマ区切りの文字列に変換
-        "to_ids": ",".join(str(id) for id in to_ids)
-    }
+    async def run(index: int, operation: Any) -> BatchItemResult:
+        if not isinstance(operation, dict):
+            return {"index": index, "ok": False, "error": f"各要素は辞書で指定してください（{type(operation).__name__} が指定されました）"}
+        lane = str(operation.get("profile") or profile).lower()
+        async with semaphores.setdefault(lane, asyncio.Semaphore(max_concurrency)):
+            try:
+                result = await handler(operation)
+            except (ValueError, RuntimeError) as e:
+                return {"index": index, "ok": False, "error": str(e)}
+            except Exception as e:
+                return {"index": index, "ok": False, "error": f"{type(e).__name__}: {e}"}
+        return {"index": index, "ok": True, "result": result}
 
-    # limitの処理（文字列として追加）
-    if limit is not None:
-        params["limit"] = str(limit)
+    results = await asyncio.gather(*(run(i, operation) for i, operation in enumerate(operations)))
+    succeeded = sum(1 for result in results if result["ok"])
+    return {
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": list(results)
+    }
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN,
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        try:
-            async with session.post(
-                f"https://api.chatwork.com/v2/rooms/{room_id}/tasks",
-                headers=headers,
-                data=params
-            ) as response:
-                if response.status == 400:
-                    error_body = await response.text()
-                    raise RuntimeError(f"リクエストが不正です: {error_body}")
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 403:
-                    raise RuntimeError("このチャットルームにアクセスする権限がありません")
-                if response.status == 404:
-                    raise RuntimeError("指定されたチャットルームが見つかりません")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    error_body = await response.text()
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}, 詳細: {error_body}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+def _require_operation_key(operation: Dict[str, Any], key: str) -> Any:
+    """一括操作の各要素から必須の項目を取り出します"""
+    if key not in operation:
+        raise ValueError(f"{key}は必須です")
+    return operation[key]
 
 @mcp.tool()
-async def get_room_task(room_id: int, task_id: int) -> Task:
-    """チャットルームの特定のタスクを取得します
-    
+@_instrumented
+async def post_room_tasks_batch(
+    tasks: List[Dict[str, Any]],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    profile: Optional[str] = None
+) -> BatchResult:
+    """複数のタスクをまとめて作成します
+
+    各タスクはpost_room_tasksと同じ項目を持つ辞書で指定します。同じタスクを複数のルームに
+    作成する場合は、room_idだけを変えた要素を並べてください。レート制限の範囲内で並列に作成し、
+    一部が失敗しても残りのタスクの作成は続けます。
+
     Args:
-        room_id (int): チャットルームのID
-        task_id (int): タスクのID
-        
+        tasks (List[Dict[str, Any]]): 作成するタスクのリスト。各要素の項目は次のとおり
+                                     room_id (int): チャットルームのID（必須）
+                                     body (str): タスクの内容（必須）
+                                     to_ids (List[int]): タスクの担当者のアカウントIDリスト（必須）
+                                     limit (int, optional): タスクの期限（UNIXタイムスタンプ）
+                                     limit_type (str, optional): "date" または "time"。デフォルトは"date"
+                                     idempotency_key (str, optional): 二重作成を防ぐためのキー
+                                     queue (int, optional): アウトボックスに登録してすぐに返すか（0: しない, 1: する）
+                                     profile (str, optional): このタスクの作成に使うプロファイル名
+        max_concurrency (int, optional): 同時に作成するタスク数の上限（プロファイルごと）
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+
     Returns:
-        Task: タスク情報
-        
+        BatchResult: 成功・失敗の件数と、タスクごとの結果（作成されたタスク情報またはエラー）
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        ValueError: APIトークンが未設定の場合、またはtasksが空の場合
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    profile = _get_profile(profile).name
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN
-        }
-        try:
-            async with session.get(
-                f"https://api.chatwork.com/v2/rooms/{room_id}/tasks/{task_id}",
-                headers=headers
-            ) as response:
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 403:
-                    raise RuntimeError("このタスクにアクセスする権限がありません")
-                if response.status == 404:
-                    raise RuntimeError("指定されたチャットルームまたはタスクが見つかりません")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+    if not tasks:
+        raise ValueError("作成するタスク（tasks）を1件以上指定してください")
+
+    async def create(operation: Dict[str, Any]) -> Union[Task, OutboxEntry]:
+        to_ids = _require_operation_key(operation, "to_ids")
+        if not isinstance(to_ids, list) or not all(
+            isinstance(to_id, (int, str)) and not isinstance(to_id, bool) and str(to_id).isdigit() for to_id in to_ids
+        ):
+            raise ValueError("to_idsはアカウントID（整数）のリストで指定してください")
+        return await _post_room_tasks(
+            room_id=_require_operation_key(operation, "room_id"),
+            body=_require_operation_key(operation, "body"),
+            to_ids=to_ids,
+            limit=operation.get("limit"),
+            limit_type=operation.get("limit_type", "date"),
+            idempotency_key=operation.get("idempotency_key"),
+            queue=operation.get("queue", 0),
+            profile=operation.get("profile", profile)
+        )
+
+    return await _run_batch(tasks, create, max_concurrency, profile)
 
 @mcp.tool()
-async def put_room_task_status(room_id: int, task_id: int, status: str = "done") -> Task:
-    """チャットルームのタスクの状態を更新します
-    
+@_instrumented
+async def put_room_task_status_batch(
+    updates: List[Dict[str, Any]],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    profile: Optional[str] = None
+) -> BatchResult:
+    """複数のタスクの状態をまとめて更新します
+
+    レート制限の範囲内で並列に更新し、一部が失敗しても残りのタスクの更新は続けます。
+
     Args:
-        room_id (int): チャットルームのID
-        task_id (int): タスクのID
-        status (str, optional): タスクの新しい状態。"open"（未完了）または"done"（完了）。デフォルトは"done"
-        
+        updates (List[Dict[str, Any]]): 更新するタスクのリスト。各要素の項目は次のとおり
+                                       room_id (int): チャットルームのID（必須）
+                                       task_id (int): タスクのID（必須）
+                                       status (str, optional): "open" または "done"。デフォルトは"done"
+                                       profile (str, optional): この更新に使うプロファイル名
+        max_concurrency (int, optional): 同時に更新するタスク数の上限（プロファイルごと）
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+
     Returns:
-        Task: 更新されたタスク情報
-        
+        BatchResult: 成功・失敗の件数と、タスクごとの結果（更新されたタスク情報またはエラー）
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合、またはstatusの値が不正な場合
-        RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
+        ValueError: APIトークンが未設定の場合、またはupdatesが空の場合
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    profile = _get_profile(profile).name
 
-    if status not in ["open", "done"]:
-        raise ValueError('statusは"open"または"done"を指定してください')
+    if not updates:
+        raise ValueError("更新するタスク（updates）を1件以上指定してください")
 
-    # パラメータの準備（bodyパラメータにステータスを設定）
-    params = {
-        "body": status  # APIの仕様に従い、bodyパラメータにステータスを設定
-    }
+    async def update(operation: Dict[str, Any]) -> Task:
+        return await _put_room_task_status(
+            room_id=_require_operation_key(operation, "room_id"),
+            task_id=_require_operation_key(operation, "task_id"),
+            status=operation.get("status", "done"),
+            profile=operation.get("profile", profile)
+        )
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN,
-            "Content-Type": "application/x-www-form-urlencoded"
+    return await _run_batch(updates, update, max_concurrency, profile)
+
+def _summarize_unread(rooms: List[Room], updated_at: Optional[int], watching: bool, last_error: Optional[str]) -> UnreadSummary:
+    """ルーム一覧から未読・メンションのあるルームをまとめます"""
+    unread_rooms: List[RoomUnread] = [
+        {
+            "room_id": room["room_id"],
+            "name": room["name"],
+            "unread_num": room["unread_num"],
+            "mention_num": room["mention_num"],
+            "mytask_num": room["mytask_num"],
+            "last_update_time": room["last_update_time"]
         }
+        for room in rooms
+        if room["unread_num"] > 0 or room["mention_num"] > 0
+    ]
+    unread_rooms.sort(key=lambda room: (room["mention_num"], room["unread_num"]), reverse=True)
+    return {
+        "total_unread": sum(room["unread_num"] for room in rooms),
+        "total_mentions": sum(room["mention_num"] for room in rooms),
+        "rooms": unread_rooms,
+        "updated_at": updated_at,
+        "watching": watching,
+        "last_error": last_error
+    }
+
+class RoomWatcher:
+    """ルーム一覧を定期的に取得し、未読・メンションの状態をメモリ上に保持するバックグラウンド処理
+
+    ルーム一覧は1回の呼び出しで全ルーム分が得られるため、ポーリング間隔はサーバー全体で調整します。
+    いずれかのルームの最終更新時刻が進んでいれば最短の間隔に戻し、変化がなければ最長の間隔まで
+    倍々に延ばします。保存先（CHATWORK_WATCH_SAVE_DIR）が指定されている場合は、更新のあった
+    ルームだけメッセージの差分を取得し、sync_room_messagesと同じ形式で保存します。
+    監視には profile を省略した場合のプロファイル（CHATWORK_DEFAULT_PROFILE）を使います。
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, save_dir: Optional[str]):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.save_dir = save_dir
+        self.interval = min_interval
+        self.rooms: List[Room] = []
+        self.updated_at: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.running = False
+        self._last_update_times: Dict[int, int] = {}
+
+    async def run(self) -> None:
+        """キャンセルされるまでポーリングを続けます"""
+        normalized_path = None
+        if self.save_dir:
+            try:
+                normalized_path = _normalize_save_dir_path(self.save_dir)
+            except ValueError as e:
+                # 保存先が不正な場合は差分の取得を行わず、未読状態の監視だけを続ける
+                self.last_error = str(e)
+        self.running = True
         try:
-            async with session.put(
-                f"https://api.chatwork.com/v2/rooms/{room_id}/tasks/{task_id}/status",
-                headers=headers,
-                data=params
-            ) as response:
-                if response.status == 400:
-                    error_body = await response.text()
-                    raise RuntimeError(f"リクエストが不正です: {error_body}")
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 403:
-                    raise RuntimeError("このタスクにアクセスする権限がありません")
-                if response.status == 404:
-                    raise RuntimeError("指定されたチャットルームまたはタスクが見つかりません")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    error_body = await response.text()
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}, 詳細: {error_body}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+            while True:
+                try:
+                    changed = await self.poll(normalized_path)
+                    self.last_error = None
+                except (ValueError, RuntimeError) as e:
+                    # エラー時も監視は止めず、間隔を延ばして再試行する
+                    changed = False
+                    self.last_error = str(e)
+                except Exception as e:
+                    # 保存先への書き込み（OSError）やローカルストア（sqlite3.Error）の失敗でも監視は止めない
+                    logger.exception("未読の監視でエラーが発生しました")
+                    changed = False
+                    self.last_error = f"{type(e).__name__}: {e}"
+                self.interval = self.min_interval if changed else min(self.interval * 2, self.max_interval)
+                await asyncio.sleep(self.interval)
+        finally:
+            self.running = False
+
+    async def poll(self, normalized_path: Optional[str]) -> bool:
+        """ルーム一覧を1回取得し、前回から更新のあったルームがあるかを返します"""
+        rooms = await _fetch_latest_rooms(DEFAULT_PROFILE)
+        first_poll = self.updated_at is None
+        changed_rooms = [
+            room for room in rooms
+            if self._last_update_times.get(room["room_id"]) != room["last_update_time"]
+        ]
+        self.rooms = rooms
+        self.updated_at = int(time.time())
+        self._last_update_times = {room["room_id"]: room["last_update_time"] for room in rooms}
+
+        if normalized_path is not None and (first_poll or changed_rooms):
+            # 初回は同期状態ファイルと比較し、以降は更新のあったルームだけを対象にする
+            await _sync_rooms(normalized_path, rooms if first_poll else changed_rooms, 0, SYNC_MAX_CONCURRENCY, DEFAULT_PROFILE)
+        return bool(changed_rooms) and not first_poll
+
+    def summary(self) -> UnreadSummary:
+        return _summarize_unread(self.rooms, self.updated_at, self.running, self.last_error)
+
+# サーバー全体で共有する未読監視（lifespanで起動）
+_room_watcher = RoomWatcher(WATCH_MIN_INTERVAL, WATCH_MAX_INTERVAL, WATCH_SAVE_DIR)
+
+async def _get_unread_summary(profile: str) -> UnreadSummary:
+    """監視中であればメモリ上の状態から、そうでなければルーム一覧から未読状態をまとめます"""
+    if profile != DEFAULT_PROFILE:
+        # 監視しているのは既定のプロファイルのみ
+        rooms = await _request_api("GET", "/rooms", cache_ttl=CACHE_TTL_ROOMS, model=RoomRecord, profile=profile)
+        return _summarize_unread(rooms, int(time.time()), False, None)
+    if _room_watcher.updated_at is not None:
+        return _room_watcher.summary()
+    rooms = await _request_api("GET", "/rooms", cache_ttl=CACHE_TTL_ROOMS, model=RoomRecord, profile=profile)
+    return _summarize_unread(rooms, int(time.time()), _room_watcher.running, _room_watcher.last_error)
 
 @mcp.tool()
-async def post_room_messages(room_id: int, body: str, self_unread: int = 0) -> Message:
-    """チャットにメッセージを投稿します
-    
+@_instrumented
+async def get_unread_summary(profile: Optional[str] = None) -> UnreadSummary:
+    """全ルームの未読・メンションの状況をまとめて取得します
+
+    バックグラウンド監視（CHATWORK_WATCH_ENABLED=1）が有効な場合は、APIを呼ばずに
+    メモリ上の最新の状態を返します（既定のプロファイルのみ）。無効な場合はルーム一覧（キャッシュ済みであればそれ）から集計します。
+
     Args:
-        room_id (int): チャットルームのID
-        body (str): メッセージの本文
-        self_unread (int, optional): 投稿したメッセージを自分の未読にするか（0: しない, 1: する）。デフォルトは0
-        
+        profile (str, optional): 使用するプロファイル名（CHATWORK_API_TOKEN_<名前> の<名前>を小文字で）。省略時は CHATWORK_DEFAULT_PROFILE
+
     Returns:
-        Message: 投稿されたメッセージ情報
-        
+        UnreadSummary: 未読数・メンション数の合計と、未読またはメンションのあるルームの一覧
+
     Raises:
-        ValueError: APIトークンが未設定、または無効な場合、またはbodyが空の場合
+        ValueError: APIトークンが未設定、または無効な場合
         RuntimeError: APIリクエスト制限超過時やその他のエラー発生時
     """
-    if not CHATWORK_API_TOKEN:
-        raise ValueError("ChatWork APIトークンが設定されていません。環境変数 CHATWORK_API_TOKEN を設定してください。")
+    profile = _get_profile(profile).name
 
-    if not body:
-        raise ValueError("メッセージの本文（body）は必須です")
+    return await _get_unread_summary(profile)
 
-    # パラメータの準備
-    params = {
-        "body": body,
-        "self_unread": str(self_unread)
-    }
+@mcp.resource("chatwork://unread", name="unread_summary", mime_type="application/json")
+async def unread_summary_resource() -> str:
+    """全ルームの未読・メンションの状況（get_unread_summaryと同じ内容、既定のプロファイル）"""
+    profile = _get_profile().name
 
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "X-ChatWorkToken": CHATWORK_API_TOKEN,
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        try:
-            async with session.post(
-                f"https://api.chatwork.com/v2/rooms/{room_id}/messages",
-                headers=headers,
-                data=params
-            ) as response:
-                if response.status == 400:
-                    error_body = await response.text()
-                    raise RuntimeError(f"リクエストが不正です: {error_body}")
-                if response.status == 401:
-                    raise ValueError("APIトークンが無効です")
-                if response.status == 403:
-                    raise RuntimeError("このチャットルームにアクセスする権限がありません")
-                if response.status == 404:
-                    raise RuntimeError("指定されたチャットルームが見つかりません")
-                if response.status == 429:
-                    raise RuntimeError("APIリクエスト制限を超過しました（5分あたり300リクエスト）")
-                if not response.ok:
-                    error_body = await response.text()
-                    raise RuntimeError(f"APIエラー: ステータスコード {response.status}, 詳細: {error_body}")
-                
-                return await response.json()
-        except aiohttp.ClientError as e:
-            raise RuntimeError(f"ネットワークエラー: {str(e)}")
+    return _get_json_codec().dumps(await _get_unread_summary(profile))
+
+@mcp.tool()
+async def get_server_metrics() -> ServerMetrics:
+    """MCPサーバーの性能指標を取得します
+
+    ツールごとの実行時間（p50/p90/p99）と失敗件数、HTTPリクエストの段階ごとの所要時間
+    （接続待ち・DNS・接続・サーバー応答・読み込みとデコード・ローカルストアとファイルへの書き込み）、
+    ステータスコードごとのレスポンス件数、キャッシュの利用状況、レート制限の残量を返します。
+    APIへのリクエストは行いません。
+
+    Returns:
+        ServerMetrics: サーバー起動以降の集計値
+    """
+    return await _metrics.snapshot()
+
+@mcp.resource("chatwork://metrics", name="server_metrics", mime_type="text/plain")
+async def server_metrics_resource() -> str:
+    """MCPサーバーの性能指標（Prometheusのテキスト形式）"""
+    return await _metrics.to_prometheus()
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """HTTPトランスポートで、リクエストを受けたワーカーの性能指標をPrometheusのテキスト形式で返します"""
+    return PlainTextResponse(await _metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+@mcp.custom_route("/healthz", methods=["GET"])
+async def healthz_endpoint(request: Request) -> JSONResponse:
+    """HTTPトランスポートで、リクエストを受けたワーカーの状態を返します（ロードバランサーの死活監視用）"""
+    return JSONResponse({
+        "status": "ok",
+        "pid": os.getpid(),
+        "shared_state": str(_shared_state.db_path) if _shared_state is not None else None,
+        "background_leader": _background_leader.active
+    })
+
+def create_http_app() -> Starlette:
+    """HTTPトランスポート（CHATWORK_MCP_TRANSPORT）のASGIアプリケーションを生成します
+
+    uvicorn のワーカーごとに呼ばれます。ワーカーが複数の場合はリクエストがどのワーカーに届くか決まらないため、
+    streamable-http をステートレス（MCPのセッションをワーカーのメモリに持たない）で動かします。
+    HTTPセッションやバックグラウンド処理は、MCPのセッションごとではなくワーカーの起動から終了まで保持します。
+
+    Returns:
+        Starlette: MCPのエンドポイント（/mcp または /sse, /messages/）と /metrics, /healthz を持つアプリケーション
+
+    Raises:
+        ValueError: CHATWORK_MCP_TRANSPORT の値が不正な場合、または sse で複数のワーカーを指定した場合
+    """
+    if MCP_TRANSPORT == "streamable-http":
+        mcp.settings.stateless_http = MCP_WORKERS > 1
+        app = mcp.streamable_http_app()
+    elif MCP_TRANSPORT == "sse":
+        if MCP_WORKERS > 1:
+            raise ValueError("sse はワーカー間でセッションを共有できないため、CHATWORK_MCP_WORKERS は1にしてください（複数の場合は streamable-http）。")
+        app = mcp.sse_app()
+    else:
+        raise ValueError(f"CHATWORK_MCP_TRANSPORT の値が不正です: {MCP_TRANSPORT}（stdio, streamable-http, sse のいずれか）")
+    transport_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def worker_lifespan(app: Starlette) -> AsyncIterator[None]:
+        async with lifespan(mcp), transport_lifespan(app):
+            yield
+
+    app.router.lifespan_context = worker_lifespan
+    return app
+
+def _run_http_server() -> None:
+    """HTTPトランスポートでサーバーを起動します
+
+    CHATWORK_MCP_WORKERS が2以上の場合は uvicorn のワーカープロセスを起動します。ワーカーはこのモジュールを
+    読み込み直すため、共有状態のパス（未指定の場合は一時ディレクトリ）は環境変数で引き継ぎます。
+    """
+    import uvicorn
+    log_level = mcp.settings.log_level.lower()
+    if MCP_WORKERS <= 1:
+        uvicorn.run(create_http_app(), host=MCP_HOST, port=MCP_PORT, log_level=log_level)
+        return
+    if MCP_TRANSPORT != "streamable-http":
+        raise ValueError("CHATWORK_MCP_WORKERS を2以上にする場合は、CHATWORK_MCP_TRANSPORT を streamable-http にしてください。")
+    os.environ.setdefault("CHATWORK_SHARED_STATE_PATH", os.path.join(tempfile.gettempdir(), f"chatwork_mcp_{MCP_PORT}.db"))
+    uvicorn.run(
+        "chatwork_mcp:create_http_app", factory=True,
+        host=MCP_HOST, port=MCP_PORT, workers=MCP_WORKERS, log_level=log_level
+    )
 
 if __name__ == "__main__":
-    mcp.run(transport="stdio") 
\ No newline at end of file
+    if MCP_TRANSPORT == "stdio":
+        mcp.run(transport="stdio")
+    else:
+        _run_http_server() 
\ No newline at end of file